@@ -0,0 +1,85 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+from app.metrics import observe_handler
+from typing import Optional
+
+# ========================
+# ДАННЫЕ INLINE-КНОПОК
+# ========================
+# Короткие префиксы: callback_data ограничена 64 байтами
+class CategoryCallback(CallbackData, prefix='c'):
+    category_id: int
+
+class ItemCallback(CallbackData, prefix='i'):
+    item_id: int
+
+class ItemsPageCallback(CallbackData, prefix='ip'):
+    category_id: int
+    direction: str = 'next'
+    cursor: Optional[int] = None
+
+class BuyCallback(CallbackData, prefix='b'):
+    item_id: int
+
+class TicketCallback(CallbackData, prefix='t'):
+    ticket_id: int
+
+class TicketAnswerCallback(CallbackData, prefix='ta'):
+    ticket_id: int
+
+class OrderCallback(CallbackData, prefix='o'):
+    order_id: int
+
+class OrderAnswerCallback(CallbackData, prefix='oa'):
+    order_id: int
+
+class TicketsPageCallback(CallbackData, prefix='tp'):
+    status: str
+    direction: str = 'next'
+    cursor: Optional[int] = None
+
+class OrdersPageCallback(CallbackData, prefix='op'):
+    status: str
+    direction: str = 'next'
+    cursor: Optional[int] = None
+
+# ========================
+# ТАБЛИЦА ОБРАБОТЧИКОВ
+# ========================
+class CallbackTable:
+    """
+    Диспетчеризация нажатий через одну таблицу "префикс -> обработчик":
+    - Ключ - префикс CallbackData или вся строка для простых кнопок ('buy_payment')
+    - Обработчик получает распакованные данные в аргументе callback_data
+    - Стоимость поиска не зависит от количества обработчиков
+    """
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, key):
+        """Регистрация обработчика для класса CallbackData или строки"""
+        def decorator(callback):
+            if isinstance(key, str):
+                self.handlers[key] = (CallableObject(callback), None)
+            else:
+                self.handlers[key.__prefix__] = (CallableObject(callback), key)
+            return callback
+        return decorator
+
+    async def dispatch(self, callback: CallbackQuery, **data):
+        """Вызов обработчика по префиксу callback.data"""
+        prefix = (callback.data or '').split(':', 1)[0]
+        entry = self.handlers.get(prefix)
+        if entry is None:
+            raise SkipHandler()
+        handler, factory = entry
+        if factory is not None:
+            data['callback_data'] = factory.unpack(callback.data)
+        with observe_handler(handler.callback.__name__):
+            return await handler.call(callback, **data)
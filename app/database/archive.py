@@ -0,0 +1,127 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from sqlalchemy import select, insert, delete, func, or_, literal, DateTime
+from app.database.models import engine, Ticket, Order, TicketArchive, OrderArchive
+from app.metrics import registry
+from os import getenv
+import asyncio
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+# Период запуска архивации в секундах (0 - архивация выключена)
+ARCHIVE_INTERVAL = float(getenv('ARCHIVE_INTERVAL', '3600'))
+# Выполненные заказы и отвеченные тикеты старше этого числа дней переносятся в архив
+ARCHIVE_ORDERS_AFTER_DAYS = int(getenv('ARCHIVE_ORDERS_AFTER_DAYS', '30'))
+ARCHIVE_TICKETS_AFTER_DAYS = int(getenv('ARCHIVE_TICKETS_AFTER_DAYS', '7'))
+ARCHIVE_BATCH_SIZE = int(getenv('ARCHIVE_BATCH_SIZE', '1000'))
+
+archived_rows = registry.counter('bot_archived_rows_total', 'Rows moved to archive tables', ['table'])
+
+# ========================
+# ПЕРЕНОС В АРХИВ
+# ========================
+async def _archive_batch(model, archive_model, condition, batch_size: int) -> int:
+    """
+    Перенос одной пачки строк одной транзакцией: INSERT ... SELECT в архив и DELETE.
+    Строка с максимальным ID не переносится - иначе SQLite выдаст ее ID новой записи
+    """
+    async with engine.begin() as conn:
+        query = (
+            select(model.id)
+            .where(condition, model.id < select(func.max(model.id)).scalar_subquery())
+            .order_by(model.id)
+            .limit(batch_size)
+        )
+        if conn.dialect.name == 'postgresql':
+            # Параллельный архиватор (другой процесс) пропускает уже взятые строки
+            query = query.with_for_update(skip_locked=True)
+        ids = (await conn.scalars(query)).all()
+        if not ids:
+            return 0
+        columns = [column.name for column in model.__table__.columns]
+        await conn.execute(insert(archive_model).from_select(
+            columns + ['archived_at'],
+            select(*model.__table__.columns, literal(datetime.datetime.now(), DateTime)).where(model.id.in_(ids))
+        ))
+        await conn.execute(delete(model).where(model.id.in_(ids)))
+    archived_rows.inc(model.__tablename__, amount=len(ids))
+    return len(ids)
+
+async def _archive_table(model, archive_model, condition, batch_size: int) -> int:
+    """Перенос всех подходящих строк пачками (между пачками блокировки отпускаются)"""
+    total = 0
+    while True:
+        moved = await _archive_batch(model, archive_model, condition, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+
+async def archive_once(batch_size: int = ARCHIVE_BATCH_SIZE) -> dict:
+    """Один проход архивации: выполненные заказы и отвеченные тикеты"""
+    now = datetime.datetime.now()
+    orders_before = now - datetime.timedelta(days=ARCHIVE_ORDERS_AFTER_DAYS)
+    tickets_before = now - datetime.timedelta(days=ARCHIVE_TICKETS_AFTER_DAYS)
+    # Старые записи без времени создания считаются давними
+    return {
+        'orders': await _archive_table(
+            Order, OrderArchive,
+            (Order.status == 'completed') & or_(Order.created_at < orders_before, Order.created_at.is_(None)),
+            batch_size
+        ),
+        'tickets': await _archive_table(
+            Ticket, TicketArchive,
+            (Ticket.status == 'completed') & or_(Ticket.created_at < tickets_before, Ticket.created_at.is_(None)),
+            batch_size
+        )
+    }
+
+# ========================
+# ФОНОВАЯ АРХИВАЦИЯ
+# ========================
+class Archiver:
+    """
+    Периодический перенос завершенных заказов и тикетов в архивные таблицы:
+    рабочие таблицы остаются маленькими, а поиск по ID (get_order_info,
+    get_ticket_info) при промахе смотрит в архив
+    """
+
+    def __init__(self, interval: float = ARCHIVE_INTERVAL, batch_size: int = ARCHIVE_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Запуск фоновой архивации (при ARCHIVE_INTERVAL=0 - ничего не делает)"""
+        if self.interval > 0 and not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                moved = await archive_once(self.batch_size)
+                if any(moved.values()):
+                    logger.info('Archived: %s', moved)
+            except Exception:
+                logger.exception('Archiving failed')
+            await asyncio.sleep(self.interval)
+
+    async def close(self) -> None:
+        """Остановка (незавершенная пачка откатывается вместе с транзакцией)"""
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+archiver = Archiver()
@@ -0,0 +1,196 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from sqlalchemy import update
+from app.database.models import async_session
+from app.metrics import registry, COUNT_BUCKETS
+from collections import Counter
+from os import getenv
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+# WRITE_BATCHING=1 включает отложенную пакетную запись заказов, тикетов и статусов
+WRITE_BATCHING = getenv('WRITE_BATCHING', '0') == '1'
+WRITE_BATCH_SIZE = int(getenv('WRITE_BATCH_SIZE', '100'))
+WRITE_BATCH_WINDOW = float(getenv('WRITE_BATCH_WINDOW_MS', '20')) / 1000
+
+_STOP = object()
+
+batch_size_histogram = registry.histogram(
+    'bot_write_batch_size', 'Operations per batched transaction', buckets=COUNT_BUCKETS + (200, 500)
+)
+
+# ========================
+# ПАКЕТНАЯ ЗАПИСЬ
+# ========================
+class BatchWriter:
+    """
+    Очередь записи в БД:
+    - Вставки и обновления копятся до WRITE_BATCH_SIZE штук или WRITE_BATCH_WINDOW
+    - Каждый пакет пишется одной транзакцией; если она упала, операции повторяются
+      по одной (в точках сохранения), и ошибку получает только виновная операция
+    - Результат операции (например, ID нового заказа) приходит через Future
+    - extra - связанные запросы (например, обновление статистики), которые
+      выполняются перед операцией в той же транзакции
+    - after - функция от вставленного объекта (уже с ID), возвращающая запросы,
+      которые выполняются сразу после вставки (например, сообщения в outbox)
+    """
+
+    def __init__(self, session_maker=None, batch_size: int = WRITE_BATCH_SIZE, window: float = WRITE_BATCH_WINDOW):
+        self.session_maker = session_maker or async_session
+        self.batch_size = batch_size
+        self.window = window
+        self.queue = asyncio.Queue()
+        self.stats = {'batches': 0, 'operations': 0, 'errors': 0, 'batch_sizes': Counter()}
+        self._task = None
+        self._closing = False
+
+    @property
+    def running(self) -> bool:
+        """Принимает ли фоновый писатель операции (после close() - нет, пишем напрямую)"""
+        return self._task is not None and not self._task.done() and not self._closing
+
+    def start(self) -> None:
+        """Запуск фоновой записи"""
+        if not self.running:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    def _submit(self, operation) -> asyncio.Future:
+        """Постановка операции в очередь"""
+        if not self.running:
+            # Операция после _STOP осталась бы в очереди навсегда
+            raise RuntimeError('BatchWriter is not running')
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._log_error)
+        self.queue.put_nowait((operation, future))
+        return future
+
+    @staticmethod
+    def _log_error(future: asyncio.Future) -> None:
+        """Логирование ошибок операций, результат которых никто не ждет"""
+        if not future.cancelled() and future.exception():
+            logger.error('Batched write failed: %s', future.exception())
+
+    def insert(self, obj, extra=(), after=None) -> asyncio.Future:
+        """Вставка объекта модели, Future вернет его ID"""
+        return self._submit(('insert', extra, obj, after))
+
+    def update(self, model, object_id: int, extra=(), **values) -> asyncio.Future:
+        """Обновление полей строки по ID"""
+        return self._submit(('update', extra, model, object_id, values))
+
+    async def _run(self) -> None:
+        """Сбор пакетов из очереди и их запись"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self.queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                try:
+                    item = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    @staticmethod
+    async def _apply(session, operation):
+        """Выполнение одной операции пакета (для вставки возвращает объект)"""
+        for statement in operation[1]:
+            await session.execute(statement)
+        if operation[0] == 'insert':
+            _, _, obj, after = operation
+            session.add(obj)
+            if after:
+                await session.flush()
+                for statement in after(obj):
+                    await session.execute(statement)
+            return obj
+        _, _, model, object_id, values = operation
+        await session.execute(update(model).where(model.id == object_id).values(**values))
+        return None
+
+    @staticmethod
+    def _set_results(done) -> None:
+        """Передача результатов ожидающим (ID вставленной строки или None)"""
+        for obj, future in done:
+            if not future.done():
+                future.set_result(obj.id if obj is not None else None)
+
+    async def _flush(self, batch) -> None:
+        """Запись пакета одной транзакцией (при ошибке - повтор по одной операции)"""
+        try:
+            async with self.session_maker() as session:
+                done = [(await self._apply(session, operation), future) for operation, future in batch]
+                await session.commit()
+        except Exception as e:
+            if len(batch) > 1:
+                logger.warning('Write batch of %s failed (%s), retrying operations one by one', len(batch), e)
+                await self._flush_separately(batch)
+                return
+            self.stats['errors'] += 1
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        self.stats['batches'] += 1
+        self.stats['operations'] += len(batch)
+        self.stats['batch_sizes'][len(batch)] += 1
+        batch_size_histogram.observe(len(batch))
+        self._set_results(done)
+
+    async def _flush_separately(self, batch) -> None:
+        """
+        Повтор упавшего пакета: каждая операция в своей точке сохранения (SAVEPOINT),
+        ошибку получает только та операция, из-за которой упал пакет
+        """
+        done = []
+        try:
+            async with self.session_maker() as session:
+                for operation, future in batch:
+                    try:
+                        async with session.begin_nested():
+                            obj = await self._apply(session, operation)
+                    except Exception as e:
+                        self.stats['errors'] += 1
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        done.append((obj, future))
+                await session.commit()
+        except Exception as e:
+            # Не удалось записать даже по одной (например, недоступна БД)
+            self.stats['errors'] += len(done)
+            for _, future in done:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.stats['operations'] += len(done)
+        self._set_results(done)
+
+    async def close(self) -> None:
+        """Остановка с записью всего, что осталось в очереди"""
+        if self.running:
+            self._closing = True
+            self.queue.put_nowait(_STOP)
+            await self._task
+
+writer = BatchWriter()
+
+registry.gauge('bot_write_queue_depth', 'Operations waiting in the write queue', function=lambda: writer.queue.qsize())
@@ -0,0 +1,243 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from sqlalchemy import select, delete, text, func, tuple_
+from app.database.models import engine, upsert, Category, Item, MediaAsset
+from app.database.migrations import ensure_catalog_keys
+from app.database.requests import invalidate_catalog
+from app.media import registry as media_registry, item_key
+from os import getenv
+import csv
+import json
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+IMPORT_CHUNK_SIZE = int(getenv('IMPORT_CHUNK_SIZE', '5000'))
+EXPORT_CHUNK_SIZE = int(getenv('EXPORT_CHUNK_SIZE', '5000'))
+
+# Колонки файла каталога (одна строка - один товар)
+COLUMNS = ('category', 'name', 'description', 'price', 'image')
+# items.price - integer: большая цена сорвала бы запись всей пачки
+MAX_PRICE = 2 ** 31 - 1
+
+def detect_format(file_name: str) -> str:
+    """Формат по расширению: jsonl (.jsonl, .ndjson) или csv"""
+    return 'jsonl' if (file_name or '').lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+# ========================
+# ЧТЕНИЕ ФАЙЛА
+# ========================
+def read_rows(path: str, fmt: str):
+    """Построчное чтение файла: (номер строки, словарь) - файл целиком в память не грузится"""
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        if fmt == 'jsonl':
+            for line_no, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError:
+                    yield line_no, None
+        else:
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+
+def _parse_item(row: dict) -> tuple:
+    """(категория, название, описание, цена, картинка) или ValueError"""
+    if not isinstance(row, dict):
+        raise ValueError('not a JSON object')
+    category = str(row.get('category') or '').strip()
+    name = str(row.get('name') or '').strip()
+    if not category or not name:
+        raise ValueError('category and name are required')
+    price = float(row.get('price') or 0)
+    if not math.isfinite(price) or not 0 <= price <= MAX_PRICE:
+        raise ValueError(f'price out of range: {row.get("price")}')
+    price = int(price)
+    image = str(row.get('image') or '').strip() or None
+    return category, name, str(row.get('description') or ''), price, image
+
+# ========================
+# ИМПОРТ
+# ========================
+class CatalogImporter:
+    """
+    Загрузка каталога пачками по IMPORT_CHUNK_SIZE строк:
+    - Категории создаются по имени (ON CONFLICT DO NOTHING), их ID кэшируются
+    - Товары обновляются по ключу (категория, название)
+    - PostgreSQL: COPY во временную таблицу и INSERT ... SELECT ... ON CONFLICT
+    - SQLite: executemany того же upsert
+    - Каждая пачка - отдельная транзакция (длинный импорт не держит блокировки):
+      при ошибке уже записанные пачки остаются, повтор импорта их обновит
+    - Кэш каталога сбрасывается один раз в конце (и при ошибке)
+    - Товарам, которым файл задает картинку, сохраненное фото (в том числе из /setmedia)
+      сбрасывается: новая картинка из файла важнее
+    """
+
+    def __init__(self, chunk_size: int = IMPORT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.category_ids = {}
+        self.stats = {'rows': 0, 'items': 0, 'categories': 0, 'errors': 0, 'error_lines': []}
+
+    async def _resolve_categories(self, conn, names) -> None:
+        """ID категорий по именам (недостающие создаются)"""
+        missing = [name for name in names if name not in self.category_ids]
+        if not missing:
+            return
+        await conn.execute(
+            upsert(Category).on_conflict_do_nothing(index_elements=[Category.name]),
+            [{'name': name} for name in missing]
+        )
+        rows = await conn.execute(select(Category.id, Category.name).where(Category.name.in_(missing)))
+        for category_id, name in rows:
+            self.category_ids[name] = category_id
+        self.stats['categories'] = len(self.category_ids)
+
+    async def _copy_items(self, conn, records) -> None:
+        """PostgreSQL: COPY пачки во временную таблицу и upsert из нее"""
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            'items_import',
+            records=records,
+            columns=['category_id', 'name', 'description', 'price', 'image']
+        )
+        await conn.execute(text(
+            'INSERT INTO tg_bot.items (category_id, name, description, price, image) '
+            'SELECT category_id, name, description, price, image FROM items_import '
+            'ON CONFLICT (category_id, name) DO UPDATE SET '
+            'description = EXCLUDED.description, price = EXCLUDED.price, '
+            'image = COALESCE(EXCLUDED.image, tg_bot.items.image)'
+        ))
+        await conn.execute(text('TRUNCATE items_import'))
+
+    async def _upsert_items(self, conn, records) -> None:
+        """SQLite и прочие: upsert товаров через executemany"""
+        query = upsert(Item)
+        await conn.execute(
+            query.on_conflict_do_update(
+                index_elements=[Item.category_id, Item.name],
+                set_={
+                    'description': query.excluded.description,
+                    'price': query.excluded.price,
+                    'image': func.coalesce(query.excluded.image, Item.image)
+                }
+            ),
+            [
+                {'category_id': category_id, 'name': name, 'description': description, 'price': price, 'image': image}
+                for category_id, name, description, price, image in records
+            ]
+        )
+
+    async def _reset_item_media(self, conn, keys) -> None:
+        """Удаление сохраненных фото товаров (категория, название), получивших новую картинку"""
+        if not keys:
+            return
+        item_ids = await conn.scalars(select(Item.id).where(tuple_(Item.category_id, Item.name).in_(keys)))
+        await conn.execute(delete(MediaAsset).where(MediaAsset.key.in_([item_key(item_id) for item_id in item_ids])))
+
+    async def _write_chunk(self, conn, chunk: dict) -> None:
+        """Запись пачки одной транзакцией"""
+        async with conn.begin():
+            await self._resolve_categories(conn, {category for category, _ in chunk})
+            records = [
+                (self.category_ids[category], name, description, price, image)
+                for (category, name), (description, price, image) in chunk.items()
+            ]
+            if conn.dialect.driver == 'asyncpg':
+                await self._copy_items(conn, records)
+            else:
+                await self._upsert_items(conn, records)
+            await self._reset_item_media(conn, [
+                (category_id, name) for category_id, name, _, _, image in records if image
+            ])
+        self.stats['items'] += len(records)
+
+    async def run(self, rows, progress=None) -> dict:
+        """
+        Импорт строк (итератор от read_rows).
+        progress - необязательная корутина, вызывается после каждой пачки со stats
+        """
+        try:
+            async with engine.connect() as conn:
+                # Upsert опирается на уникальные ключи, пропущенные миграцией из-за дубликатов
+                problems = await conn.run_sync(ensure_catalog_keys)
+                await conn.commit()
+                if problems:
+                    raise RuntimeError(
+                        'в каталоге есть повторяющиеся названия (таблица (колонки): число) - '
+                        + '; '.join(problems) + '. Переименуйте их и повторите импорт'
+                    )
+                if conn.dialect.driver == 'asyncpg':
+                    await conn.execute(text(
+                        'CREATE TEMP TABLE IF NOT EXISTS items_import '
+                        '(category_id integer, name text, description text, price integer, image text)'
+                    ))
+                    await conn.commit()
+                # (категория, название) -> (описание, цена, картинка); при повторе ключа в пачке остается последняя строка
+                chunk = {}
+                for line_no, row in rows:
+                    self.stats['rows'] += 1
+                    try:
+                        category, name, description, price, image = _parse_item(row)
+                    except (ValueError, TypeError, OverflowError) as e:
+                        self.stats['errors'] += 1
+                        if len(self.stats['error_lines']) < 10:
+                            self.stats['error_lines'].append(f'{line_no}: {e}')
+                        continue
+                    chunk[(category, name)] = (description, price, image)
+                    if len(chunk) >= self.chunk_size:
+                        await self._write_chunk(conn, chunk)
+                        chunk = {}
+                        if progress:
+                            await progress(self.stats)
+                if chunk:
+                    await self._write_chunk(conn, chunk)
+                if conn.dialect.driver == 'asyncpg':
+                    await conn.execute(text('DROP TABLE IF EXISTS items_import'))
+                    await conn.commit()
+        finally:
+            invalidate_catalog()
+            media_registry.invalidate()
+        return self.stats
+
+async def import_catalog(path: str, fmt: str, progress=None) -> dict:
+    """Импорт каталога из CSV/JSONL-файла"""
+    started = time.perf_counter()
+    stats = await CatalogImporter().run(read_rows(path, fmt), progress)
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    logger.info('Catalog import: %s', stats)
+    return stats
+
+# ========================
+# ЭКСПОРТ
+# ========================
+async def export_catalog(path: str, fmt: str) -> int:
+    """Выгрузка каталога в файл потоком (серверный курсор, пачками по EXPORT_CHUNK_SIZE)"""
+    query = (
+        select(Category.name, Item.name, Item.description, Item.price, Item.image)
+        .join(Category, Category.id == Item.category_id)
+        .order_by(Item.id)
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(COLUMNS)
+        async with engine.connect() as conn:
+            result = await conn.stream(query)
+            async for rows in result.partitions():
+                for row in rows:
+                    if writer:
+                        writer.writerow(row)
+                    else:
+                        file.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n')
+                count += len(rows)
+    return count
@@ -0,0 +1,311 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from sqlalchemy import select, text, inspect, insert, delete, func, case
+from sqlalchemy import MetaData, Table, Column, Integer, BigInteger, String, Text, Date, DateTime, JSON, ForeignKey
+from sqlalchemy.exc import DBAPIError
+from app.database.models import engine, read_engine, upsert, SchemaVersion
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ========================
+# СНИМКИ СХЕМЫ
+# ========================
+# Таблицы в том виде, в каком их создает миграция. Модели в models.py меняются,
+# а миграция N должна делать одно и то же всегда - поэтому здесь отдельная MetaData,
+# которую после выпуска миграции не правят.
+_schema = MetaData(schema='tg_bot')
+
+# Версия 1: исходные таблицы бота
+_users = Table(
+    'users', _schema,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('tg_id', BigInteger, unique=True)
+)
+_categories = Table(
+    'categories', _schema,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('name', Text)
+)
+_items = Table(
+    'items', _schema,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('name', Text),
+    Column('description', Text),
+    Column('price', Integer),
+    Column('category_id', Integer, ForeignKey('tg_bot.categories.id'))
+)
+_tickets = Table(
+    'tickets', _schema,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('tg_id', BigInteger),
+    Column('fio', Text),
+    Column('description', Text),
+    Column('status', Text)
+)
+_orders = Table(
+    'orders', _schema,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('tg_id', BigInteger),
+    Column('fio', String),
+    Column('work_id', Integer, ForeignKey('tg_bot.items.id')),
+    Column('variant', String),
+    Column('price', Integer),
+    Column('category_id', Integer),
+    Column('status', String),
+    Column('created_at', DateTime)
+)
+_fsm_storage = Table(
+    'fsm_storage', _schema,
+    Column('key', Text, primary_key=True),
+    Column('state', Text, nullable=True),
+    Column('data', JSON),
+    Column('updated_at', DateTime)
+)
+
+# Версия 5
+_media_assets_table = Table(
+    'media_assets', _schema,
+    Column('key', Text, primary_key=True),
+    Column('url', Text, nullable=True),
+    Column('file_id', Text, nullable=True),
+    Column('updated_at', DateTime)
+)
+
+# Версия 6
+_sales_daily_table = Table(
+    'sales_daily', _schema,
+    Column('day', Date, primary_key=True),
+    Column('category_id', Integer, primary_key=True),
+    Column('orders', Integer),
+    Column('completed', Integer),
+    Column('revenue', Integer),
+    Column('completed_revenue', Integer)
+)
+
+# Версия 8
+_orders_archive = Table(
+    'orders_archive', _schema,
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('tg_id', BigInteger),
+    Column('fio', String),
+    Column('work_id', Integer),
+    Column('variant', String),
+    Column('price', Integer),
+    Column('category_id', Integer),
+    Column('status', String),
+    Column('created_at', DateTime, nullable=True),
+    Column('archived_at', DateTime)
+)
+_tickets_archive = Table(
+    'tickets_archive', _schema,
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('tg_id', BigInteger),
+    Column('fio', Text),
+    Column('description', Text),
+    Column('status', Text),
+    Column('created_at', DateTime, nullable=True),
+    Column('archived_at', DateTime)
+)
+
+# Версия 9
+_outbox_table = Table(
+    'outbox', _schema,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('chat_id', BigInteger),
+    Column('text', Text),
+    Column('status', String),
+    Column('attempts', Integer),
+    Column('next_attempt_at', DateTime),
+    Column('created_at', DateTime),
+    Column('last_error', Text, nullable=True)
+)
+
+# ========================
+# МИГРАЦИИ
+# ========================
+# Каждая миграция - (версия, описание, функция от синхронного соединения).
+# Миграция работает только со снимками выше и явным DDL (без моделей), с проверкой
+# существования, чтобы ее можно было применять и к новой, и к существующей БД.
+def _prefix(conn) -> str:
+    """Схема перед именем таблицы в сыром SQL (в SQLite схемы нет)"""
+    return 'tg_bot.' if conn.dialect.name == 'postgresql' else ''
+
+def _add_column(conn, table: str, column: str, ddl_type: str) -> None:
+    """ALTER TABLE ... ADD COLUMN, если колонки еще нет"""
+    schema = 'tg_bot' if conn.dialect.name == 'postgresql' else None
+    columns = {info['name'] for info in inspect(conn).get_columns(table, schema=schema)}
+    if column not in columns:
+        conn.execute(text(f'ALTER TABLE {_prefix(conn)}{table} ADD COLUMN {column} {ddl_type}'))
+
+def _create_index(conn, name: str, table: str, columns, unique: bool = False) -> None:
+    """Создание индекса по зафиксированному списку колонок (не зависит от текущих моделей)"""
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    conn.execute(text(f'CREATE {kind} IF NOT EXISTS {name} ON {_prefix(conn)}{table} ({", ".join(columns)})'))
+
+def _baseline(conn):
+    """Создание исходных таблиц, которых еще нет"""
+    for table in (_users, _categories, _items, _tickets, _orders, _fsm_storage):
+        table.create(conn, checkfirst=True)
+
+def _hot_column_indexes(conn):
+    """Индексы по колонкам фильтров и составные (status, id) для постраничных списков"""
+    _create_index(conn, 'ix_items_category_id', 'items', ['category_id'])
+    _create_index(conn, 'ix_tickets_status_id', 'tickets', ['status', 'id'])
+    _create_index(conn, 'ix_orders_status_id', 'orders', ['status', 'id'])
+    _create_index(conn, 'ix_orders_tg_id', 'orders', ['tg_id'])
+
+def _items_fulltext_index(conn):
+    """GIN-индекс для полнотекстового поиска по товарам (только PostgreSQL)"""
+    if conn.dialect.name != 'postgresql':
+        return
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_items_fulltext ON tg_bot.items "
+        "USING gin (to_tsvector('russian', name || ' ' || description))"
+    ))
+
+def _items_category_page_index(conn):
+    """Составной индекс (category_id, id) для постраничного вывода товаров вместо индекса по category_id"""
+    _create_index(conn, 'ix_items_category_id_id', 'items', ['category_id', 'id'])
+    conn.execute(text(f'DROP INDEX IF EXISTS {_prefix(conn)}ix_items_category_id'))
+
+def _media_assets(conn):
+    """Таблица медиафайлов (file_id Telegram) и колонка с картинкой товара"""
+    _media_assets_table.create(conn, checkfirst=True)
+    _add_column(conn, 'items', 'image', 'TEXT')
+
+def _sales_daily(conn):
+    """Таблица статистики продаж и ее заполнение по существующим заказам"""
+    _sales_daily_table.create(conn, checkfirst=True)
+    orders = _orders.c
+    completed = orders.status == 'completed'
+    day = func.date(orders.created_at)
+    conn.execute(delete(_sales_daily_table))
+    conn.execute(insert(_sales_daily_table).from_select(
+        ['day', 'category_id', 'orders', 'completed', 'revenue', 'completed_revenue'],
+        select(
+            day,
+            orders.category_id,
+            func.count(),
+            func.sum(case((completed, 1), else_=0)),
+            func.coalesce(func.sum(orders.price), 0),
+            func.sum(case((completed, orders.price), else_=0))
+        )
+        .where(orders.created_at.is_not(None), orders.category_id.is_not(None))
+        .group_by(day, orders.category_id)
+    ))
+
+# Уникальные ключи каталога, на которых держится upsert импорта: имя индекса -> таблица и колонки
+CATALOG_KEYS = [
+    ('ux_categories_name', _categories, ('name',)),
+    ('ux_items_category_id_name', _items, ('category_id', 'name'))
+]
+
+def ensure_catalog_keys(conn) -> list:
+    """
+    Создание уникальных ключей каталога, где это возможно (миграция 7 и каждый импорт).
+    Возвращает ключи, которые мешают создать дубликаты: '<таблица> (<колонки>): <число>'
+    """
+    schema = 'tg_bot' if conn.dialect.name == 'postgresql' else None
+    problems = []
+    for name, table, columns in CATALOG_KEYS:
+        if name in {index['name'] for index in inspect(conn).get_indexes(table.name, schema=schema)}:
+            continue
+        key = [table.c[column] for column in columns]
+        duplicates = conn.scalar(select(func.count()).select_from(
+            select(*key).group_by(*key).having(func.count() > 1).subquery()
+        ))
+        if duplicates:
+            problems.append(f'{table.name} ({", ".join(columns)}): {duplicates}')
+            continue
+        _create_index(conn, name, table.name, list(columns), unique=True)
+    return problems
+
+def _catalog_natural_keys(conn):
+    """
+    Уникальные ключи каталога для импорта: имя категории, (категория, название) товара.
+    Дубликаты в существующем каталоге не останавливают запуск бота: ключ пропускается
+    с предупреждением, импорт откажет, пока их не переименуют
+    """
+    for problem in ensure_catalog_keys(conn):
+        logger.warning('Catalog key not created, duplicated values in %s; catalog import is disabled until they are renamed', problem)
+
+def _archive_tables(conn):
+    """Архивные таблицы заказов и тикетов и время создания тикета (у старых тикетов - NULL)"""
+    for table in (_orders_archive, _tickets_archive):
+        table.create(conn, checkfirst=True)
+    _add_column(conn, 'tickets', 'created_at', 'TIMESTAMP')
+
+def _outbox(conn):
+    """Таблица исходящих сообщений (outbox)"""
+    _outbox_table.create(conn, checkfirst=True)
+    _create_index(conn, 'ix_outbox_status_id', 'outbox', ['status', 'id'])
+    _create_index(conn, 'ix_outbox_chat_id_id', 'outbox', ['chat_id', 'id'])
+
+def _orders_checkout_key(conn):
+    """Ключ оформления заказа (в архиве тоже - архиватор копирует все колонки) и уникальный индекс по нему"""
+    for table in ('orders', 'orders_archive'):
+        _add_column(conn, table, 'checkout_key', 'VARCHAR')
+    _create_index(conn, 'ux_orders_checkout_key', 'orders', ['checkout_key'], unique=True)
+
+MIGRATIONS = [
+    (1, 'baseline tables', _baseline),
+    (2, 'indexes on orders, tickets and items', _hot_column_indexes),
+    (3, 'full-text index on items', _items_fulltext_index),
+    (4, 'keyset index on items (category_id, id)', _items_category_page_index),
+    (5, 'media assets and item images', _media_assets),
+    (6, 'daily sales summary with backfill', _sales_daily),
+    (7, 'unique natural keys for catalog import', _catalog_natural_keys),
+    (8, 'archive tables for orders and tickets', _archive_tables),
+    (9, 'outbox for outgoing messages', _outbox),
+    (10, 'unique checkout key on orders', _orders_checkout_key),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# ========================
+# ПРИМЕНЕНИЕ МИГРАЦИЙ
+# ========================
+async def get_schema_version(bind=engine) -> int:
+    """Текущая версия схемы (0 - таблицы версий еще нет)"""
+    try:
+        async with bind.connect() as conn:
+            return await conn.scalar(select(SchemaVersion.version).where(SchemaVersion.id == 1)) or 0
+    except DBAPIError:
+        return 0
+
+async def migrate(bind=engine) -> int:
+    """Применение недостающих миграций (при актуальной схеме - один SELECT)"""
+    version = await get_schema_version(bind)
+    if version >= LATEST_VERSION:
+        return version
+
+    async with bind.begin() as conn:
+        if bind.dialect.name == 'postgresql':
+            # Не даем двум процессам мигрировать одновременно
+            await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('tg_bot.schema_version'))"))
+        await conn.run_sync(SchemaVersion.__table__.create, checkfirst=True)
+        version = await conn.scalar(select(SchemaVersion.version).where(SchemaVersion.id == 1)) or 0
+
+        for migration_version, description, apply in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            logger.info('Applying migration %s: %s', migration_version, description)
+            await conn.run_sync(apply)
+            version = migration_version
+
+        query = upsert(SchemaVersion).values(id=1, version=version, applied_at=datetime.datetime.now())
+        await conn.execute(query.on_conflict_do_update(
+            index_elements=[SchemaVersion.id],
+            set_={'version': query.excluded.version, 'applied_at': query.excluded.applied_at}
+        ))
+    return version
+
+async def init_db():
+    """Инициализация базы данных (применение миграций схемы)"""
+    await migrate()
+    # Локальная "реплика" из второго файла SQLite не реплицируется - схему создаем в ней отдельно
+    if read_engine is not engine and read_engine.dialect.name == 'sqlite':
+        await migrate(read_engine)
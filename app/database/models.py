@@ -1,34 +1,113 @@
 # ========================
 # ИМПОРТЫ
 # ========================
-from sqlalchemy import BigInteger, Integer, Text, ForeignKey, Column, String, DateTime
+from sqlalchemy import BigInteger, Integer, Text, ForeignKey, Column, String, Date, DateTime, JSON, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
-import os, datetime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import os, datetime, asyncio, logging
 from dotenv import load_dotenv
+from app.metrics import instrument_engine, InstrumentedPool
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # ========================
 # НАСТРОЙКА БАЗЫ ДАННЫХ
 # ========================
-engine = create_async_engine(
+# DB_URL позволяет подключить другую БД (например, sqlite+aiosqlite:///bot.db для тестов)
+DB_URL = os.getenv('DB_URL') or (
     f"postgresql+asyncpg://"
     f"{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@"
     f"{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/"
-    f"{os.getenv('DB_NAME')}",
-    echo=True,
-    pool_size=10,
-    max_overflow=5,
-    pool_timeout=30,
-    connect_args={
-        "timeout": 30,
-        "command_timeout": 30
-    }
+    f"{os.getenv('DB_NAME')}"
 )
 
+# Необязательная реплика для чтения (каталог, списки в админке); пусто - все идет в основную БД
+DB_READ_URL = os.getenv('DB_READ_URL') or None
+
+# Размеры пулов задаются отдельно для основной БД и реплики
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', str(DB_POOL_SIZE)))
+DB_READ_MAX_OVERFLOW = int(os.getenv('DB_READ_MAX_OVERFLOW', str(DB_MAX_OVERFLOW)))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+# Сколько соединений каждого пула открыть при старте (по умолчанию - весь пул, 0 - не открывать)
+DB_POOL_WARMUP = int(os.getenv('DB_POOL_WARMUP', '-1'))
+
+# Кэши подготовленных запросов на соединение: SQLAlchemy (prepared statements asyncpg)
+# и внутренний кэш asyncpg. За PgBouncer в режиме transaction оба выставляются в 0
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv('DB_PREPARED_STATEMENT_CACHE_SIZE', '100'))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '100'))
+
+def make_engine(url: str, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW, name: str = 'primary'):
+    """Создание движка БД (в SQLite схема tg_bot не используется); name - метка пула в метриках"""
+    if url.startswith('sqlite'):
+        return create_async_engine(
+            url,
+            execution_options={'schema_translate_map': {'tg_bot': None}}
+        )
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedPool,
+        pool_logging_name=name,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        connect_args={
+            "timeout": 30,
+            "command_timeout": 30,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE
+        }
+    )
+
+engine = make_engine(DB_URL)
+instrument_engine(engine)
+
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
+if DB_READ_URL:
+    read_engine = make_engine(DB_READ_URL, DB_READ_POOL_SIZE, DB_READ_MAX_OVERFLOW, name='replica')
+    instrument_engine(read_engine)
+else:
+    read_engine = engine
+
+async def warm_up_pool(bind, count: int) -> int:
+    """Открытие count соединений заранее: первые запросы после деплоя не ждут подключения и TLS"""
+    if bind.dialect.name == 'sqlite' or count <= 0:
+        return 0
+    results = await asyncio.gather(*(bind.connect().start() for _ in range(count)), return_exceptions=True)
+    opened = 0
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.warning('Pool warm-up connection failed: %s', result)
+            continue
+        await result.close()
+        opened += 1
+    return opened
+
+async def warm_up_pools(count: int = DB_POOL_WARMUP) -> None:
+    """Прогрев пулов основной БД и реплики"""
+    pools = [(engine, DB_POOL_SIZE)]
+    if read_engine is not engine:
+        pools.append((read_engine, DB_READ_POOL_SIZE))
+    for bind, pool_size in pools:
+        opened = await warm_up_pool(bind, pool_size if count < 0 else min(count, pool_size))
+        if opened:
+            logger.info('DB pool %s warmed up: %s connections', bind.pool.logging_name, opened)
+
+# Сессии только для чтения (без реплики - та же основная БД)
+async_read_session = async_sessionmaker(read_engine, expire_on_commit=False)
+
+def upsert(model):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущей БД"""
+    if engine.dialect.name == 'sqlite':
+        return sqlite_insert(model)
+    return pg_insert(model)
+
 # ========================
 # БАЗОВАЯ МОДЕЛЬ
 # ========================
@@ -49,7 +128,11 @@ class User(Base):
 # ========================
 class Category(Base):
     __tablename__ = 'categories'
-    
+    __table_args__ = (
+        Index('ux_categories_name', 'name', unique=True),
+        {'schema': 'tg_bot'}
+    )
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(Text)
 
@@ -58,31 +141,49 @@ class Category(Base):
 # ========================
 class Item(Base):
     __tablename__ = 'items'
+    __table_args__ = (
+        Index('ix_items_category_id_id', 'category_id', 'id'),
+        Index('ux_items_category_id_name', 'category_id', 'name', unique=True),
+        {'schema': 'tg_bot'}
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(Text)
     description: Mapped[str] = mapped_column(Text)
     price: Mapped[int] = mapped_column(Integer)
     category_id: Mapped[int] = mapped_column(ForeignKey('tg_bot.categories.id'))
+    # URL картинки товара (file_id после первой отправки хранится в media_assets)
+    image: Mapped[str] = mapped_column(Text, nullable=True)
 
 # ========================
 # МОДЕЛЬ ТИКЕТА
 # ========================
 class Ticket(Base):
     __tablename__ = 'tickets'
+    __table_args__ = (
+        Index('ix_tickets_status_id', 'status', 'id'),
+        {'schema': 'tg_bot'}
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     tg_id: Mapped[int] = mapped_column(BigInteger)
     fio: Mapped[str] = mapped_column(Text)
     description: Mapped[str] = mapped_column(Text)
     status: Mapped[str] = mapped_column(Text, default='not_complete')
+    created_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now, nullable=True)
 
 # ========================
 # МОДЕЛЬ ЗАКАЗА
 # ========================
 class Order(Base):
     __tablename__ = 'orders'
-    
+    __table_args__ = (
+        Index('ix_orders_status_id', 'status', 'id'),
+        Index('ix_orders_tg_id', 'tg_id'),
+        Index('ux_orders_checkout_key', 'checkout_key', unique=True),
+        {'schema': 'tg_bot'}
+    )
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     tg_id: Mapped[int] = mapped_column(BigInteger)
     fio: Mapped[str] = mapped_column(String)
@@ -92,13 +193,110 @@ class Order(Base):
     category_id: Mapped[int] = mapped_column(Integer)
     status: Mapped[str] = mapped_column(String, default='new')
     created_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+    # Ключ оформления (checkout_id из FSM): повтор подтверждения не создает второй заказ
+    checkout_key: Mapped[str] = mapped_column(String, nullable=True)
     
     item: Mapped["Item"] = relationship("Item", backref="orders")
 
 # ========================
-# ИНИЦИАЛИЗАЦИЯ БД
+# АРХИВ ЗАКАЗОВ И ТИКЕТОВ
 # ========================
-async def init_db():
-    """Инициализация базы данных (создание таблиц)"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+# Те же колонки, что у orders и tickets, плюс время переноса; строки переносит app/database/archive.py
+class OrderArchive(Base):
+    __tablename__ = 'orders_archive'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    tg_id: Mapped[int] = mapped_column(BigInteger)
+    fio: Mapped[str] = mapped_column(String)
+    work_id: Mapped[int] = mapped_column(Integer)
+    variant: Mapped[str] = mapped_column(String)
+    price: Mapped[int] = mapped_column(Integer)
+    category_id: Mapped[int] = mapped_column(Integer)
+    status: Mapped[str] = mapped_column(String)
+    created_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True)
+    checkout_key: Mapped[str] = mapped_column(String, nullable=True)
+    archived_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+
+    # Без внешнего ключа: архив не мешает удалять товары
+    item: Mapped["Item"] = relationship(
+        "Item", primaryjoin="foreign(OrderArchive.work_id) == Item.id", viewonly=True
+    )
+
+class TicketArchive(Base):
+    __tablename__ = 'tickets_archive'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    tg_id: Mapped[int] = mapped_column(BigInteger)
+    fio: Mapped[str] = mapped_column(Text)
+    description: Mapped[str] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True)
+    archived_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+
+# ========================
+# МОДЕЛЬ СТАТИСТИКИ ПРОДАЖ
+# ========================
+# Сводка по заказам за день и категорию - обновляется в одной транзакции с заказами
+class SalesDaily(Base):
+    __tablename__ = 'sales_daily'
+
+    day: Mapped[datetime.date] = mapped_column(Date, primary_key=True)
+    category_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    orders: Mapped[int] = mapped_column(Integer, default=0)
+    completed: Mapped[int] = mapped_column(Integer, default=0)
+    revenue: Mapped[int] = mapped_column(Integer, default=0)
+    completed_revenue: Mapped[int] = mapped_column(Integer, default=0)
+
+# ========================
+# МОДЕЛЬ ИСХОДЯЩЕГО СООБЩЕНИЯ
+# ========================
+# Outbox: сообщение пишется в одной транзакции со сменой статуса, отправляет его app/outbox.py
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        Index('ix_outbox_status_id', 'status', 'id'),
+        Index('ix_outbox_chat_id_id', 'chat_id', 'id'),
+        {'schema': 'tg_bot'}
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger)
+    text: Mapped[str] = mapped_column(Text)
+    # pending - ждет отправки, failed - отклонено Telegram или исчерпаны попытки
+    status: Mapped[str] = mapped_column(String, default='pending')
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+    created_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+
+# ========================
+# МОДЕЛЬ СОСТОЯНИЯ FSM
+# ========================
+class FSMRecord(Base):
+    __tablename__ = 'fsm_storage'
+
+    key: Mapped[str] = mapped_column(Text, primary_key=True)
+    state: Mapped[str] = mapped_column(Text, nullable=True)
+    data: Mapped[dict] = mapped_column(JSON, default=dict)
+    updated_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+
+# ========================
+# МОДЕЛЬ МЕДИАФАЙЛА
+# ========================
+class MediaAsset(Base):
+    __tablename__ = 'media_assets'
+
+    key: Mapped[str] = mapped_column(Text, primary_key=True)
+    url: Mapped[str] = mapped_column(Text, nullable=True)
+    file_id: Mapped[str] = mapped_column(Text, nullable=True)
+    updated_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
+
+# ========================
+# МОДЕЛЬ ВЕРСИИ СХЕМЫ
+# ========================
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer)
+    applied_at: Mapped[datetime.datetime] = mapped_column(DateTime, default=datetime.datetime.now)
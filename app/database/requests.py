@@ -1,75 +1,359 @@
 # ========================
 # ИМПОРТЫ
 # ========================
-from sqlalchemy import select, delete, update
-from sqlalchemy.orm import joinedload
-from app.database.models import async_session
-from app.database.models import User, Category, Item, Ticket, Order
+from sqlalchemy import select, insert, delete, update, exists, func, and_, or_, case, literal_column
+from sqlalchemy.orm import joinedload, aliased
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.models import async_session, async_read_session, upsert, engine
+from app.database.models import User, Category, Item, Ticket, Order, OrderArchive, TicketArchive, OutboxMessage, MediaAsset, SalesDaily
+from app.database.batcher import writer
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from os import getenv
+import asyncio
+import bisect
+import datetime
+import time
 
 # ========================
-# РАБОТА С ПОЛЬЗОВАТЕЛЯМИ
+# СЕССИИ
 # ========================
-async def set_user(tg_id: int) -> None:
-    """Добавление нового пользователя"""
-    async with async_session() as session:
-        user = await session.scalar(select(User).where(User.tg_id == tg_id))
-        if not user:
-            session.add(User(tg_id=tg_id))
+# Функции чтения вызываются с read=True: без переданной сессии они идут в реплику
+# (DB_READ_URL). Записи и чтение сразу после записи (get_ticket_info, get_order_info)
+# остаются на основной БД. Обработчики передают сюда session или read_session.
+@asynccontextmanager
+async def _use_session(session: AsyncSession = None, read: bool = False):
+    """
+    Сессия текущего обновления (если передана) или новая короткая сессия.
+    Транзакция сессии обновления завершается сразу после запроса: соединение
+    возвращается в пул и не занято, пока обработчик ждет ответа Telegram
+    """
+    if session is not None:
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+        if session.in_transaction():
             await session.commit()
+    else:
+        async with (async_read_session if read else async_session)() as new_session:
+            yield new_session
+
+# ========================
+# КЭШ КАТАЛОГА
+# ========================
+CATALOG_CACHE_TTL = float(getenv('CATALOG_CACHE_TTL', '300'))
+
+class CatalogCache:
+    """
+    Кэш каталога в памяти процесса:
+    - Загружает категории и товары целиком двумя запросами
+    - Живет CATALOG_CACHE_TTL секунд (0 - кэш отключен)
+    - Сбрасывается вручную через invalidate()
+    - version растет при каждой перезагрузке, по нему кэшируются клавиатуры
+    - Читает из реплики, но после invalidate() - из основной БД,
+      чтобы не закэшировать данные, которые реплика еще не получила
+    - generation растет при каждом invalidate(): если сброс пришел во время
+      загрузки, загруженное не считается свежим и следующий запрос перечитает каталог
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.version = 0
+        self.generation = 0
+        self.loaded_at = None
+        self.read_primary = False
+        self.categories = []
+        self.categories_by_id = {}
+        self.items_by_id = {}
+        self.items_by_category = {}
+        self.item_ids_by_category = {}
+        self._lock = asyncio.Lock()
+
+    def is_fresh(self) -> bool:
+        """Проверка, что данные загружены и не устарели"""
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    async def load(self):
+        """Получение актуального кэша (с перезагрузкой при необходимости)"""
+        if self.is_fresh():
+            return self
+        async with self._lock:
+            if self.is_fresh():
+                return self
+            generation = self.generation
+            session_maker = async_session if self.read_primary else async_read_session
+            async with session_maker() as session:
+                categories = list(await session.scalars(select(Category).order_by(Category.id)))
+                items = list(await session.scalars(select(Item).order_by(Item.id)))
+
+            self.categories = categories
+            self.categories_by_id = {category.id: category for category in categories}
+            self.items_by_id = {item.id: item for item in items}
+            self.items_by_category = {}
+            self.item_ids_by_category = {}
+            for item in items:
+                self.items_by_category.setdefault(item.category_id, []).append(item)
+                self.item_ids_by_category.setdefault(item.category_id, []).append(item.id)
+            self.version += 1
+            if generation == self.generation:
+                self.loaded_at = time.monotonic()
+                self.read_primary = False
+        return self
+
+    def invalidate(self) -> None:
+        """Сброс кэша - следующий запрос перечитает каталог из БД"""
+        self.loaded_at = None
+        self.read_primary = True
+        self.generation += 1
+        self.version += 1
+
+catalog = CatalogCache(CATALOG_CACHE_TTL)
+
+def invalidate_catalog() -> None:
+    """Сброс кэша каталога после изменения категорий или товаров"""
+    catalog.invalidate()
+
+# ========================
+# ПОСТРАНИЧНАЯ ВЫБОРКА
+# ========================
+ADMIN_PAGE_SIZE = int(getenv('ADMIN_PAGE_SIZE', '20'))
+
+async def _keyset_page(query, id_column, cursor: int = None, direction: str = 'next', limit: int = ADMIN_PAGE_SIZE, session: AsyncSession = None):
+    """
+    Keyset-пагинация по ID (новые записи сверху):
+    - next: записи с ID меньше курсора
+    - prev: записи с ID больше курсора
+    Возвращает строки страницы и признак наличия записей дальше по направлению
+    """
+    if cursor is not None and direction == 'prev':
+        query = query.where(id_column > cursor).order_by(id_column.asc())
+    elif cursor is not None:
+        query = query.where(id_column < cursor).order_by(id_column.desc())
+    else:
+        query = query.order_by(id_column.desc())
+
+    async with _use_session(session, read=True) as session:
+        rows = (await session.execute(query.limit(limit + 1))).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'prev':
+        rows.reverse()
+    return rows, has_more
+
+# ========================
+# РАБОТА С ПОЛЬЗОВАТЕЛЯМИ
+# ========================
+KNOWN_USERS_CACHE_SIZE = int(getenv('KNOWN_USERS_CACHE_SIZE', '100000'))
+
+# Недавно зарегистрированные tg_id (LRU) - повторный /start не ходит в БД
+_known_users = OrderedDict()
+
+def _remember_users(tg_ids) -> None:
+    """Добавление tg_id в LRU известных пользователей"""
+    for tg_id in tg_ids:
+        _known_users[tg_id] = None
+        _known_users.move_to_end(tg_id)
+    while len(_known_users) > KNOWN_USERS_CACHE_SIZE:
+        _known_users.popitem(last=False)
+
+async def set_user(tg_id: int, session: AsyncSession = None) -> None:
+    """Добавление нового пользователя (один INSERT ... ON CONFLICT DO NOTHING)"""
+    if tg_id in _known_users:
+        _known_users.move_to_end(tg_id)
+        return
+    async with _use_session(session) as session:
+        await session.execute(
+            upsert(User)
+            .values(tg_id=tg_id)
+            .on_conflict_do_nothing(index_elements=[User.tg_id])
+        )
+        await session.commit()
+    _remember_users([tg_id])
+
+async def set_users(tg_ids, chunk_size: int = 1000, session: AsyncSession = None) -> None:
+    """Массовое добавление пользователей (импорт списков)"""
+    new_ids = list(dict.fromkeys(tg_id for tg_id in tg_ids if tg_id not in _known_users))
+    if not new_ids:
+        return
+    async with _use_session(session) as session:
+        for start in range(0, len(new_ids), chunk_size):
+            chunk = new_ids[start:start + chunk_size]
+            await session.execute(
+                upsert(User)
+                .values([{'tg_id': tg_id} for tg_id in chunk])
+                .on_conflict_do_nothing(index_elements=[User.tg_id])
+            )
+        await session.commit()
+    _remember_users(new_ids)
 
 # ========================
 # РАБОТА С КАТЕГОРИЯМИ
 # ========================
-async def get_categories():
+async def get_categories(session: AsyncSession = None):
     """Получение всех категорий"""
-    async with async_session() as session:
+    if catalog.ttl > 0:
+        return (await catalog.load()).categories
+    async with _use_session(session, read=True) as session:
         return await session.scalars(select(Category))
 
-async def get_category(category_id: int):
+async def get_category(category_id: int, session: AsyncSession = None):
     """Получение категории по ID"""
-    async with async_session() as session:
+    if catalog.ttl > 0:
+        return (await catalog.load()).categories_by_id.get(category_id)
+    async with _use_session(session, read=True) as session:
         return await session.scalar(select(Category).where(Category.id == category_id))
 
 # ========================
 # РАБОТА С ТОВАРАМИ
 # ========================
-async def get_category_items(category_id: int):
+async def get_category_items(category_id: int, session: AsyncSession = None):
     """Получение товаров по категории"""
-    async with async_session() as session:
+    if catalog.ttl > 0:
+        return (await catalog.load()).items_by_category.get(category_id, [])
+    async with _use_session(session, read=True) as session:
         return await session.scalars(select(Item).where(Item.category_id == category_id))
 
-async def get_item(item_id: int):
+ITEMS_PAGE_SIZE = int(getenv('ITEMS_PAGE_SIZE', '10'))
+
+async def get_category_items_page(category_id: int, cursor: int = None, direction: str = 'next', limit: int = ITEMS_PAGE_SIZE, session: AsyncSession = None):
+    """
+    Keyset-страница товаров категории (по возрастанию ID):
+    - next: товары с ID больше курсора
+    - prev: товары с ID меньше курсора
+    Возвращает товары страницы и признак наличия товаров дальше по направлению
+    """
+    if catalog.ttl > 0:
+        # Товары в кэше отсортированы по ID - границу страницы ищем бинарным поиском
+        cache = await catalog.load()
+        category_items = cache.items_by_category.get(category_id, [])
+        ids = cache.item_ids_by_category.get(category_id, [])
+        if cursor is None:
+            start, end = 0, limit
+        elif direction == 'prev':
+            end = bisect.bisect_left(ids, cursor)
+            start = max(end - limit, 0)
+        else:
+            start = bisect.bisect_right(ids, cursor)
+            end = start + limit
+        page = category_items[start:end]
+        has_more = start > 0 if direction == 'prev' and cursor is not None else end < len(category_items)
+        return page, has_more
+
+    query = select(Item).where(Item.category_id == category_id)
+    if cursor is not None and direction == 'prev':
+        query = query.where(Item.id < cursor).order_by(Item.id.desc())
+    elif cursor is not None:
+        query = query.where(Item.id > cursor).order_by(Item.id.asc())
+    else:
+        query = query.order_by(Item.id.asc())
+
+    async with _use_session(session, read=True) as session:
+        page = list(await session.scalars(query.limit(limit + 1)))
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    if direction == 'prev':
+        page.reverse()
+    return page, has_more
+
+async def get_item(item_id: int, session: AsyncSession = None):
     """Получение товара по ID"""
-    async with async_session() as session:
+    if catalog.ttl > 0:
+        return (await catalog.load()).items_by_id.get(item_id)
+    async with _use_session(session, read=True) as session:
         return await session.scalar(select(Item).where(Item.id == item_id))
 
+async def get_item_with_category(item_id: int, session: AsyncSession = None):
+    """Получение товара вместе с категорией (одним запросом с JOIN)"""
+    if catalog.ttl > 0:
+        cache = await catalog.load()
+        item = cache.items_by_id.get(item_id)
+        return (item, cache.categories_by_id.get(item.category_id)) if item else None
+    async with _use_session(session, read=True) as session:
+        row = (await session.execute(
+            select(Item, Category)
+            .join(Category, Category.id == Item.category_id)
+            .where(Item.id == item_id)
+        )).first()
+        return tuple(row) if row else None
+
+async def search_items_db(query: str, limit: int = 50, session: AsyncSession = None):
+    """Поиск товаров в БД: полнотекстовый в PostgreSQL, по подстрокам в SQLite"""
+    async with _use_session(session, read=True) as session:
+        if engine.dialect.name == 'postgresql':
+            # Выражение совпадает с индексом ix_items_fulltext (константы без параметров)
+            config = literal_column("'russian'")
+            document = func.to_tsvector(config, Item.name + literal_column("' '") + Item.description)
+            ts_query = func.plainto_tsquery(config, query)
+            return list(await session.scalars(
+                select(Item)
+                .where(document.op('@@')(ts_query))
+                .order_by(func.ts_rank(document, ts_query).desc())
+                .limit(limit)
+            ))
+        conditions = [
+            or_(Item.name.ilike(f'%{word}%'), Item.description.ilike(f'%{word}%'))
+            for word in query.split()
+        ]
+        return list(await session.scalars(select(Item).where(and_(*conditions)).order_by(Item.id).limit(limit)))
+
 # ========================
 # РАБОТА С ТИКЕТАМИ
 # ========================
-async def set_ticket(tg_id: int, fio: str, question: str, status: str = 'not_completed'):
-    """Создание нового тикета"""
-    async with async_session() as session:
-        session.add(Ticket(
-            tg_id=tg_id,
-            fio=fio,
-            description=question,
-            status=status
-        ))
+async def set_ticket(tg_id: int, fio: str, question: str, status: str = 'not_completed', messages=(), session: AsyncSession = None):
+    """
+    Создание нового тикета (при пакетной записи - без ожидания коммита).
+    messages - пары (chat_id, текст) для outbox, пишутся в той же транзакции
+    """
+    ticket = Ticket(
+        tg_id=tg_id,
+        fio=fio,
+        description=question,
+        status=status
+    )
+    outbox = _outbox_insert(messages)
+    if writer.running:
+        writer.insert(ticket, extra=outbox)
+        return
+    async with _use_session(session) as session:
+        session.add(ticket)
+        for statement in outbox:
+            await session.execute(statement)
         await session.commit()
 
-async def get_tickets(status: str = 'not_completed'):
+async def get_tickets(status: str = 'not_completed', session: AsyncSession = None):
     """Получение тикетов по статусу"""
-    async with async_session() as session:
+    async with _use_session(session, read=True) as session:
         return await session.scalars(select(Ticket).where(Ticket.status == status))
 
-async def get_ticket_info(ticket_id: int):
-    """Получение информации о тикете"""
-    async with async_session() as session:
-        return await session.scalar(select(Ticket).where(Ticket.id == ticket_id))
+async def get_tickets_page(status: str = 'not_completed', cursor: int = None, direction: str = 'next', session: AsyncSession = None):
+    """Страница тикетов по статусу (один запрос с LIMIT)"""
+    query = select(Ticket.id, Ticket.fio)
+    if status:
+        query = query.where(Ticket.status == status)
+    return await _keyset_page(query, Ticket.id, cursor, direction, session=session)
+
+async def get_ticket_info(ticket_id: int, session: AsyncSession = None):
+    """Получение информации о тикете (если его нет в рабочей таблице - из архива)"""
+    async with _use_session(session) as session:
+        ticket = await session.scalar(select(Ticket).where(Ticket.id == ticket_id))
+        if ticket is None:
+            ticket = await session.scalar(select(TicketArchive).where(TicketArchive.id == ticket_id))
+        return ticket
 
-async def update_ticket_status(ticket_id: int, status: str = 'completed'):
-    """Обновление статуса тикета"""
-    async with async_session() as session:
+async def update_ticket_status(ticket_id: int, status: str = 'completed', messages=(), session: AsyncSession = None):
+    """Обновление статуса тикета (messages - сообщения в outbox в той же транзакции)"""
+    outbox = _outbox_insert(messages)
+    if writer.running:
+        writer.update(Ticket, ticket_id, extra=outbox, status=status)
+        return
+    async with _use_session(session) as session:
+        for statement in outbox:
+            await session.execute(statement)
         await session.execute(
             update(Ticket)
             .where(Ticket.id == ticket_id)
@@ -77,9 +361,9 @@ async def update_ticket_status(ticket_id: int, status: str = 'completed'):
         )
         await session.commit()
 
-async def save_ticket_answer(ticket_id: int, answer: str):
+async def save_ticket_answer(ticket_id: int, answer: str, session: AsyncSession = None):
     """Сохранение ответа на тикет"""
-    async with async_session() as session:
+    async with _use_session(session) as session:
         await session.execute(
             update(Ticket)
             .where(Ticket.id == ticket_id)
@@ -87,6 +371,86 @@ async def save_ticket_answer(ticket_id: int, answer: str):
         )
         await session.commit()
 
+# ========================
+# СТАТИСТИКА ПРОДАЖ
+# ========================
+# Сводка sales_daily меняется теми же транзакциями, что и заказы
+# (в том числе пакетами BatchWriter), поэтому /stats не сканирует orders
+_SALES_COUNTERS = ('orders', 'completed', 'revenue', 'completed_revenue')
+
+def _sales_new_order(order: Order):
+    """Учет нового заказа в сводке за его день и категорию"""
+    completed = order.status == 'completed'
+    query = upsert(SalesDaily).values(
+        day=order.created_at.date(),
+        category_id=order.category_id,
+        orders=1,
+        completed=int(completed),
+        revenue=order.price,
+        completed_revenue=order.price if completed else 0
+    )
+    return query.on_conflict_do_update(
+        index_elements=[SalesDaily.day, SalesDaily.category_id],
+        set_={name: getattr(SalesDaily, name) + getattr(query.excluded, name) for name in _SALES_COUNTERS}
+    )
+
+def _sales_row_of(order_id: int):
+    """Условие: строка сводки, к которой относится заказ (для UPDATE ... FROM orders)"""
+    return and_(
+        Order.id == order_id,
+        SalesDaily.day == func.date(Order.created_at),
+        SalesDaily.category_id == Order.category_id
+    )
+
+def _sales_status_change(order_id: int, status: str):
+    """Перенос заказа в выполненные или обратно (выполняется до смены статуса)"""
+    if status == 'completed':
+        sign, changes = 1, Order.status != 'completed'
+    else:
+        sign, changes = -1, Order.status == 'completed'
+    return (
+        update(SalesDaily)
+        .where(_sales_row_of(order_id), changes)
+        .values(
+            completed=SalesDaily.completed + sign,
+            completed_revenue=SalesDaily.completed_revenue + sign * Order.price
+        )
+    )
+
+def _sales_order_deleted(order_id: int):
+    """Вычитание удаляемого заказа из сводки (выполняется до удаления)"""
+    completed = Order.status == 'completed'
+    return (
+        update(SalesDaily)
+        .where(_sales_row_of(order_id))
+        .values(
+            orders=SalesDaily.orders - 1,
+            revenue=SalesDaily.revenue - Order.price,
+            completed=SalesDaily.completed - case((completed, 1), else_=0),
+            completed_revenue=SalesDaily.completed_revenue - case((completed, Order.price), else_=0)
+        )
+    )
+
+async def get_sales_stats(since: datetime.date, session: AsyncSession = None):
+    """Сводка продаж с даты since: по категориям и по дням"""
+    totals = [func.sum(getattr(SalesDaily, name)).label(name) for name in _SALES_COUNTERS]
+    async with _use_session(session, read=True) as session:
+        by_category = (await session.execute(
+            select(Category.name.label('category_name'), *totals)
+            .select_from(SalesDaily)
+            .outerjoin(Category, Category.id == SalesDaily.category_id)
+            .where(SalesDaily.day >= since)
+            .group_by(SalesDaily.category_id, Category.name)
+            .order_by(func.sum(SalesDaily.revenue).desc())
+        )).all()
+        by_day = (await session.execute(
+            select(SalesDaily.day, *totals)
+            .where(SalesDaily.day >= since)
+            .group_by(SalesDaily.day)
+            .order_by(SalesDaily.day.desc())
+        )).all()
+    return by_category, by_day
+
 # ========================
 # РАБОТА С ЗАКАЗАМИ
 # ========================
@@ -97,49 +461,95 @@ async def set_order(
     variant: str,
     price: int,
     category_id: int,
-    status: str = 'new'
+    status: str = 'new',
+    messages=None,
+    checkout_key: str = None,
+    session: AsyncSession = None
 ):
-    """Создание нового заказа"""
-    async with async_session() as session:
-        order = Order(
-            tg_id=tg_id,
-            fio=fio,
-            work_id=work_id,
-            variant=variant,
-            price=price,
-            category_id=category_id,
-            status=status
-        )
+    """
+    Создание нового заказа (при пакетной записи ID приходит после коммита пакета).
+    messages - функция от ID заказа, возвращающая пары (chat_id, текст) для outbox:
+    сообщения пишутся в той же транзакции, что и заказ
+    """
+    order = Order(
+        tg_id=tg_id,
+        fio=fio,
+        work_id=work_id,
+        variant=variant,
+        price=price,
+        category_id=category_id,
+        status=status,
+        created_at=datetime.datetime.now(),
+        checkout_key=checkout_key
+    )
+    sales = _sales_new_order(order)
+    after = (lambda order: _outbox_insert(messages(order.id))) if messages else None
+    if writer.running:
+        return await writer.insert(order, extra=(sales,), after=after)
+    async with _use_session(session) as session:
         session.add(order)
+        await session.execute(sales)
+        if after:
+            await session.flush()
+            for statement in after(order):
+                await session.execute(statement)
         await session.commit()
         return order.id
 
-async def get_order_with_item(order_id: int):
-    """Получение заказа с информацией о товаре"""
-    async with async_session() as session:
+async def get_order_with_item(order_id: int, session: AsyncSession = None):
+    """Получение заказа с информацией о товаре (если его нет в рабочей таблице - из архива)"""
+    async with _use_session(session) as session:
         result = await session.execute(
             select(Order)
             .join(Item, Order.work_id == Item.id)
             .where(Order.id == order_id)
             .options(joinedload(Order.item))
         )
+        order = result.scalar_one_or_none()
+        if order is not None:
+            return order
+        result = await session.execute(
+            select(OrderArchive)
+            .join(Item, OrderArchive.work_id == Item.id)
+            .where(OrderArchive.id == order_id)
+            .options(joinedload(OrderArchive.item))
+        )
         return result.scalar_one()
 
-async def get_orders(status: str = None):
+async def get_orders(status: str = None, session: AsyncSession = None):
     """Получение заказов (с фильтром по статусу)"""
-    async with async_session() as session:
+    async with _use_session(session, read=True) as session:
         if status:
             return await session.scalars(select(Order).where(Order.status == status))
         return await session.scalars(select(Order))
 
-async def get_order_info(order_id: int):
-    """Получение информации о заказе"""
-    async with async_session() as session:
-        return await session.scalar(select(Order).where(Order.id == order_id))
+async def get_orders_page(status: str = None, cursor: int = None, direction: str = 'next', session: AsyncSession = None):
+    """Страница заказов с названием категории (один запрос с JOIN и LIMIT)"""
+    query = (
+        select(Order.id, Order.status, Category.name.label('category_name'))
+        .outerjoin(Category, Category.id == Order.category_id)
+    )
+    if status:
+        query = query.where(Order.status == status)
+    return await _keyset_page(query, Order.id, cursor, direction, session=session)
+
+async def get_order_info(order_id: int, session: AsyncSession = None):
+    """Получение информации о заказе (если его нет в рабочей таблице - из архива)"""
+    async with _use_session(session) as session:
+        order = await session.scalar(select(Order).where(Order.id == order_id))
+        if order is None:
+            order = await session.scalar(select(OrderArchive).where(OrderArchive.id == order_id))
+        return order
 
-async def update_order_status(order_id: int, status: str):
-    """Обновление статуса заказа"""
-    async with async_session() as session:
+async def update_order_status(order_id: int, status: str, messages=(), session: AsyncSession = None):
+    """Обновление статуса заказа (messages - сообщения в outbox в той же транзакции)"""
+    extra = (_sales_status_change(order_id, status), *_outbox_insert(messages))
+    if writer.running:
+        writer.update(Order, order_id, extra=extra, status=status)
+        return
+    async with _use_session(session) as session:
+        for statement in extra:
+            await session.execute(statement)
         await session.execute(
             update(Order)
             .where(Order.id == order_id)
@@ -147,8 +557,212 @@ async def update_order_status(order_id: int, status: str):
         )
         await session.commit()
 
-async def del_order(order_id: int):
+async def del_order(order_id: int, session: AsyncSession = None):
     """Удаление заказа"""
-    async with async_session() as session:
+    async with _use_session(session) as session:
+        await session.execute(_sales_order_deleted(order_id))
         await session.execute(delete(Order).where(Order.id == order_id))
-        await session.commit()
\ No newline at end of file
+        await session.commit()
+
+# ========================
+# ИДЕМПОТЕНТНОЕ ОФОРМЛЕНИЕ ЗАКАЗА
+# ========================
+# Сколько помнить результат оформления в памяти (повторные нажатия, повторная доставка)
+CHECKOUT_DEDUP_TTL = float(getenv('CHECKOUT_DEDUP_TTL', '600'))
+CHECKOUT_DEDUP_SIZE = int(getenv('CHECKOUT_DEDUP_SIZE', '100000'))
+
+class CheckoutDedup:
+    """
+    Кэш оформлений в памяти: ключ -> Future с ID заказа.
+    Первый вызов создает заказ, одновременные и последующие (в пределах TTL)
+    получают тот же ID без записи в БД
+    """
+
+    def __init__(self, ttl: float = CHECKOUT_DEDUP_TTL, size: int = CHECKOUT_DEDUP_SIZE):
+        self.ttl = ttl
+        self.size = size
+        # ключ -> (время создания, Future)
+        self.entries = OrderedDict()
+
+    def _get(self, key: str):
+        """Future для ключа (устаревшие завершенные записи удаляются)"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        created_at, future = entry
+        if future.done() and time.monotonic() - created_at > self.ttl:
+            del self.entries[key]
+            return None
+        return future
+
+    async def run(self, key: str, create) -> tuple:
+        """
+        (ID заказа, создан ли он этим вызовом). create - корутина-функция,
+        возвращающая такую же пару; при ошибке запись удаляется и повтор пробует снова
+        """
+        future = self._get(key)
+        if future is not None:
+            return await asyncio.shield(future), False
+
+        future = asyncio.get_running_loop().create_future()
+        self.entries[key] = (time.monotonic(), future)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        try:
+            order_id, created = await create()
+        except BaseException as e:
+            self.entries.pop(key, None)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # Ожидающих может не быть - помечаем исключение полученным
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        future.set_result(order_id)
+        return order_id, created
+
+checkout_dedup = CheckoutDedup()
+
+async def get_order_id_by_checkout(checkout_key: str, session: AsyncSession = None):
+    """ID заказа, созданного в рамках оформления (None - еще не создан)"""
+    async with _use_session(session) as session:
+        return await session.scalar(select(Order.id).where(Order.checkout_key == checkout_key))
+
+async def set_order_once(checkout_key: str, session: AsyncSession = None, **fields) -> tuple:
+    """
+    Идемпотентное создание заказа: (ID заказа, создан ли он этим вызовом).
+    Повторы в процессе ждут первый вызов (checkout_dedup), повтор после рестарта
+    упирается в уникальный индекс orders.checkout_key и получает ID существующего заказа.
+    fields - аргументы set_order
+    """
+    async def create():
+        if writer.running:
+            # Ошибка уникальности отменила бы весь пакет - при пакетной записи проверяем заранее
+            order_id = await get_order_id_by_checkout(checkout_key, session)
+            if order_id is not None:
+                return order_id, False
+        try:
+            return await set_order(checkout_key=checkout_key, session=session, **fields), True
+        except IntegrityError:
+            if session is not None:
+                await session.rollback()
+            order_id = await get_order_id_by_checkout(checkout_key, session)
+            if order_id is None:
+                raise
+            return order_id, False
+
+    return await checkout_dedup.run(checkout_key, create)
+
+# ========================
+# РАБОТА С МЕДИАФАЙЛАМИ
+# ========================
+async def get_media_assets(session: AsyncSession = None):
+    """Получение всех сохраненных медиафайлов"""
+    async with _use_session(session) as session:
+        return list(await session.scalars(select(MediaAsset)))
+
+async def set_media_asset(key: str, url: str = None, file_id: str = None, session: AsyncSession = None):
+    """Сохранение медиафайла (INSERT ... ON CONFLICT DO UPDATE)"""
+    async with _use_session(session) as session:
+        query = upsert(MediaAsset).values(key=key, url=url, file_id=file_id, updated_at=datetime.datetime.now())
+        await session.execute(query.on_conflict_do_update(
+            index_elements=[MediaAsset.key],
+            set_={
+                'url': query.excluded.url,
+                'file_id': query.excluded.file_id,
+                'updated_at': query.excluded.updated_at
+            }
+        ))
+        await session.commit()
+
+# ========================
+# ИСХОДЯЩИЕ СООБЩЕНИЯ (OUTBOX)
+# ========================
+def _outbox_insert(messages) -> list:
+    """Запросы постановки сообщений (chat_id, текст) в outbox (пустой список - нечего ставить)"""
+    now = datetime.datetime.now()
+    rows = [
+        {'chat_id': chat_id, 'text': text, 'status': 'pending', 'attempts': 0, 'next_attempt_at': now, 'created_at': now}
+        for chat_id, text in messages
+    ]
+    return [insert(OutboxMessage).values(rows)] if rows else []
+
+# Взятое на отправку сообщение не выдается другому отправителю это время (секунд);
+# должно быть больше прохода (до OUTBOX_BATCH_SIZE сообщений в один чат при лимите 1/с)
+OUTBOX_CLAIM_TIMEOUT = float(getenv('OUTBOX_CLAIM_TIMEOUT', '300'))
+
+async def get_outbox_batch(limit: int, session: AsyncSession = None):
+    """
+    Сообщения, готовые к отправке, по порядку ID. Сообщение не берется, пока в тот же
+    чат есть более раннее, ожидающее повтора, - порядок внутри чата сохраняется.
+    Выбранные сообщения закрепляются за вызвавшим: next_attempt_at сдвигается на
+    OUTBOX_CLAIM_TIMEOUT (итог прохода перезаписывает его, при падении сообщение
+    вернется в очередь по истечении срока)
+    """
+    now = datetime.datetime.now()
+    earlier = aliased(OutboxMessage)
+    blocked = exists().where(
+        earlier.chat_id == OutboxMessage.chat_id,
+        earlier.status == 'pending',
+        earlier.id < OutboxMessage.id,
+        earlier.next_attempt_at > now
+    )
+    query = (
+        select(OutboxMessage)
+        .where(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now, ~blocked)
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+    )
+    if engine.dialect.name == 'postgresql':
+        # Параллельный отправитель (другой процесс) пропускает строки, которые уже закрепляются
+        query = query.with_for_update(skip_locked=True)
+    async with _use_session(session) as session:
+        messages = (await session.scalars(query)).all()
+        if messages:
+            await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_([message.id for message in messages]))
+                .values(next_attempt_at=now + datetime.timedelta(seconds=OUTBOX_CLAIM_TIMEOUT))
+            )
+        await session.commit()
+        return messages
+
+async def finish_outbox(sent_ids, retries=(), failed=(), released=(), session: AsyncSession = None):
+    """
+    Итог прохода одной транзакцией:
+    sent_ids - отправленные (удаляются), retries - (id, попытки, время повтора, ошибка),
+    failed - (id, ошибка) для окончательно неотправленных,
+    released - (id, время) взятые, но не отправленные: возвращаются в очередь к этому времени
+    """
+    async with _use_session(session) as session:
+        for message_id, next_attempt_at in released:
+            await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id == message_id)
+                .values(next_attempt_at=next_attempt_at)
+            )
+        if sent_ids:
+            await session.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(sent_ids)))
+        for message_id, attempts, next_attempt_at, error in retries:
+            await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id == message_id)
+                .values(attempts=attempts, next_attempt_at=next_attempt_at, last_error=error)
+            )
+        for message_id, error in failed:
+            await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id == message_id)
+                .values(status='failed', attempts=OutboxMessage.attempts + 1, last_error=error)
+            )
+        await session.commit()
+
+async def get_outbox_stats(session: AsyncSession = None):
+    """Число ожидающих сообщений и время создания самого старого из них"""
+    async with _use_session(session) as session:
+        result = await session.execute(
+            select(func.count(), func.min(OutboxMessage.created_at))
+            .where(OutboxMessage.status == 'pending')
+        )
+        return result.one()
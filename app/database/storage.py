@@ -0,0 +1,157 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from sqlalchemy import select, delete
+from app.database.models import async_session, upsert, FSMRecord
+from collections import OrderedDict
+from contextvars import ContextVar
+from os import getenv
+import datetime
+import time
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+FSM_CACHE_SIZE = int(getenv('FSM_CACHE_SIZE', '10000'))
+# Кэш между обновлениями включается только в воркерах (WORKERS > 1): туда обновления
+# пользователя приходят всегда в один процесс, и другой процесс не может изменить его состояние
+FSM_CACHE_TTL = float(getenv('FSM_CACHE_TTL', '60'))
+
+# Ключи, прочитанные или измененные при обработке текущего обновления
+_update_keys = ContextVar('fsm_update_keys', default=None)
+
+# ========================
+# ХРАНИЛИЩЕ FSM В БАЗЕ ДАННЫХ
+# ========================
+class DBStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в таблице fsm_storage (состояние и данные в одной строке):
+    - Изменения копятся в памяти и записываются одним запросом в flush_update()
+      (FSMFlushMiddleware вызывает его после каждого обновления - только для ключей
+      этого обновления, незаконченные обновления других пользователей не трогаются)
+    - В пределах одного обновления запись читается из БД один раз
+    - Между обновлениями запись кэшируется на cache_ttl секунд (0 - не кэшируется):
+      только если все обновления пользователя обрабатывает этот процесс
+    """
+
+    def __init__(self, session_maker=None, cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = 0):
+        self.session_maker = session_maker or async_session
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # ключ -> [состояние, данные, время загрузки]
+        self._cache = OrderedDict()
+        self._dirty = set()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        """Строковый ключ записи"""
+        return ':'.join(str(part) for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id or '',
+            key.business_connection_id or '',
+            key.destiny
+        ))
+
+    async def _entry(self, key: StorageKey) -> list:
+        """Запись из кэша или из БД"""
+        db_key = self._key(key)
+        update_keys = _update_keys.get()
+        entry = self._cache.get(db_key)
+        if entry is not None and (
+            db_key in self._dirty
+            or (update_keys is not None and db_key in update_keys)
+            or time.monotonic() - entry[2] < self.cache_ttl
+        ):
+            self._cache.move_to_end(db_key)
+        else:
+            async with self.session_maker() as session:
+                record = await session.scalar(select(FSMRecord).where(FSMRecord.key == db_key))
+            entry = [record.state, dict(record.data or {}), time.monotonic()] if record else [None, {}, time.monotonic()]
+            self._cache[db_key] = entry
+            self._cache.move_to_end(db_key)
+            self._evict()
+        if update_keys is not None:
+            update_keys.add(db_key)
+        return entry
+
+    def _evict(self) -> None:
+        """Вытеснение старых ключей (несохраненные не вытесняются)"""
+        for db_key in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if db_key not in self._dirty:
+                del self._cache[db_key]
+
+    def _touch(self, key: StorageKey) -> None:
+        """Пометка ключа как измененного"""
+        self._dirty.add(self._key(key))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        self._touch(key)
+
+    async def get_state(self, key: StorageKey):
+        return (await self._entry(key))[0]
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        entry = await self._entry(key)
+        entry[1] = data.copy()
+        self._touch(key)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return (await self._entry(key))[1].copy()
+
+    @staticmethod
+    def track_update():
+        """Начало обработки обновления: запоминаются его ключи (токен - для flush_update)"""
+        return _update_keys.set(set())
+
+    async def flush_update(self, token) -> None:
+        """Запись изменений только тех ключей, которых касалось текущее обновление"""
+        keys = _update_keys.get()
+        _update_keys.reset(token)
+        await self.flush(keys)
+
+    async def flush(self, keys=None) -> None:
+        """Запись накопленных изменений ключей keys (None - всех) одной транзакцией"""
+        dirty = self._dirty if keys is None else self._dirty & keys
+        if not dirty:
+            return
+        pending = {db_key: self._cache[db_key] for db_key in dirty}
+        self._dirty.difference_update(pending)
+
+        rows = []
+        empty = []
+        now = datetime.datetime.now()
+        for db_key, (state, data, _) in pending.items():
+            if state is None and not data:
+                empty.append(db_key)
+            else:
+                rows.append({'key': db_key, 'state': state, 'data': data, 'updated_at': now})
+
+        try:
+            async with self.session_maker() as session:
+                if rows:
+                    query = upsert(FSMRecord).values(rows)
+                    await session.execute(query.on_conflict_do_update(
+                        index_elements=[FSMRecord.key],
+                        set_={
+                            'state': query.excluded.state,
+                            'data': query.excluded.data,
+                            'updated_at': query.excluded.updated_at
+                        }
+                    ))
+                if empty:
+                    await session.execute(delete(FSMRecord).where(FSMRecord.key.in_(empty)))
+                await session.commit()
+        except Exception:
+            self._dirty.update(pending)
+            raise
+
+    async def close(self) -> None:
+        await self.flush()
@@ -1,16 +1,51 @@
 # ========================
 # ИМПОРТЫ И НАСТРОЙКИ
 # ========================
-from aiogram.types import Message, CallbackQuery
-from aiogram.filters import CommandStart, Command
+from aiogram.types import (
+    Message,
+    CallbackQuery,
+    FSInputFile,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent
+)
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram import F, Router, Bot
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import requests as rq
 from app import keyboards as kb
+from app import media
+from app.database.catalog_io import import_catalog, export_catalog, detect_format
+from app.search import search_items, SEARCH_INLINE_CACHE_TIME
+from app.callbacks import (
+    CallbackTable,
+    CategoryCallback,
+    ItemCallback,
+    ItemsPageCallback,
+    BuyCallback,
+    TicketCallback,
+    TicketAnswerCallback,
+    OrderCallback,
+    OrderAnswerCallback,
+    TicketsPageCallback,
+    OrdersPageCallback
+)
 from os import getenv
+from types import SimpleNamespace
+import datetime
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
 
 router = Router()
+callbacks = CallbackTable()
 
 # ========================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
@@ -42,94 +77,161 @@ class OrderAnswerState(StatesGroup):
     """Состояния для ответа на заказ"""
     answering = State()
 
+class CatalogImportState(StatesGroup):
+    """Ожидание файла каталога для импорта"""
+    file = State()
+
 # ========================
 # ОСНОВНЫЕ КОМАНДЫ
 # ========================
 @router.message(CommandStart())
-async def cmd_start(message: Message):
-    """Обработка команды /start - регистрация пользователя"""
-    await rq.set_user(message.from_user.id)
+async def cmd_start(message: Message, command: CommandObject, bot: Bot, session: AsyncSession, read_session: AsyncSession):
+    """Обработка команды /start - регистрация пользователя (/start item_<id> - ссылка из inline-поиска)"""
+    await rq.set_user(message.from_user.id, session=session)
     await message.answer('Добро пожаловать в магазин работ', reply_markup=kb.main)
+    payload = command.args or ''
+    if payload.startswith('item_') and payload[5:].isdigit():
+        found = await rq.get_item_with_category(int(payload[5:]), session=read_session)
+        if not found:
+            await message.answer('Товар не найден')
+            return
+        await _send_item_card(bot, message.chat.id, *found)
 
 @router.message(F.text == 'Каталог')
-async def catalog(message: Message):
+async def catalog(message: Message, read_session: AsyncSession):
     """Показ категорий товаров"""
-    await message.answer('Выберите предмет', reply_markup=await kb.categories())
+    await message.answer('Выберите предмет', reply_markup=await kb.categories(session=read_session))
 
 # ========================
 # ОБРАБОТЧИКИ ТОВАРОВ
 # ========================
-@router.callback_query(F.data.startswith('category_'))
-async def category_items(callback: CallbackQuery):
+@callbacks.register(CategoryCallback)
+async def category_items(callback: CallbackQuery, callback_data: CategoryCallback, read_session: AsyncSession):
     """Показ товаров в выбранной категории"""
-    category_id = int(callback.data.split('_')[1])
     await callback.message.edit_text(
         'Выберите работу',
-        reply_markup=await kb.items(category_id)
+        reply_markup=await kb.items(callback_data.category_id, session=read_session)
+    )
+
+@callbacks.register(ItemsPageCallback)
+async def category_items_page(callback: CallbackQuery, callback_data: ItemsPageCallback, read_session: AsyncSession):
+    """Переключение страницы товаров категории (сообщение редактируется на месте)"""
+    await callback.message.edit_reply_markup(
+        reply_markup=await kb.items(
+            callback_data.category_id,
+            callback_data.cursor,
+            callback_data.direction,
+            session=read_session
+        )
     )
+    await callback.answer()
+
+def _item_card_text(item, category) -> str:
+    """Текст карточки товара"""
+    return (
+        f'Название: {item.name}\n'
+        f'Описание: {item.description}\n'
+        f'Категория: {category.name}\n'
+        f'Цена: {int(item.price)}₽'
+    )
+
+async def _has_image(item) -> bool:
+    return bool(item.image) or await media.registry.has(media.item_key(item.id))
 
-@router.callback_query(F.data.startswith('item_'))
-async def show_item(callback: CallbackQuery, state: FSMContext):
-    """Показ информации о товаре с сохранением ID в состоянии"""
+async def _send_item_card(bot: Bot, chat_id: int, item, category) -> None:
+    """Карточка товара новым сообщением (с картинкой, если она есть)"""
+    text = _item_card_text(item, category)
+    if await _has_image(item):
+        await media.registry.send_photo(
+            bot, chat_id, media.item_key(item.id), url=item.image, caption=text, reply_markup=kb.buy_work(item.id)
+        )
+    else:
+        await bot.send_message(chat_id, text, reply_markup=kb.buy_work(item.id))
+
+@callbacks.register(ItemCallback)
+async def show_item(callback: CallbackQuery, callback_data: ItemCallback, bot: Bot, read_session: AsyncSession):
+    """Показ информации о товаре (ID товара передается в кнопке 'Купить')"""
     try:
-        item_id = int(callback.data.split('_')[1])
-        item = await rq.get_item(item_id)
-        if not item:
+        found = await rq.get_item_with_category(callback_data.item_id, session=read_session)
+        if not found:
             await callback.answer("Товар не найден", show_alert=True)
             return
-            
-        category = await rq.get_category(item.category_id)
-        
-        # Сохраняем ID товара в состоянии
-        await state.update_data(item_id=item_id)
-        
-        await callback.message.edit_text(
-            f'Название: {item.name}\n'
-            f'Описание: {item.description}\n'
-            f'Категория: {category.name}\n'
-            f'Цена: {int(item.price)}₽',
-            reply_markup=kb.buy_work
-        )
+        item, category = found
+
+        # Карточка с картинкой отправляется отдельным сообщением (список товаров остается)
+        if await _has_image(item):
+            await _send_item_card(bot, callback.message.chat.id, item, category)
+        else:
+            await callback.message.edit_text(_item_card_text(item, category), reply_markup=kb.buy_work(item.id))
         await callback.answer()
     except Exception as e:
         print(f"Error in show_item: {e}")
         await callback.answer("Ошибка загрузки товара", show_alert=True)
 
+# ========================
+# ПОИСК ТОВАРОВ
+# ========================
+@router.message(Command('search'))
+async def search(message: Message, command: CommandObject, read_session: AsyncSession):
+    """Поиск товаров по названию и описанию (/search запрос)"""
+    if not command.args:
+        await message.answer('Введите запрос после команды, например: /search курсовая')
+        return
+    found = await search_items(command.args, session=read_session)
+    if not found:
+        await message.answer('Ничего не найдено')
+        return
+    await message.answer('Результаты поиска:', reply_markup=kb.search_results(found))
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery, bot: Bot, read_session: AsyncSession):
+    """Поиск товаров в inline-режиме (ответ кэшируется на стороне Telegram)"""
+    found = await search_items(inline_query.query, session=read_session)
+    bot_username = (await bot.me()).username
+    await inline_query.answer(
+        [
+            InlineQueryResultArticle(
+                id=str(item.id),
+                title=item.name,
+                description=f'{int(item.price)}₽ - {item.description}'[:100],
+                input_message_content=InputTextMessageContent(
+                    message_text=f'Название: {item.name}\n'
+                                 f'Описание: {item.description}\n'
+                                 f'Цена: {int(item.price)}₽'
+                ),
+                reply_markup=kb.inline_item(item.id, bot_username)
+            )
+            for item in found
+        ],
+        cache_time=SEARCH_INLINE_CACHE_TIME,
+        is_personal=False
+    )
+
 # ========================
 # ОФОРМЛЕНИЕ ЗАКАЗА
 # ========================
-@router.callback_query(F.data == 'buy')
-async def start_order(callback: CallbackQuery, state: FSMContext):
-    """Начало оформления заказа - получаем ID товара из состояния"""
+@callbacks.register(BuyCallback)
+async def start_order(callback: CallbackQuery, callback_data: BuyCallback, bot: Bot, state: FSMContext, read_session: AsyncSession):
+    """Начало оформления заказа - ID товара приходит в данных кнопки"""
+    # У кнопки из inline-сообщения (отправленного до перехода на ссылки) нет message - пишем в личку
+    chat_id = callback.message.chat.id if callback.message else callback.from_user.id
     try:
-        # Получаем данные из состояния
-        state_data = await state.get_data()
-        item_id = state_data.get('item_id')
-        
-        if not item_id:
-            # Альтернативный способ получения ID, если нет в состоянии
-            if hasattr(callback.message.reply_markup, 'inline_keyboard'):
-                for row in callback.message.reply_markup.inline_keyboard:
-                    for button in row:
-                        if button.callback_data and button.callback_data.startswith('item_'):
-                            item_id = int(button.callback_data.split('_')[1])
-                            break
-        
-        if not item_id:
-            raise ValueError("Не удалось определить ID товара")
-            
-        item = await rq.get_item(item_id)
+        item = await rq.get_item(callback_data.item_id, session=read_session)
         if not item:
             raise ValueError("Товар не найден в базе данных")
             
+        # checkout_id - ключ этого оформления: повторное подтверждение не создаст второй заказ
         await state.update_data(
             item_id=item.id,
             item_name=item.name,
             item_price=item.price,
-            item_category=item.category_id
+            item_category=item.category_id,
+            checkout_id=uuid.uuid4().hex
         )
+        # Состояние - только после успешного ответа, иначе пользователь застрянет в оформлении
+        await bot.send_message(chat_id, 'Введите ФИО для работы')
         await state.set_state(BuyerStates.fio)
-        await callback.message.answer('Введите ФИО для работы')
+        await callback.answer()
         
     except ValueError as ve:
         print(f"Validation error in start_order: {ve}")
@@ -151,38 +253,51 @@ async def process_variant(message: Message, state: FSMContext):
     await state.update_data(variant=message.text)
     await message.answer('Подтвердите заказ', reply_markup=kb.buy_end)
 
-@router.callback_query(F.data == 'buy_payment')
-async def confirm_order(callback: CallbackQuery, bot: Bot, state: FSMContext):
+@callbacks.register('buy_payment')
+async def confirm_order(callback: CallbackQuery, bot: Bot, state: FSMContext, session: AsyncSession):
     """Подтверждение и оформление заказа"""
+    # Данные товара сохранены в состоянии при start_order - повторно в БД не ходим
     data = await state.get_data()
-    item = await rq.get_item(data['item_id'])
+    if 'fio' not in data or 'variant' not in data:
+        # Состояние уже очищено: повторное нажатие или повторная доставка после оформления
+        await callback.answer('Заказ уже оформлен')
+        return
     
-    order_id = await rq.set_order(
+    details = (
+        f'ID товара: {data["item_id"]}\n'
+        f'Название: {data["item_name"]}\n'
+        f'Цена: {int(data["item_price"])}₽\n'
+        f'Клиент: {data["fio"]}'
+    )
+    # Уведомления админам пишутся в outbox вместе с заказом и уходят в фоне.
+    # Ключ - оформление из FSM (для старых состояний без него - ID нажатия)
+    order_id, created = await rq.set_order_once(
+        data.get('checkout_id') or f'callback:{callback.id}',
         tg_id=callback.from_user.id,
         fio=data['fio'],
         work_id=data['item_id'],
         variant=data['variant'],
-        price=int(item.price),
-        category_id=item.category_id
+        price=int(data['item_price']),
+        category_id=data['item_category'],
+        messages=lambda order_id: [(admin_id, f'Новый заказ #{order_id}!\n{details}') for admin_id in get_admins()],
+        session=session
     )
+    if not created:
+        # Повтор того же оформления: фото и уведомления уже отправлены первым вызовом
+        await callback.answer(f'Заказ #{order_id} уже оформлен')
+        await state.clear()
+        return
     
-    await callback.message.answer_photo(
-        photo='https://imgur.com/a/BHyF2BF',
-        caption=f'Оплата работы "{item.name}" по QR-коду...\n'
-                f'Цена: {int(item.price)}₽\n'
+    # Фото оплаты уходит по сохраненному file_id (URL скачивается только при первой отправке)
+    await media.registry.send_photo(
+        bot,
+        callback.message.chat.id,
+        'payment',
+        caption=f'Оплата работы "{data["item_name"]}" по QR-коду...\n'
+                f'Цена: {int(data["item_price"])}₽\n'
                 f'Номер заказа: {order_id}',
         reply_markup=kb.buy_complete
     )
-    
-    for admin_id in get_admins():
-        await bot.send_message(
-            admin_id,
-            f'Новый заказ #{order_id}!\n'
-            f'ID товара: {data["item_id"]}\n'
-            f'Название: {item.name}\n'
-            f'Цена: {int(item.price)}₽\n'
-            f'Клиент: {data["fio"]}'
-        )
     await state.clear()
 
 # ========================
@@ -202,72 +317,122 @@ async def process_support_fio(message: Message, state: FSMContext):
     await message.answer('Введите ваш вопрос')
 
 @router.message(SupportStates.question)
-async def create_ticket(message: Message, state: FSMContext, bot: Bot):
+async def create_ticket(message: Message, state: FSMContext, session: AsyncSession):
     """Создание тикета"""
     data = await state.get_data()
     await rq.set_ticket(
         tg_id=message.from_user.id,
         fio=data['fio'],
-        question=message.text
+        question=message.text,
+        messages=[(admin_id, f'Новый тикет от {data["fio"]}') for admin_id in get_admins()],
+        session=session
     )
     await message.answer('Ваш вопрос принят!')
-    for admin_id in get_admins():
-        await bot.send_message(admin_id, f'Новый тикет от {data["fio"]}')
     await state.clear()
 
 # ========================
 # АДМИН-ПАНЕЛЬ
 # ========================
+def _is_known_status(status: str, filters) -> bool:
+    """Статус из списка фильтров (произвольная строка не влезла бы в callback_data)"""
+    return status in {name for name, _ in filters}
+
+def _status_usage(command: str, filters) -> str:
+    """Подсказка по допустимым статусам"""
+    return f'Использование: {command} [статус]\nСтатусы: ' + ', '.join(f'{name} ({title})' for name, title in filters)
+
+async def _edit_list(callback: CallbackQuery, text: str, reply_markup) -> None:
+    """Замена списка в сообщении (нажатие на уже выбранный фильтр ничего не меняет - это не ошибка)"""
+    try:
+        await callback.message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if 'message is not modified' not in str(e):
+            raise
+    await callback.answer()
+
 @router.message(Command('tickets'))
-async def admin_tickets(message: Message):
-    """Показ списка тикетов для администратора"""
+async def admin_tickets(message: Message, command: CommandObject, read_session: AsyncSession):
+    """Показ списка тикетов для администратора (/tickets [статус])"""
     if message.from_user.id in get_admins():
-        await message.answer('Тикеты:', reply_markup=await kb.admin_support())
+        status = (command.args or 'not_completed').strip()
+        if not _is_known_status(status, kb.TICKET_FILTERS):
+            await message.answer(_status_usage('/tickets', kb.TICKET_FILTERS))
+            return
+        await message.answer('Тикеты:', reply_markup=await kb.admin_support(status, session=read_session))
+
+@callbacks.register(TicketsPageCallback)
+async def admin_tickets_page(callback: CallbackQuery, callback_data: TicketsPageCallback, read_session: AsyncSession):
+    """Переключение страницы/фильтра списка тикетов"""
+    if callback.from_user.id not in get_admins():
+        await callback.answer()
+        return
+    await _edit_list(
+        callback,
+        'Тикеты:',
+        await kb.admin_support(callback_data.status, callback_data.cursor, callback_data.direction, session=read_session)
+    )
 
-@router.callback_query(F.data.startswith('ticket_'))
-async def view_ticket(callback: CallbackQuery, state: FSMContext):
+@callbacks.register(TicketCallback)
+async def view_ticket(callback: CallbackQuery, callback_data: TicketCallback, session: AsyncSession):
     """Просмотр конкретного тикета"""
-    ticket_id = int(callback.data.split('_')[1])
-    ticket = await rq.get_ticket_info(ticket_id)
-    await state.update_data(ticket_id=ticket_id, user_id=ticket.tg_id)
+    ticket_id = callback_data.ticket_id
+    ticket = await rq.get_ticket_info(ticket_id, session=session)
     await callback.message.edit_text(
         f'Тикет #{ticket_id}\nОт: {ticket.fio}\nВопрос: {ticket.description}',
-        reply_markup=kb.ticket_red
+        reply_markup=kb.ticket_red(ticket_id)
     )
 
-@router.callback_query(F.data == 'answer_tick')
-async def answer_ticket(callback: CallbackQuery, state: FSMContext):
+@callbacks.register(TicketAnswerCallback)
+async def answer_ticket(callback: CallbackQuery, callback_data: TicketAnswerCallback, state: FSMContext, session: AsyncSession):
     """Начало ответа на тикет"""
+    ticket = await rq.get_ticket_info(callback_data.ticket_id, session=session)
+    await state.update_data(ticket_id=ticket.id, user_id=ticket.tg_id)
     await state.set_state(TicketFormState.answering)
     await callback.message.answer('Введите ответ на тикет:')
 
 @router.message(TicketFormState.answering)
-async def send_ticket_answer(message: Message, state: FSMContext, bot: Bot):
+async def send_ticket_answer(message: Message, state: FSMContext, session: AsyncSession):
     """Отправка ответа на тикет"""
     data = await state.get_data()
     ticket_id = data['ticket_id']
     user_id = data['user_id']
     
-    await bot.send_message(
-        user_id,
-        f"Ответ на ваш тикет #{ticket_id}:\n{message.text}"
+    # Ответ уходит через outbox: статус и сообщение сохраняются одной транзакцией
+    await rq.update_ticket_status(
+        ticket_id,
+        messages=[(user_id, f"Ответ на ваш тикет #{ticket_id}:\n{message.text}")],
+        session=session
     )
-    
-    await rq.update_ticket_status(ticket_id)
     await message.answer('Ответ отправлен пользователю!')
     await state.clear()
 
 @router.message(Command('orders'))
-async def admin_orders(message: Message):
-    """Показ списка заказов для администратора"""
+async def admin_orders(message: Message, command: CommandObject, read_session: AsyncSession):
+    """Показ списка заказов для администратора (/orders [статус])"""
     if message.from_user.id in get_admins():
-        await message.answer('Заказы:', reply_markup=await kb.worker_panel())
+        status = (command.args or 'all').strip()
+        if not _is_known_status(status, kb.ORDER_FILTERS):
+            await message.answer(_status_usage('/orders', kb.ORDER_FILTERS))
+            return
+        await message.answer('Заказы:', reply_markup=await kb.worker_panel(status, session=read_session))
+
+@callbacks.register(OrdersPageCallback)
+async def admin_orders_page(callback: CallbackQuery, callback_data: OrdersPageCallback, read_session: AsyncSession):
+    """Переключение страницы/фильтра списка заказов"""
+    if callback.from_user.id not in get_admins():
+        await callback.answer()
+        return
+    await _edit_list(
+        callback,
+        'Заказы:',
+        await kb.worker_panel(callback_data.status, callback_data.cursor, callback_data.direction, session=read_session)
+    )
 
-@router.callback_query(F.data.startswith('order_'))
-async def view_order(callback: CallbackQuery):
+@callbacks.register(OrderCallback)
+async def view_order(callback: CallbackQuery, callback_data: OrderCallback, session: AsyncSession):
     """Просмотр конкретного заказа"""
-    order_id = int(callback.data.split('_')[1])
-    order = await rq.get_order_with_item(order_id)
+    order_id = callback_data.order_id
+    order = await rq.get_order_with_item(order_id, session=session)
     
     await callback.message.edit_text(
         f'Заказ #{order_id}\n'
@@ -275,38 +440,207 @@ async def view_order(callback: CallbackQuery):
         f'Цена: {order.price}₽\n'
         f'Клиент: {order.fio}\n'
         f'Вариант: {order.variant}',
-        reply_markup=kb.order_red
+        reply_markup=kb.order_red(order_id)
     )
     await callback.answer()
 
-@router.callback_query(F.data == 'answer_order')
-async def answer_order(callback: CallbackQuery, state: FSMContext):
+@callbacks.register(OrderAnswerCallback)
+async def answer_order(callback: CallbackQuery, callback_data: OrderAnswerCallback, state: FSMContext):
     """Начало ответа на заказ"""
-    order_id = int(callback.message.text.split('#')[1].split('\n')[0])
-    await state.update_data(order_id=order_id)
+    await state.update_data(order_id=callback_data.order_id)
     await state.set_state(OrderAnswerState.answering)
     await callback.message.answer('Введите ответ для клиента:')
     await callback.answer()
 
 @router.message(OrderAnswerState.answering)
-async def send_order_answer(message: Message, state: FSMContext, bot: Bot):
+async def send_order_answer(message: Message, state: FSMContext, session: AsyncSession):
     """Отправка ответа по заказу"""
     data = await state.get_data()
-    order = await rq.get_order_info(data['order_id'])
+    order = await rq.get_order_info(data['order_id'], session=session)
     
-    await bot.send_message(
-        order.tg_id,
-        f"Ответ по вашему заказу #{data['order_id']}:\n{message.text}"
+    await rq.update_order_status(
+        data['order_id'],
+        status='completed',
+        messages=[(order.tg_id, f"Ответ по вашему заказу #{data['order_id']}:\n{message.text}")],
+        session=session
     )
-    
-    await rq.update_order_status(data['order_id'], status='completed')
     await message.answer('Ответ отправлен клиенту!')
     await state.clear()
 
+# ========================
+# СТАТИСТИКА ПРОДАЖ
+# ========================
+STATS_DAYS = int(getenv('STATS_DAYS', '30'))
+# Больший период обрезается (иначе дата начала выходит за допустимый диапазон)
+STATS_MAX_DAYS = int(getenv('STATS_MAX_DAYS', '3650'))
+
+def _format_sales(title: str, row) -> str:
+    """Строка отчета: заказы, выполненные, процент выполнения, выручка"""
+    rate = row.completed * 100 // row.orders if row.orders else 0
+    return (
+        f'{title}: {row.orders} зак., {row.completed} вып. ({rate}%), '
+        f'{row.revenue}₽ (выполнено на {row.completed_revenue}₽)'
+    )
+
+@router.message(Command('stats'))
+async def admin_stats(message: Message, command: CommandObject, read_session: AsyncSession):
+    """Выручка, количество заказов и процент выполнения по категориям и дням (/stats [дней])"""
+    if message.from_user.id not in get_admins():
+        return
+    days = int(command.args) if command.args and command.args.strip().isdigit() else STATS_DAYS
+    days = min(max(days, 1), STATS_MAX_DAYS)
+    since = datetime.date.today() - datetime.timedelta(days=days - 1)
+    by_category, by_day = await rq.get_sales_stats(since, session=read_session)
+    if not by_day:
+        await message.answer(f'С {since} ({days} дн.) заказов не было')
+        return
+
+    total = SimpleNamespace(**{
+        name: sum(getattr(row, name) for row in by_day)
+        for name in ('orders', 'completed', 'revenue', 'completed_revenue')
+    })
+    lines = [f'Статистика с {since} ({days} дн.)', _format_sales('Итого', total), '']
+    lines.append('По категориям:')
+    lines.extend(_format_sales(f'• {row.category_name or "Без категории"}', row) for row in by_category)
+    lines.append('')
+    lines.append('По дням:')
+    lines.extend(_format_sales(f'• {row.day}', row) for row in by_day)
+    await message.answer('\n'.join(lines)[:4096])
+
+# ========================
+# ИМПОРТ И ЭКСПОРТ КАТАЛОГА
+# ========================
+IMPORT_PROGRESS_INTERVAL = float(getenv('IMPORT_PROGRESS_INTERVAL', '2'))
+
+async def _finish_status(message: Message, status: Message, text: str) -> None:
+    """Итоговый текст в сообщение статуса (если его уже нельзя изменить - новым сообщением)"""
+    try:
+        await status.edit_text(text)
+    except TelegramAPIError:
+        await message.answer(text)
+
+async def _run_catalog_import(message: Message, bot: Bot):
+    """
+    Скачивание файла и импорт с периодическим обновлением статуса.
+    Импорт не атомарный: каждая пачка (IMPORT_CHUNK_SIZE строк) фиксируется отдельно,
+    при ошибке записанные пачки остаются - повторный импорт того же файла их просто обновит
+    """
+    document = message.document
+    status = await message.answer('Загружаю файл...')
+    last_update = time.monotonic()
+    written = 0
+
+    async def progress(stats):
+        nonlocal last_update, written
+        written = stats['items']
+        if time.monotonic() - last_update >= IMPORT_PROGRESS_INTERVAL:
+            last_update = time.monotonic()
+            try:
+                await status.edit_text(f'Импорт: прочитано строк {stats["rows"]}, записано товаров {stats["items"]}')
+            except TelegramAPIError:
+                # Статус - не повод прерывать импорт
+                pass
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog')
+            await bot.download(document, destination=path)
+            stats = await import_catalog(path, detect_format(document.file_name), progress)
+    except Exception as e:
+        logger.exception('Catalog import failed')
+        await _finish_status(
+            message, status,
+            f'Импорт прерван: {e}\nТоваров записано до ошибки: {written} (повторите импорт после исправления)'
+        )
+        return
+
+    text = (
+        f'Импорт завершен за {stats["seconds"]} с\n'
+        f'Строк: {stats["rows"]}, товаров записано: {stats["items"]}, '
+        f'категорий: {stats["categories"]}, ошибок: {stats["errors"]}'
+    )
+    if stats['error_lines']:
+        text += '\nПервые ошибки (строка: причина):\n' + '\n'.join(stats['error_lines'])
+    await _finish_status(message, status, text)
+
+@router.message(Command('import'))
+async def catalog_import(message: Message, state: FSMContext, bot: Bot):
+    """Импорт каталога из CSV/JSONL (файл в этом же сообщении или следующим)"""
+    if message.from_user.id not in get_admins():
+        return
+    if message.document:
+        await _run_catalog_import(message, bot)
+        return
+    await state.set_state(CatalogImportState.file)
+    await message.answer(
+        'Отправьте файл .csv или .jsonl с колонками: category, name, description, price, image.\n'
+        'Товары обновляются по паре (категория, название)'
+    )
+
+@router.message(CatalogImportState.file, F.document)
+async def catalog_import_file(message: Message, state: FSMContext, bot: Bot):
+    """Получение файла для импорта каталога"""
+    await state.clear()
+    if message.from_user.id not in get_admins():
+        return
+    await _run_catalog_import(message, bot)
+
+@router.message(Command('export'))
+async def catalog_export(message: Message, command: CommandObject):
+    """Выгрузка каталога в CSV или JSONL (/export [csv|jsonl])"""
+    if message.from_user.id not in get_admins():
+        return
+    fmt = 'jsonl' if (command.args or '').strip().lower() == 'jsonl' else 'csv'
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f'catalog.{fmt}')
+        count = await export_catalog(path, fmt)
+        await message.answer_document(FSInputFile(path), caption=f'Товаров: {count}')
+
+# ========================
+# МЕДИАФАЙЛЫ
+# ========================
+@router.message(Command('setmedia'))
+async def set_media(message: Message, command: CommandObject):
+    """
+    Замена медиафайла (только для админов):
+    - /setmedia <ключ> <URL> - новый URL, file_id сохранится при первой отправке
+    - фото с подписью /setmedia <ключ> или ответ на фото - сразу file_id
+    Ключи: payment, item:<ID товара>
+    """
+    if message.from_user.id not in get_admins():
+        return
+    args = (command.args or '').split()
+    if not args or not media.is_valid_key(args[0]):
+        await message.answer('Использование: /setmedia <payment | item:ID> [URL] (или подпись к фото)')
+        return
+
+    key = args[0]
+    photo = message.photo or (message.reply_to_message.photo if message.reply_to_message else None)
+    if photo:
+        await media.registry.set(key, file_id=photo[-1].file_id)
+    elif len(args) > 1:
+        await media.registry.set(key, url=args[1])
+    else:
+        await message.answer('Прикрепите фото или укажите URL')
+        return
+    await message.answer(f'Медиафайл {key} обновлен')
+
 # ========================
 # ДОПОЛНИТЕЛЬНЫЕ ФУНКЦИИ
 # ========================
-@router.callback_query(F.data == 'to_main')
+@callbacks.register('to_main')
 async def back_to_main(callback: CallbackQuery):
     """Возврат в главное меню"""
-    await callback.message.answer('Главное меню', reply_markup=kb.main)
\ No newline at end of file
+    if callback.message is None:
+        # Кнопка из inline-сообщения в чужом чате - меню там показать нельзя
+        await callback.answer('Откройте чат с ботом, чтобы вернуться в меню')
+        return
+    await callback.message.answer('Главное меню', reply_markup=kb.main)
+
+# ========================
+# ДИСПЕТЧЕРИЗАЦИЯ НАЖАТИЙ
+# ========================
+@router.callback_query(flags={'callback_table': True})
+async def dispatch_callback(callback: CallbackQuery, **data):
+    """Все inline-кнопки обрабатываются через таблицу префиксов"""
+    return await callbacks.dispatch(callback, **data)
\ No newline at end of file
@@ -10,11 +10,56 @@ from aiogram.types import (
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from app.database.requests import (
     get_categories, 
-    get_category_items,
-    get_tickets,
-    get_orders,
-    get_category
+    get_category_items_page,
+    get_tickets_page,
+    get_orders_page,
+    catalog
 )
+from app.callbacks import (
+    CategoryCallback,
+    ItemCallback,
+    ItemsPageCallback,
+    BuyCallback,
+    TicketCallback,
+    TicketAnswerCallback,
+    OrderCallback,
+    OrderAnswerCallback,
+    TicketsPageCallback,
+    OrdersPageCallback
+)
+from collections import OrderedDict
+from os import getenv
+
+# ========================
+# КЭШ КЛАВИАТУР КАТАЛОГА
+# ========================
+# Готовые клавиатуры каталога текущей версии (LRU): ключ -> разметка.
+# При смене версии каталога кэш очищается целиком
+CATALOG_MARKUP_CACHE_SIZE = int(getenv('CATALOG_MARKUP_CACHE_SIZE', '1000'))
+_catalog_markups = OrderedDict()
+_catalog_markups_version = None
+
+def _cached_markup(key):
+    """Получение клавиатуры из кэша, если версия каталога не менялась"""
+    if catalog.ttl <= 0 or _catalog_markups_version != catalog.version:
+        return None
+    markup = _catalog_markups.get(key)
+    if markup is not None:
+        _catalog_markups.move_to_end(key)
+    return markup
+
+def _store_markup(key, markup):
+    """Сохранение клавиатуры в кэш под текущей версией каталога"""
+    global _catalog_markups_version
+    if catalog.ttl > 0:
+        if _catalog_markups_version != catalog.version:
+            _catalog_markups.clear()
+            _catalog_markups_version = catalog.version
+        _catalog_markups[key] = markup
+        _catalog_markups.move_to_end(key)
+        if len(_catalog_markups) > CATALOG_MARKUP_CACHE_SIZE:
+            _catalog_markups.popitem(last=False)
+    return markup
 
 # ========================
 # ОСНОВНЫЕ КЛАВИАТУРЫ
@@ -28,13 +73,6 @@ main = ReplyKeyboardMarkup(
     input_field_placeholder='Выберите пункт меню'
 )
 
-buy_work = InlineKeyboardMarkup(
-    inline_keyboard=[
-        [InlineKeyboardButton(text='Купить', callback_data='buy')],
-        [InlineKeyboardButton(text='На главную', callback_data='to_main')]
-    ]
-)
-
 buy_end = InlineKeyboardMarkup(
     inline_keyboard=[
         [InlineKeyboardButton(text='Подтвердить', callback_data='buy_payment')],
@@ -48,61 +86,117 @@ buy_complete = InlineKeyboardMarkup(
     ]
 )
 
-ticket_red = InlineKeyboardMarkup(
-    inline_keyboard=[
-        [InlineKeyboardButton(text='Ответить', callback_data='answer_tick')],
-        [InlineKeyboardButton(text='Назад', callback_data='to_admin_sup')]
-    ]
-)
+# ========================
+# КЛАВИАТУРЫ С ID В ДАННЫХ КНОПОК
+# ========================
+def buy_work(item_id: int):
+    """Клавиатура покупки товара"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text='Купить', callback_data=BuyCallback(item_id=item_id).pack())],
+            [InlineKeyboardButton(text='На главную', callback_data='to_main')]
+        ]
+    )
 
-order_red = InlineKeyboardMarkup(
-    inline_keyboard=[
-        [InlineKeyboardButton(text='Выполнено', callback_data='answer_order')],
-        [InlineKeyboardButton(text='Назад', callback_data='to_admin_sup')]
-    ]
-)
+def inline_item(item_id: int, bot_username: str):
+    """
+    Клавиатура товара в inline-результатах: у сообщения из inline-режима нет чата бота,
+    поэтому вместо callback-кнопок - ссылка на бота (/start item_<id>) и новый поиск
+    """
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text='Купить', url=f'https://t.me/{bot_username}?start=item_{item_id}')],
+            [InlineKeyboardButton(text='Искать еще', switch_inline_query_current_chat='')]
+        ]
+    )
+
+def ticket_red(ticket_id: int):
+    """Клавиатура действий с тикетом"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text='Ответить', callback_data=TicketAnswerCallback(ticket_id=ticket_id).pack())],
+            [InlineKeyboardButton(text='Назад', callback_data='to_admin_sup')]
+        ]
+    )
+
+def order_red(order_id: int):
+    """Клавиатура действий с заказом"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text='Выполнено', callback_data=OrderAnswerCallback(order_id=order_id).pack())],
+            [InlineKeyboardButton(text='Назад', callback_data='to_admin_sup')]
+        ]
+    )
 
 # ========================
 # ДИНАМИЧЕСКИЕ КЛАВИАТУРЫ
 # ========================
-async def categories():
+async def categories(session=None):
     """Клавиатура с категориями товаров"""
-    all_categories = await get_categories()
+    all_categories = await get_categories(session=session)
+    markup = _cached_markup('categories')
+    if markup:
+        return markup
     keyboard = InlineKeyboardBuilder()
     for category in all_categories:
         keyboard.add(InlineKeyboardButton(
             text=category.name,
-            callback_data=f"category_{category.id}"
+            callback_data=CategoryCallback(category_id=category.id).pack()
         ))
     keyboard.add(InlineKeyboardButton(
         text='На главную',
         callback_data='to_main'
     ))
-    return keyboard.adjust(2).as_markup()
+    return _store_markup('categories', keyboard.adjust(2).as_markup())
 
-async def items(category_id: int):
-    """Клавиатура с товарами в категории"""
-    all_items = await get_category_items(category_id)
+async def items(category_id: int, cursor: int = None, direction: str = 'next', session=None):
+    """Клавиатура с товарами в категории (одна страница, кэшируется по категории, курсору и направлению)"""
+    if catalog.ttl > 0:
+        await catalog.load()
+    markup = _cached_markup(('items', category_id, cursor, direction))
+    if markup:
+        return markup
+    page_items, has_more = await get_category_items_page(category_id, cursor, direction, session=session)
     keyboard = InlineKeyboardBuilder()
-    for item in all_items:
+    for item in page_items:
         keyboard.add(InlineKeyboardButton(
             text=item.name,
-            callback_data=f"item_{item.id}"
+            callback_data=ItemCallback(item_id=item.id).pack()
         ))
-    keyboard.add(InlineKeyboardButton(
+    keyboard.adjust(2)
+    if page_items:
+        has_prev = has_more if direction == 'prev' else cursor is not None
+        has_next = has_more if direction == 'next' else True
+        navigation = []
+        if has_prev:
+            navigation.append(InlineKeyboardButton(
+                text='<<',
+                callback_data=ItemsPageCallback(
+                    category_id=category_id, direction='prev', cursor=page_items[0].id
+                ).pack()
+            ))
+        if has_next:
+            navigation.append(InlineKeyboardButton(
+                text='>>',
+                callback_data=ItemsPageCallback(
+                    category_id=category_id, direction='next', cursor=page_items[-1].id
+                ).pack()
+            ))
+        if navigation:
+            keyboard.row(*navigation)
+    keyboard.row(InlineKeyboardButton(
         text='На главную',
         callback_data='to_main'
     ))
-    return keyboard.adjust(2).as_markup()
+    return _store_markup(('items', category_id, cursor, direction), keyboard.as_markup())
 
-async def admin_support():
-    """Клавиатура с тикетами для админа"""
-    all_tickets = await get_tickets()
+def search_results(found_items):
+    """Клавиатура с результатами поиска"""
     keyboard = InlineKeyboardBuilder()
-    for ticket in all_tickets:
+    for item in found_items:
         keyboard.add(InlineKeyboardButton(
-            text=f"Тикет #{ticket.id}",
-            callback_data=f"ticket_{ticket.id}"
+            text=item.name,
+            callback_data=ItemCallback(item_id=item.id).pack()
         ))
     keyboard.add(InlineKeyboardButton(
         text='На главную',
@@ -110,18 +204,74 @@ async def admin_support():
     ))
     return keyboard.adjust(1).as_markup()
 
-async def worker_panel():
-    """Клавиатура с заказами для админа"""
-    all_orders = await get_orders()
+# ========================
+# АДМИНСКИЕ СПИСКИ (ПОСТРАНИЧНО)
+# ========================
+ORDER_FILTERS = [('all', 'Все'), ('new', 'Новые'), ('completed', 'Выполненные')]
+TICKET_FILTERS = [('not_completed', 'Открытые'), ('completed', 'Отвеченные')]
+
+def _page_navigation(keyboard, factory, status: str, rows, cursor, direction: str, has_more: bool):
+    """Кнопки 'назад/вперед' для keyset-страницы"""
+    if not rows:
+        return
+    has_prev = has_more if direction == 'prev' else cursor is not None
+    has_next = has_more if direction == 'next' else True
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(
+            text='<<',
+            callback_data=factory(status=status, direction='prev', cursor=rows[0].id).pack()
+        ))
+    if has_next:
+        navigation.append(InlineKeyboardButton(
+            text='>>',
+            callback_data=factory(status=status, direction='next', cursor=rows[-1].id).pack()
+        ))
+    if navigation:
+        keyboard.row(*navigation)
+
+def _status_filters(keyboard, factory, filters, current: str):
+    """Кнопки фильтра по статусу"""
+    keyboard.row(*[
+        InlineKeyboardButton(
+            text=f"• {title}" if status == current else title,
+            callback_data=factory(status=status).pack()
+        )
+        for status, title in filters
+    ])
+
+async def admin_support(status: str = 'not_completed', cursor: int = None, direction: str = 'next', session=None):
+    """Клавиатура с тикетами для админа (одна страница)"""
+    tickets, has_more = await get_tickets_page(status, cursor, direction, session=session)
     keyboard = InlineKeyboardBuilder()
-    for order in all_orders:
-        category = await get_category(order.category_id)
+    for ticket in tickets:
         keyboard.add(InlineKeyboardButton(
-            text=f"Заказ #{order.id} - {category.name}",
-            callback_data=f"order_{order.id}"
+            text=f"Тикет #{ticket.id}",
+            callback_data=TicketCallback(ticket_id=ticket.id).pack()
         ))
-    keyboard.add(InlineKeyboardButton(
+    keyboard.adjust(1)
+    _page_navigation(keyboard, TicketsPageCallback, status, tickets, cursor, direction, has_more)
+    _status_filters(keyboard, TicketsPageCallback, TICKET_FILTERS, status)
+    keyboard.row(InlineKeyboardButton(
+        text='На главную',
+        callback_data='to_main'
+    ))
+    return keyboard.as_markup()
+
+async def worker_panel(status: str = 'all', cursor: int = None, direction: str = 'next', session=None):
+    """Клавиатура с заказами для админа (одна страница)"""
+    orders, has_more = await get_orders_page(None if status == 'all' else status, cursor, direction, session=session)
+    keyboard = InlineKeyboardBuilder()
+    for order in orders:
+        keyboard.add(InlineKeyboardButton(
+            text=f"Заказ #{order.id} - {order.category_name}",
+            callback_data=OrderCallback(order_id=order.id).pack()
+        ))
+    keyboard.adjust(1)
+    _page_navigation(keyboard, OrdersPageCallback, status, orders, cursor, direction, has_more)
+    _status_filters(keyboard, OrdersPageCallback, ORDER_FILTERS, status)
+    keyboard.row(InlineKeyboardButton(
         text='На главную',
         callback_data='to_main'
     ))
-    return keyboard.adjust(1).as_markup()
\ No newline at end of file
+    return keyboard.as_markup()
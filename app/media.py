@@ -0,0 +1,138 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from app.database import requests as rq
+from os import getenv
+import asyncio
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+PAYMENT_PHOTO_URL = getenv('PAYMENT_PHOTO_URL', 'https://imgur.com/a/BHyF2BF')
+# Чат для загрузки файлов при старте (пусто - первый администратор)
+MEDIA_WARMUP_CHAT_ID = int(getenv('MEDIA_WARMUP_CHAT_ID', '0') or 0)
+# Как часто перечитывать реестр из БД (файлы могли заменить в другом процессе)
+MEDIA_CACHE_TTL = float(getenv('MEDIA_CACHE_TTL', '300'))
+
+# Постоянные файлы бота: ключ -> URL по умолчанию
+STATIC_ASSETS = {
+    'payment': PAYMENT_PHOTO_URL
+}
+
+_ITEM_KEY_RE = re.compile(r'item:\d+')
+
+def item_key(item_id: int) -> str:
+    """Ключ картинки товара"""
+    return f'item:{item_id}'
+
+def is_valid_key(key: str) -> bool:
+    """Проверка ключа: постоянный файл или картинка товара"""
+    return key in STATIC_ASSETS or bool(_ITEM_KEY_RE.fullmatch(key))
+
+# ========================
+# РЕЕСТР МЕДИАФАЙЛОВ
+# ========================
+class MediaRegistry:
+    """
+    Реестр медиафайлов (ключ -> URL и file_id):
+    - После первой отправки по URL file_id сохраняется в памяти и в БД
+    - Следующие отправки идут по file_id - Telegram не скачивает URL заново
+    - Если file_id перестал приниматься, файл отправляется по URL повторно
+    - Реестр перечитывается из БД раз в ttl секунд: замена через /setmedia
+      в одном процессе доходит до остальных
+    """
+
+    def __init__(self, defaults: dict = None, ttl: float = MEDIA_CACHE_TTL):
+        self.defaults = dict(defaults or {})
+        self.assets = {key: (url, None) for key, url in self.defaults.items()}
+        self.ttl = ttl
+        self.loaded_at = None
+        self._lock = asyncio.Lock()
+        self._warm_up_task = None
+
+    def _is_fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    async def load(self) -> None:
+        """Чтение сохраненных file_id из БД (повторно - после истечения ttl)"""
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            assets = {key: (url, None) for key, url in self.defaults.items()}
+            for asset in await rq.get_media_assets():
+                assets[asset.key] = (asset.url, asset.file_id)
+            self.assets = assets
+            self.loaded_at = time.monotonic()
+
+    def _file_id(self, key: str, url: str = None):
+        """Сохраненный file_id, если он относится к тому же URL"""
+        stored_url, file_id = self.assets.get(key, (None, None))
+        # Файл, загруженный админом напрямую (без URL), подходит всегда
+        if file_id and (stored_url is None or url is None or url == stored_url):
+            return file_id
+        return None
+
+    def invalidate(self) -> None:
+        """Сброс - следующий запрос перечитает реестр из БД"""
+        self.loaded_at = None
+
+    async def has(self, key: str) -> bool:
+        """Есть ли файл для ключа (по file_id или URL)"""
+        await self.load()
+        return any(self.assets.get(key, (None, None)))
+
+    async def set(self, key: str, url: str = None, file_id: str = None) -> None:
+        """Замена файла (новый URL или готовый file_id)"""
+        self.assets[key] = (url, file_id)
+        await rq.set_media_asset(key, url, file_id)
+
+    async def send_photo(self, bot: Bot, chat_id: int, key: str, url: str = None, **kwargs):
+        """
+        Отправка фото по ключу: по file_id, а при его отсутствии - по URL с запоминанием file_id.
+        url - картинка по умолчанию (например, items.image): файл из реестра (в том числе
+        заданный через /setmedia) важнее и ею не перезаписывается
+        """
+        await self.load()
+        stored_url, file_id = self.assets.get(key, (None, None))
+        url = stored_url or url
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id, file_id, **kwargs)
+            except TelegramBadRequest:
+                if url is None:
+                    raise
+                logger.warning('Stored file_id for %s was rejected, resending from URL', key)
+        if url is None:
+            raise LookupError(f'Media asset {key!r} is not registered')
+
+        message = await bot.send_photo(chat_id, url, **kwargs)
+        await self.set(key, url, message.photo[-1].file_id)
+        return message
+
+    async def warm_up(self, bot: Bot, chat_id: int) -> None:
+        """Загрузка постоянных файлов без file_id в служебный чат (сообщения сразу удаляются)"""
+        await self.load()
+        for key in STATIC_ASSETS:
+            if self._file_id(key):
+                continue
+            try:
+                message = await self.send_photo(bot, chat_id, key, disable_notification=True)
+                await bot.delete_message(chat_id, message.message_id)
+                logger.info('Media asset %s uploaded, file_id stored', key)
+            except (TelegramAPIError, LookupError) as e:
+                logger.warning('Media warm-up failed for %s: %s', key, e)
+
+    def start_warm_up(self, bot: Bot, chat_id: int) -> None:
+        """Запуск прогрева в фоне, чтобы не задерживать старт бота"""
+        self._warm_up_task = asyncio.create_task(self.warm_up(bot, chat_id))
+
+registry = MediaRegistry(STATIC_ASSETS)
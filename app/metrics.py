@@ -0,0 +1,260 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiohttp import web
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import getenv
+import bisect
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+METRICS_HOST = getenv('METRICS_HOST', '127.0.0.1')
+# 0 (по умолчанию) - сервер метрик не запускается
+METRICS_PORT = int(getenv('METRICS_PORT', '') or 0)
+SLOW_QUERY_MS = float(getenv('SLOW_QUERY_MS', '200'))
+# Доля SQL-запросов, которые пишутся в лог (вместо echo=True для всех)
+SQL_LOG_SAMPLE_RATE = float(getenv('SQL_LOG_SAMPLE_RATE', '0'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# ========================
+# ТИПЫ МЕТРИК
+# ========================
+def _labels(names, values) -> str:
+    """Метки в формате Prometheus"""
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+class Counter:
+    """Счетчик (только растет)"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f'{self.name}{_labels(self.label_names, labels)} {value}'
+
+class Gauge(Counter):
+    """Текущее значение (задается явно или функцией)"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value: float, *labels) -> None:
+        self.values[labels] = value
+
+    def samples(self):
+        if self.function is not None:
+            self.values[()] = self.function()
+        yield from super().samples()
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики по корзинам, сумма, количество]
+        self.values = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        names = self.label_names + ('le',)
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}'
+            yield f'{self.name}_bucket{_labels(names, labels + ("+Inf",))} {count}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {count}'
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels=(), function=None) -> Gauge:
+        return self._register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# ========================
+# МЕТРИКИ ОБРАБОТКИ ОБНОВЛЕНИЙ И БД
+# ========================
+update_seconds = registry.histogram('bot_update_seconds', 'Update processing time', ['event_type'])
+handler_seconds = registry.histogram('bot_handler_seconds', 'Handler execution time', ['handler'])
+handler_errors = registry.counter('bot_handler_errors_total', 'Handler exceptions', ['handler'])
+update_db_queries = registry.histogram('bot_update_db_queries', 'DB queries per update', ['event_type'], COUNT_BUCKETS)
+update_db_seconds = registry.histogram('bot_update_db_seconds', 'DB time per update', ['event_type'])
+db_query_seconds = registry.histogram('bot_db_query_seconds', 'DB statement execution time')
+db_slow_queries = registry.counter('bot_db_slow_queries_total', 'Statements slower than SLOW_QUERY_MS')
+
+# [количество запросов, время в БД] текущего обновления
+current_db_usage = ContextVar('current_db_usage', default=None)
+
+@contextmanager
+def observe_handler(name: str):
+    """Замер времени и ошибок обработчика"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        handler_errors.inc(name)
+        raise
+    finally:
+        handler_seconds.observe(time.perf_counter() - started, name)
+
+# ========================
+# ИНСТРУМЕНТИРОВАНИЕ SQLALCHEMY
+# ========================
+def instrument_engine(engine) -> None:
+    """Подсчет запросов и их времени, лог медленных и выборочных запросов"""
+    sync_engine = getattr(engine, 'sync_engine', engine)
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        db_query_seconds.observe(elapsed)
+
+        usage = current_db_usage.get()
+        if usage is not None:
+            usage[0] += 1
+            usage[1] += elapsed
+
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            db_slow_queries.inc()
+            logger.warning('Slow query (%.1f ms): %s | params: %r', elapsed * 1000, statement, parameters)
+        elif SQL_LOG_SAMPLE_RATE and random.random() < SQL_LOG_SAMPLE_RATE:
+            logger.info('SQL (%.1f ms): %s | params: %r', elapsed * 1000, statement, parameters)
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def handle_error(context):
+        # after_cursor_execute не вызывается для упавшего запроса - сбрасываем его время старта
+        conn = context.connection
+        if conn is not None:
+            conn.info.get('query_started', []).clear()
+
+# ========================
+# ИНСТРУМЕНТИРОВАННЫЙ ПУЛ СОЕДИНЕНИЙ
+# ========================
+db_pool_wait_seconds = registry.histogram(
+    'bot_db_pool_wait_seconds', 'Time to check out a pooled connection, including opening a new one', ['pool']
+)
+db_pool_connect_seconds = registry.histogram('bot_db_pool_connect_seconds', 'Time to open a new DB connection', ['pool'])
+db_pool_timeouts = registry.counter('bot_db_pool_timeouts_total', 'Checkouts that timed out waiting for a free connection', ['pool'])
+db_pool_connections = registry.gauge('bot_db_pool_connections', 'Pooled DB connections by state', ['pool', 'state'])
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений с метриками (имя пула - pool_logging_name движка):
+    - ожидание выдачи соединения и таймауты пула
+    - время открытия новых соединений
+    - занятые, свободные и сверхлимитные (overflow) соединения
+    """
+
+    @property
+    def label(self) -> str:
+        return self.logging_name or 'default'
+
+    def report(self) -> None:
+        """Обновление метрик занятости пула"""
+        db_pool_connections.set(self.checkedout(), self.label, 'checked_out')
+        db_pool_connections.set(self.checkedin(), self.label, 'idle')
+        db_pool_connections.set(max(self.overflow(), 0), self.label, 'overflow')
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            db_pool_timeouts.inc(self.label)
+            raise
+        finally:
+            db_pool_wait_seconds.observe(time.perf_counter() - started, self.label)
+            self.report()
+
+    def _create_connection(self):
+        started = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            db_pool_connect_seconds.observe(time.perf_counter() - started, self.label)
+
+    def _do_return_conn(self, record) -> None:
+        super()._do_return_conn(record)
+        self.report()
+
+# ========================
+# HTTP-ЭНДПОИНТ /metrics
+# ========================
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Отдача метрик в формате Prometheus"""
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    """Запуск локального HTTP-сервера метрик"""
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('Metrics server started on %s:%s/metrics', host, port)
+    return runner
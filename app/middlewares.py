@@ -0,0 +1,259 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import TelegramObject, Update
+from app import metrics
+from app.database.models import DB_POOL_SIZE, DB_MAX_OVERFLOW
+from app.ratelimit import TokenBucket
+from app.scheduler import UpdateScheduler, classify_update
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+import time
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+# Одновременно обрабатываемых обновлений - по умолчанию по размеру пула БД
+MAX_CONCURRENT_UPDATES = int(getenv('MAX_CONCURRENT_UPDATES', str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+# Сколько обновлений может ждать свободного слота и сколько секунд
+MAX_WAITING_UPDATES = int(getenv('MAX_WAITING_UPDATES', str(MAX_CONCURRENT_UPDATES * 20)))
+CONCURRENCY_WAIT_TIMEOUT = float(getenv('CONCURRENCY_WAIT_TIMEOUT', '10'))
+
+# Лимит обновлений от одного пользователя: в секунду и допустимый всплеск (0 - без лимита)
+USER_RATE = float(getenv('USER_RATE', '2'))
+USER_BURST = float(getenv('USER_BURST', '5'))
+# Повторное нажатие той же кнопки в течение этого времени игнорируется (0 - не проверять)
+DUPLICATE_CALLBACK_WINDOW = float(getenv('DUPLICATE_CALLBACK_WINDOW', '1'))
+THROTTLE_CACHE_SIZE = int(getenv('THROTTLE_CACHE_SIZE', '100000'))
+
+OVERLOAD_TEXT = 'Бот сейчас перегружен, попробуйте через минуту'
+THROTTLE_TEXT = 'Слишком много запросов, подождите немного'
+
+async def _reply_briefly(event: Update, text: str) -> None:
+    """Короткий ответ отклоненному обновлению (без обращения к БД)"""
+    try:
+        if event.callback_query:
+            await event.callback_query.answer(text)
+        elif event.message:
+            await event.message.answer(text)
+    except TelegramAPIError:
+        pass
+
+# ========================
+# ОГРАНИЧЕНИЕ НАГРУЗКИ
+# ========================
+updates_rejected = metrics.registry.counter('bot_updates_rejected_total', 'Updates dropped by overload protection', ['reason'])
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """
+    Ограничение числа одновременно обрабатываемых обновлений:
+    - Лишние обновления ждут свободного слота (до CONCURRENCY_WAIT_TIMEOUT секунд)
+      в очереди своего класса (admin / checkout / browsing, см. app.scheduler):
+      админские действия и оформление заказа обслуживаются раньше каталога
+    - При переполнении очереди ожидания (только для browsing) или по таймауту
+      пользователь получает короткий ответ "перегружен" вместо ошибки pool_timeout
+    """
+
+    def __init__(self, limit: int = MAX_CONCURRENT_UPDATES, max_waiting: int = MAX_WAITING_UPDATES, timeout: float = CONCURRENCY_WAIT_TIMEOUT):
+        self.scheduler = UpdateScheduler(limit)
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.active = 0
+        metrics.registry.gauge('bot_updates_in_progress', 'Updates being handled', function=lambda: self.active)
+        metrics.registry.gauge('bot_updates_waiting', 'Updates waiting for a concurrency slot', function=lambda: self.scheduler.waiting)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        update_class = classify_update(event, data)
+        if update_class == 'browsing' and self.scheduler.waiting >= self.max_waiting:
+            updates_rejected.inc('overload')
+            await _reply_briefly(event, OVERLOAD_TEXT)
+            return None
+        try:
+            await self.scheduler.acquire(update_class, self.timeout)
+        except asyncio.TimeoutError:
+            updates_rejected.inc('timeout')
+            await _reply_briefly(event, OVERLOAD_TEXT)
+            return None
+
+        self.active += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            self.scheduler.release()
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничение частоты запросов одного пользователя:
+    - Повторное нажатие той же кнопки, пока первое обрабатывается или в течение
+      DUPLICATE_CALLBACK_WINDOW, отбрасывается (нажатие просто подтверждается)
+    - Остальное ограничивается token bucket USER_RATE/USER_BURST на пользователя
+    - Работает первым (до ConcurrencyLimitMiddleware и чтения FSM): отброшенное
+      обновление не занимает слот и не обращается к хранилищу
+    """
+
+    def __init__(self, rate: float = USER_RATE, burst: float = USER_BURST, window: float = DUPLICATE_CALLBACK_WINDOW, cache_size: int = THROTTLE_CACHE_SIZE):
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.cache_size = cache_size
+        # user_id -> TokenBucket (LRU)
+        self.buckets = OrderedDict()
+        # (user_id, callback_data) -> время начала обработки (None - еще обрабатывается)
+        self.recent_callbacks = OrderedDict()
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.cache_size:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(user_id)
+        return bucket
+
+    def _is_duplicate(self, key) -> bool:
+        """Та же кнопка еще обрабатывается или нажата только что"""
+        if key not in self.recent_callbacks:
+            return False
+        finished_at = self.recent_callbacks[key]
+        return finished_at is None or time.monotonic() - finished_at < self.window
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+
+        key = None
+        if event.callback_query and self.window > 0:
+            key = (user.id, event.callback_query.data)
+            if self._is_duplicate(key):
+                updates_rejected.inc('duplicate')
+                await _reply_briefly(event, None)
+                return None
+
+        if self.rate > 0 and not self._bucket(user.id).try_acquire():
+            updates_rejected.inc('throttled')
+            if event.callback_query:
+                await _reply_briefly(event, THROTTLE_TEXT)
+            return None
+
+        if key is None:
+            return await handler(event, data)
+        self.recent_callbacks[key] = None
+        self.recent_callbacks.move_to_end(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self.recent_callbacks[key] = time.monotonic()
+            if len(self.recent_callbacks) > self.cache_size:
+                self.recent_callbacks.popitem(last=False)
+
+# ========================
+# СЕССИЯ БД НА ОБНОВЛЕНИЕ
+# ========================
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Одна сессия БД на обновление (аргумент session в обработчиках).
+    Соединение берется из пула на время запроса и сразу возвращается
+    (см. requests._use_session), а не держится до конца обработки.
+    read_session - сессия реплики для чтения (без реплики - та же session)
+    """
+
+    def __init__(self, session_maker, read_session_maker=None):
+        self.session_maker = session_maker
+        self.read_session_maker = read_session_maker
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with self.session_maker() as session:
+            data['session'] = session
+            if self.read_session_maker is None:
+                data['read_session'] = session
+                return await handler(event, data)
+            async with self.read_session_maker() as read_session:
+                data['read_session'] = read_session
+                return await handler(event, data)
+
+# ========================
+# СОХРАНЕНИЕ СОСТОЯНИЙ FSM
+# ========================
+class FSMFlushMiddleware(BaseMiddleware):
+    """
+    Запись изменений FSM одним запросом после обработки обновления
+    (регистрируется до FSMContextMiddleware, чтобы учесть и чтение состояния)
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        token = self.storage.track_update()
+        try:
+            return await handler(event, data)
+        finally:
+            await self.storage.flush_update(token)
+
+# ========================
+# МЕТРИКИ
+# ========================
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Время обработки обновления и количество/время запросов к БД за обновление"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        event_type = event.event_type if isinstance(event, Update) else type(event).__name__
+        usage = [0, 0.0]
+        token = metrics.current_db_usage.set(usage)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.update_seconds.observe(time.perf_counter() - started, event_type)
+            metrics.update_db_queries.observe(usage[0], event_type)
+            metrics.update_db_seconds.observe(usage[1], event_type)
+            metrics.current_db_usage.reset(token)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время выполнения и ошибки конкретного обработчика"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if get_flag(data, 'callback_table'):
+            # Обработчик выбирает CallbackTable, он же и замеряет время
+            return await handler(event, data)
+        with metrics.observe_handler(data['handler'].callback.__name__):
+            return await handler(event, data)
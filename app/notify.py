@@ -0,0 +1,55 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiogram import Bot
+from app.ratelimit import TokenBucket
+from collections import OrderedDict
+from os import getenv
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+# Лимиты Telegram: ~30 сообщений в секунду всего и ~1 в секунду в один чат
+NOTIFY_GLOBAL_RATE = float(getenv('NOTIFY_GLOBAL_RATE', '30'))
+NOTIFY_CHAT_RATE = float(getenv('NOTIFY_CHAT_RATE', '1'))
+
+# ========================
+# СЕРВИС УВЕДОМЛЕНИЙ
+# ========================
+class Notifier:
+    """
+    Соблюдение лимитов Telegram при отправке (общий и поканальный token bucket).
+    Повторы и порядок доставки ведет app.outbox
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        # chat_id -> TokenBucket (LRU)
+        self.chat_buckets = OrderedDict()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        """Лимитер для конкретного чата"""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            self._evict_idle()
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _evict_idle(self) -> None:
+        """Удаление давно не использованных лимитеров: с полным запасом он не отличается от нового"""
+        while self.chat_buckets:
+            chat_id, bucket = next(iter(self.chat_buckets.items()))
+            if not bucket.full:
+                break
+            del self.chat_buckets[chat_id]
+
+    async def try_send(self, bot: Bot, chat_id: int, text: str, **kwargs) -> None:
+        """Одна попытка отправки с учетом лимитов (ошибки Telegram пробрасываются)"""
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+        await bot.send_message(chat_id, text, **kwargs)
+
+notifier = Notifier(NOTIFY_GLOBAL_RATE, NOTIFY_CHAT_RATE)
@@ -0,0 +1,143 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramNetworkError,
+    TelegramServerError,
+    TelegramAPIError
+)
+from app.database import requests as rq
+from app.metrics import registry
+from app.notify import notifier
+from os import getenv
+import asyncio
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+OUTBOX_BATCH_SIZE = int(getenv('OUTBOX_BATCH_SIZE', '100'))
+# Пауза между проходами, когда отправлять нечего
+OUTBOX_POLL_INTERVAL = float(getenv('OUTBOX_POLL_INTERVAL', '0.5'))
+OUTBOX_MAX_ATTEMPTS = int(getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+# Пауза перед повтором: OUTBOX_BACKOFF * 2^(попытка - 1), но не больше OUTBOX_MAX_BACKOFF
+OUTBOX_BACKOFF = float(getenv('OUTBOX_BACKOFF', '1'))
+OUTBOX_MAX_BACKOFF = float(getenv('OUTBOX_MAX_BACKOFF', '600'))
+# Сообщений в один чат за проход: при лимите ~1/с в чат занятый чат не задерживает остальные
+OUTBOX_CHAT_LIMIT = int(getenv('OUTBOX_CHAT_LIMIT', '3'))
+
+outbox_depth = registry.gauge('bot_outbox_depth', 'Messages waiting in the outbox')
+outbox_lag = registry.gauge('bot_outbox_lag_seconds', 'Age of the oldest message waiting in the outbox')
+outbox_sent = registry.counter('bot_outbox_messages_total', 'Outbox delivery results', ['result'])
+
+# ========================
+# ОТПРАВКА ИЗ OUTBOX
+# ========================
+class OutboxDispatcher:
+    """
+    Фоновая отправка сообщений из таблицы outbox:
+    - Сообщения берутся пачками; чаты обслуживаются параллельно, внутри чата - строго по порядку
+    - За проход в чат уходит не больше chat_limit сообщений, остальные сразу возвращаются в очередь
+    - После временной ошибки неотправленные сообщения чата возвращаются в очередь
+      со временем повтора первого из них (порядок сохраняется)
+    - Лимиты Telegram соблюдаются через общий notifier
+    - Сетевые ошибки и ошибки сервера - повтор с экспоненциальной паузой (до OUTBOX_MAX_ATTEMPTS),
+      RetryAfter - повтор через указанное время без траты попытки
+    - Отклоненные Telegram сообщения (бот заблокирован и т.п.) помечаются failed
+    - Доставка "хотя бы один раз": при падении между отправкой и записью итога сообщение уйдет повторно
+    """
+
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, interval: float = OUTBOX_POLL_INTERVAL, chat_limit: int = OUTBOX_CHAT_LIMIT):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.chat_limit = chat_limit
+        self._task = None
+        self._stop = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, bot: Bot) -> None:
+        """Запуск фоновой отправки"""
+        if not self.running:
+            self._stop.clear()
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def _send_chat(self, bot: Bot, messages, result: dict) -> None:
+        """Отправка сообщений одного чата по порядку (после первой временной ошибки - стоп до повтора)"""
+        for index, message in enumerate(messages):
+            try:
+                await notifier.try_send(bot, message.chat_id, message.text)
+            except TelegramRetryAfter as e:
+                retry_at = datetime.datetime.now() + datetime.timedelta(seconds=e.retry_after)
+                result['retries'].append((message.id, message.attempts, retry_at, str(e)))
+                result['released'].extend((later.id, retry_at) for later in messages[index + 1:])
+                outbox_sent.inc('retry')
+                return
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempts = message.attempts + 1
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    logger.error('Outbox message %s dropped after %s attempts: %s', message.id, attempts, e)
+                    result['failed'].append((message.id, str(e)))
+                    outbox_sent.inc('failed')
+                    continue
+                delay = min(OUTBOX_BACKOFF * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF)
+                retry_at = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+                result['retries'].append((message.id, attempts, retry_at, str(e)))
+                result['released'].extend((later.id, retry_at) for later in messages[index + 1:])
+                outbox_sent.inc('retry')
+                return
+            except TelegramAPIError as e:
+                logger.error('Outbox message %s to chat %s rejected: %s', message.id, message.chat_id, e)
+                result['failed'].append((message.id, str(e)))
+                outbox_sent.inc('failed')
+                continue
+            result['sent'].append(message.id)
+            outbox_sent.inc('sent')
+
+    async def dispatch_once(self, bot: Bot) -> int:
+        """Один проход: пачка сообщений, отправка и запись итога (со снятием закрепления) одной транзакцией"""
+        messages = await rq.get_outbox_batch(self.batch_size)
+        if messages:
+            by_chat = {}
+            for message in messages:
+                by_chat.setdefault(message.chat_id, []).append(message)
+            result = {'sent': [], 'retries': [], 'failed': [], 'released': []}
+            now = datetime.datetime.now()
+            for chat in by_chat.values():
+                result['released'].extend((message.id, now) for message in chat[self.chat_limit:])
+            await asyncio.gather(*(self._send_chat(bot, chat[:self.chat_limit], result) for chat in by_chat.values()))
+            await rq.finish_outbox(result['sent'], result['retries'], result['failed'], result['released'])
+
+        depth, oldest = await rq.get_outbox_stats()
+        outbox_depth.set(depth)
+        outbox_lag.set((datetime.datetime.now() - oldest).total_seconds() if oldest else 0)
+        return len(messages)
+
+    async def _run(self, bot: Bot) -> None:
+        while not self._stop.is_set():
+            try:
+                count = await self.dispatch_once(bot)
+            except Exception:
+                logger.exception('Outbox dispatch failed')
+                count = 0
+            # Полная пачка - сразу следующая, иначе ждем новых сообщений
+            if count < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def close(self) -> None:
+        """Остановка после текущего прохода (итог отправленного успевает записаться)"""
+        if self.running:
+            self._stop.set()
+            await self._task
+
+outbox = OutboxDispatcher()
@@ -0,0 +1,46 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+import asyncio
+import time
+
+# ========================
+# TOKEN BUCKET
+# ========================
+class TokenBucket:
+    """
+    Ограничитель частоты "token bucket":
+    - rate - скорость пополнения (токенов в секунду)
+    - capacity - максимальный запас токенов (допустимый всплеск)
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        """Пополнение токенов за прошедшее время"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    @property
+    def full(self) -> bool:
+        """Запас восстановлен полностью (ограничитель простаивает)"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Попытка взять токены без ожидания"""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """Ожидание и получение токенов"""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
@@ -0,0 +1,157 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiogram.types import Update
+from app import metrics
+from app.callbacks import BuyCallback
+from app.handlers import get_admins
+from app.keyboards import main as main_menu
+from collections import deque
+from os import getenv
+import asyncio
+import time
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+# Веса классов: при конкуренции за слоты на одно обновление каталога приходится
+# до 4 оформлений заказа и до 8 админских
+SCHEDULER_WEIGHTS = getenv('SCHEDULER_WEIGHTS', 'admin=8,checkout=4,browsing=1')
+# Обновление, ждущее дольше, обслуживается вне очереди (защита от голодания)
+SCHEDULER_MAX_DELAY = float(getenv('SCHEDULER_MAX_DELAY', '2'))
+
+def parse_weights(value: str) -> dict:
+    """'admin=8,checkout=4' -> {'admin': 8, 'checkout': 4} (порядок = приоритет)"""
+    weights = {}
+    for pair in value.split(','):
+        name, _, weight = pair.partition('=')
+        if name.strip():
+            weights[name.strip()] = max(int(weight or 1), 1)
+    return weights
+
+# ========================
+# КЛАССИФИКАЦИЯ ОБНОВЛЕНИЙ
+# ========================
+CHECKOUT_CALLBACKS = ('buy_payment', f'{BuyCallback.__prefix__}:')
+# Кнопки главного меню - навигация; прочий текст без команды бот принимает только
+# как ответ в форме (ФИО, вариант работы, вопрос)
+MENU_TEXTS = {button.text for row in main_menu.keyboard for button in row}
+
+def classify_update(event: Update, data: dict) -> str:
+    """
+    Класс обновления: admin, checkout (оформление заказа и ввод в форму) или browsing.
+    Определяется только по самому обновлению, без чтения состояния FSM:
+    планировщик работает до FSM и сессии БД
+    """
+    user = data.get('event_from_user')
+    if user is not None and user.id in get_admins():
+        return 'admin'
+    if event.callback_query and (event.callback_query.data or '').startswith(CHECKOUT_CALLBACKS):
+        return 'checkout'
+    text = event.message.text if event.message else None
+    if text and not text.startswith('/') and text not in MENU_TEXTS:
+        return 'checkout'
+    return 'browsing'
+
+# ========================
+# ПЛАНИРОВЩИК
+# ========================
+queue_delay = metrics.registry.histogram('bot_scheduler_queue_delay_seconds', 'Time an update waited for a slot', ['class'])
+queue_depth = metrics.registry.gauge('bot_scheduler_queue_depth', 'Updates waiting for a slot', ['class'])
+
+class UpdateScheduler:
+    """
+    Выдача слотов обработки по классам обновлений:
+    - Пока есть свободные слоты, обновления проходят сразу
+    - Иначе ждут в очереди своего класса; освободившийся слот достается
+      по взвешенному кругу (weighted round robin) между непустыми очередями
+    - Ожидающий дольше max_delay получает слот первым, независимо от класса
+    """
+
+    def __init__(self, limit: int, weights: dict = None, max_delay: float = SCHEDULER_MAX_DELAY):
+        self.weights = weights or parse_weights(SCHEDULER_WEIGHTS)
+        self.free = limit
+        self.max_delay = max_delay
+        # класс -> очередь (время постановки, future)
+        self.queues = {name: deque() for name in self.weights}
+        self.credits = dict(self.weights)
+        self.waiting = 0
+
+    def _set_depth(self, name: str) -> None:
+        queue_depth.set(len(self.queues[name]), name)
+
+    async def acquire(self, name: str, timeout: float = None) -> None:
+        """Получение слота (TimeoutError, если не дождались за timeout секунд)"""
+        if name not in self.queues:
+            name = next(reversed(self.queues))
+        if self.free > 0 and not self.waiting:
+            self.free -= 1
+            queue_delay.observe(0, name)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        queued_at = time.monotonic()
+        self.queues[name].append((queued_at, future))
+        self.waiting += 1
+        self._set_depth(name)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if future.done() and not future.cancelled():
+                # Слот уже был выдан - возвращаем его следующему
+                self.release()
+            raise
+        finally:
+            queue_delay.observe(time.monotonic() - queued_at, name)
+
+    def _pop(self, name: str):
+        """Первый еще ожидающий в очереди класса"""
+        queue = self.queues[name]
+        while queue:
+            queued_at, future = queue.popleft()
+            self.waiting -= 1
+            if not future.done():
+                self._set_depth(name)
+                return future
+        self._set_depth(name)
+        return None
+
+    def _drop_cancelled(self, name: str) -> None:
+        """Снятие с головы очереди тех, кто перестал ждать (таймаут)"""
+        queue = self.queues[name]
+        while queue and queue[0][1].done():
+            queue.popleft()
+            self.waiting -= 1
+        self._set_depth(name)
+
+    def _next(self):
+        """Выбор следующего ожидающего"""
+        for name in self.queues:
+            self._drop_cancelled(name)
+        heads = [(queue[0][0], name) for name, queue in self.queues.items() if queue]
+        if not heads:
+            return None
+
+        oldest_at, oldest = min(heads)
+        if time.monotonic() - oldest_at >= self.max_delay:
+            return self._pop(oldest)
+
+        for _ in range(2):
+            for name, queue in self.queues.items():
+                if queue and self.credits[name] > 0:
+                    self.credits[name] -= 1
+                    return self._pop(name)
+            # Все непустые классы исчерпали кредиты - новый круг
+            self.credits = dict(self.weights)
+        return None
+
+    def release(self) -> None:
+        """Освобождение слота: передается следующему ожидающему или возвращается в пул"""
+        while True:
+            future = self._next()
+            if future is None:
+                self.free += 1
+                return
+            if not future.done():
+                future.set_result(None)
+                return
@@ -0,0 +1,137 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from app.database import requests as rq
+from collections import OrderedDict
+from os import getenv
+import bisect
+import re
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+SEARCH_LIMIT = int(getenv('SEARCH_LIMIT', '50'))
+SEARCH_CACHE_SIZE = int(getenv('SEARCH_CACHE_SIZE', '10000'))
+# Сколько секунд Telegram может кэшировать ответ на inline-запрос
+SEARCH_INLINE_CACHE_TIME = int(getenv('SEARCH_INLINE_CACHE_TIME', '300'))
+
+_TOKEN_RE = re.compile(r'\w+')
+
+def tokenize(text: str) -> list:
+    """Разбиение текста на слова в нижнем регистре"""
+    return _TOKEN_RE.findall((text or '').lower().replace('ё', 'е'))
+
+# ========================
+# ИНДЕКС ПОИСКА
+# ========================
+class SearchIndex:
+    """
+    Обратный индекс по названию и описанию товаров:
+    - слово -> ID товаров, плюс отсортированный список слов для поиска по префиксу
+    - При смене версии каталога перестраивается только для измененных товаров
+    - Результаты запросов кэшируются (LRU) до следующего изменения каталога
+    """
+
+    def __init__(self, cache_size: int = SEARCH_CACHE_SIZE):
+        self.version = None
+        self.postings = {}
+        self.tokens = []
+        self.item_tokens = {}
+        self.item_texts = {}
+        self.cache_size = cache_size
+        self._results = OrderedDict()
+
+    def _add(self, item) -> None:
+        """Добавление товара в индекс"""
+        name_tokens = set(tokenize(item.name))
+        tokens = name_tokens | set(tokenize(item.description))
+        self.item_tokens[item.id] = (tokens, name_tokens)
+        self.item_texts[item.id] = (item.name, item.description)
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = set()
+                bisect.insort(self.tokens, token)
+            posting.add(item.id)
+
+    def _remove(self, item_id: int) -> None:
+        """Удаление товара из индекса"""
+        tokens, _ = self.item_tokens.pop(item_id)
+        self.item_texts.pop(item_id)
+        for token in tokens:
+            posting = self.postings[token]
+            posting.discard(item_id)
+            if not posting:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+
+    def sync(self, catalog) -> None:
+        """Приведение индекса к текущей версии кэша каталога"""
+        if self.version == catalog.version:
+            return
+        items = catalog.items_by_id
+        for item_id in [item_id for item_id in self.item_texts if item_id not in items]:
+            self._remove(item_id)
+        for item in items.values():
+            text = self.item_texts.get(item.id)
+            if text == (item.name, item.description):
+                continue
+            if text is not None:
+                self._remove(item.id)
+            self._add(item)
+        self.version = catalog.version
+        self._results.clear()
+
+    def _prefix_matches(self, prefix: str) -> set:
+        """ID товаров со словами, начинающимися с prefix"""
+        matches = set()
+        start = bisect.bisect_left(self.tokens, prefix)
+        for token in self.tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            matches |= self.postings[token]
+        return matches
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> list:
+        """ID товаров, в которых есть все слова запроса (по префиксу)"""
+        key = (' '.join(tokenize(query)), limit)
+        cached = self._results.get(key)
+        if cached is not None:
+            self._results.move_to_end(key)
+            return cached
+
+        query_tokens = key[0].split()
+        found = None
+        for token in query_tokens:
+            matches = self._prefix_matches(token)
+            found = matches if found is None else found & matches
+            if not found:
+                break
+        # Сначала товары, у которых совпало название
+        result = sorted(
+            found or (),
+            key=lambda item_id: (
+                not all(any(t.startswith(q) for t in self.item_tokens[item_id][1]) for q in query_tokens),
+                item_id
+            )
+        )[:limit]
+
+        self._results[key] = result
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return result
+
+index = SearchIndex()
+
+# ========================
+# ПОИСК ТОВАРОВ
+# ========================
+async def search_items(query: str, limit: int = SEARCH_LIMIT, session=None) -> list:
+    """Поиск товаров: по индексу в памяти или полнотекстовым запросом к БД"""
+    if not tokenize(query):
+        return []
+    if rq.catalog.ttl <= 0:
+        return await rq.search_items_db(query, limit, session=session)
+    cache = await rq.catalog.load()
+    index.sync(cache)
+    return [cache.items_by_id[item_id] for item_id in index.search(query, limit)]
@@ -0,0 +1,258 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web, ClientSession, ClientTimeout, ClientError
+from app.metrics import registry
+from os import getenv
+import asyncio
+import logging
+import multiprocessing
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+# ========================
+# НАСТРОЙКИ
+# ========================
+# Количество процессов-воркеров (1 - обычный запуск в одном процессе)
+WORKERS = int(getenv('WORKERS', '1'))
+WORKER_QUEUE_SIZE = int(getenv('WORKER_QUEUE_SIZE', '10000'))
+# Сколько обновлений воркер обрабатывает одновременно; остальные ждут в его очереди
+WORKER_MAX_IN_FLIGHT = int(getenv('WORKER_MAX_IN_FLIGHT', '500'))
+WORKER_HEARTBEAT = float(getenv('WORKER_HEARTBEAT', '2'))
+# Воркер без отметки дольше этого времени считается зависшим и перезапускается
+WORKER_HEARTBEAT_TIMEOUT = float(getenv('WORKER_HEARTBEAT_TIMEOUT', '30'))
+# Время на запуск воркера (импорт, подключение к БД) до первой отметки
+WORKER_START_TIMEOUT = float(getenv('WORKER_START_TIMEOUT', '60'))
+HEALTH_HOST = getenv('HEALTH_HOST', '127.0.0.1')
+HEALTH_PORT = int(getenv('HEALTH_PORT', '8081') or 0)
+POLLING_TIMEOUT = int(getenv('POLLING_TIMEOUT', '30'))
+
+TELEGRAM_API_URL = 'https://api.telegram.org/bot{token}/{method}'
+
+# ========================
+# ШАРДИРОВАНИЕ ОБНОВЛЕНИЙ
+# ========================
+def shard_key(update: dict) -> int:
+    """ID пользователя (или чата) обновления - по нему выбирается воркер"""
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return update.get('update_id', 0)
+
+# ========================
+# ПУЛ ВОРКЕРОВ
+# ========================
+class WorkerPool:
+    """
+    Процессы-воркеры с очередями обновлений:
+    - Обновления одного пользователя всегда попадают в один воркер (FSM не разъезжается)
+    - Воркер раз в WORKER_HEARTBEAT секунд отмечается в общей памяти
+    - Упавший или зависший воркер перезапускается с новой очередью: процесс,
+      убитый во время чтения, может оставить блокировку старой очереди занятой
+      (его необработанные обновления при этом теряются)
+    """
+
+    def __init__(self, target, count: int = WORKERS, queue_size: int = WORKER_QUEUE_SIZE):
+        self.target = target
+        self.count = count
+        self.context = multiprocessing.get_context('spawn')
+        self.queue_size = queue_size
+        self.queues = [self.context.Queue(queue_size) for _ in range(count)]
+        self.heartbeats = [self.context.Value('d', 0.0) for _ in range(count)]
+        self.processes = [None] * count
+        self.started_at = [0.0] * count
+        self.restarts = registry.counter('bot_worker_restarts_total', 'Worker process restarts', ['worker'])
+        registry.gauge('bot_workers_alive', 'Alive worker processes', function=self.alive_count)
+
+    def _spawn(self, index: int) -> None:
+        """Запуск процесса-воркера"""
+        self.heartbeats[index].value = 0.0
+        self.started_at[index] = time.time()
+        process = self.context.Process(
+            target=self.target,
+            args=(index, self.count, self.queues[index], self.heartbeats[index]),
+            name=f'bot-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info('Worker %s started (pid %s)', index, process.pid)
+
+    def start(self) -> None:
+        for index in range(self.count):
+            self._spawn(index)
+
+    def alive_count(self) -> int:
+        return sum(1 for process in self.processes if process is not None and process.is_alive())
+
+    async def dispatch(self, update: dict) -> None:
+        """Передача обновления воркеру пользователя (при полной очереди - ждем)"""
+        updates = self.queues[hash(shard_key(update)) % self.count]
+        while True:
+            try:
+                updates.put_nowait(update)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.05)
+
+    def _is_hung(self, index: int) -> bool:
+        """Воркер давно не отмечался (до первой отметки действует WORKER_START_TIMEOUT)"""
+        heartbeat = self.heartbeats[index].value
+        if heartbeat:
+            return time.time() - heartbeat > WORKER_HEARTBEAT_TIMEOUT
+        return time.time() - self.started_at[index] > WORKER_START_TIMEOUT
+
+    async def supervise(self) -> None:
+        """Проверка воркеров и перезапуск упавших или зависших"""
+        while True:
+            await asyncio.sleep(WORKER_HEARTBEAT)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logger.error('Worker %s exited with code %s, restarting', index, process.exitcode)
+                elif self._is_hung(index):
+                    logger.error('Worker %s missed heartbeats, restarting', index)
+                    process.kill()
+                    await asyncio.to_thread(process.join, 5)
+                else:
+                    continue
+                self.restarts.inc(str(index))
+                self.queues[index] = self.context.Queue(self.queue_size)
+                self._spawn(index)
+
+    def status(self) -> list:
+        """Состояние воркеров для /health"""
+        now = time.time()
+        return [
+            {
+                'worker': index,
+                'pid': process.pid,
+                'alive': process.is_alive() and not self._is_hung(index),
+                'starting': not self.heartbeats[index].value,
+                'heartbeat_age': round(now - (self.heartbeats[index].value or self.started_at[index]), 3)
+            }
+            for index, process in enumerate(self.processes)
+        ]
+
+    async def stop(self, timeout: float = 30) -> None:
+        """Остановка: воркеры дорабатывают очередь и выполняют shutdown"""
+        for updates in self.queues:
+            updates.put(None)
+        for index, process in enumerate(self.processes):
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logger.warning('Worker %s did not stop in time, killing', index)
+                process.kill()
+
+# ========================
+# ПРИЕМ ОБНОВЛЕНИЙ (ФРОНТ)
+# ========================
+async def health_handler(request: web.Request) -> web.Response:
+    """Состояние воркеров: 200, если все живы, иначе 503"""
+    pool = request.app['pool']
+    workers = pool.status()
+    healthy = all(worker['alive'] for worker in workers)
+    return web.json_response({'healthy': healthy, 'workers': workers}, status=200 if healthy else 503)
+
+def create_front_app(pool: WorkerPool) -> web.Application:
+    """aiohttp-приложение фронта с эндпоинтом /health"""
+    app = web.Application()
+    app['pool'] = pool
+    app.router.add_get('/health', health_handler)
+    return app
+
+async def poll_updates(pool: WorkerPool, token: str) -> None:
+    """
+    Long polling без разбора обновлений: фронт только читает JSON
+    и раскладывает его по воркерам
+    """
+    url = TELEGRAM_API_URL.format(token=token, method='getUpdates')
+    offset = None
+    backoff = 1
+    async with ClientSession(timeout=ClientTimeout(total=POLLING_TIMEOUT + 10)) as http:
+        while True:
+            try:
+                params = {'timeout': POLLING_TIMEOUT}
+                if offset is not None:
+                    params['offset'] = offset
+                async with http.get(url, params=params) as response:
+                    payload = await response.json()
+                if not payload.get('ok'):
+                    raise ClientError(payload.get('description'))
+            except (ClientError, asyncio.TimeoutError) as e:
+                logger.warning('getUpdates failed: %s, retrying in %s s', e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            backoff = 1
+            for update in payload['result']:
+                await pool.dispatch(update)
+                offset = update['update_id'] + 1
+
+def add_webhook_route(app: web.Application, pool: WorkerPool, path: str, secret: str = None) -> None:
+    """Прием webhook фронтом: проверка секрета и передача JSON воркеру"""
+    async def webhook_handler(request: web.Request) -> web.Response:
+        if secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+            return web.Response(status=401)
+        await pool.dispatch(await request.json())
+        return web.Response()
+
+    app.router.add_post(path, webhook_handler)
+
+# ========================
+# ОБРАБОТКА В ВОРКЕРЕ
+# ========================
+async def _heartbeat(heartbeat) -> None:
+    """Отметка о том, что цикл событий воркера не завис"""
+    while True:
+        heartbeat.value = time.time()
+        await asyncio.sleep(WORKER_HEARTBEAT)
+
+async def _process_update(dp: Dispatcher, bot: Bot, update: Update) -> None:
+    try:
+        await dp.feed_update(bot, update)
+    except Exception:
+        logger.exception('Update %s failed', update.update_id)
+
+async def serve_updates(dp: Dispatcher, bot: Bot, updates, heartbeat, batch_size: int = 100, max_in_flight: int = WORKER_MAX_IN_FLIGHT) -> None:
+    """
+    Чтение обновлений из очереди воркера и обработка через feed_update.
+    Следующее обновление берется из очереди, только когда обрабатывается меньше
+    max_in_flight: при перегрузке обновления копятся в ограниченной очереди, а не в памяти задачами
+    """
+    loop = asyncio.get_running_loop()
+    beat = asyncio.create_task(_heartbeat(heartbeat))
+    slots = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+    stopping = False
+    while not stopping:
+        await slots.acquire()
+        batch = [await loop.run_in_executor(None, updates.get)]
+        while len(batch) < batch_size and not slots.locked():
+            try:
+                raw = updates.get_nowait()
+            except queue.Empty:
+                break
+            await slots.acquire()
+            batch.append(raw)
+        for raw in batch:
+            if raw is None:
+                stopping = True
+                break
+            update = Update.model_validate(raw, context={'bot': bot})
+            task = asyncio.create_task(_process_update(dp, bot, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: slots.release())
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    beat.cancel()
@@ -0,0 +1,343 @@
+# ========================
+# БЕНЧМАРК ОБРАБОТЧИКОВ
+# ========================
+# Прогоняет синтетические обновления через настоящий роутер (Dispatcher.feed_update)
+# с заглушкой Telegram API и локальной БД, печатает пропускную способность и
+# p50/p95/p99 по каждому обработчику и сохраняет результат в JSON.
+#
+# Пример:
+#   python benchmarks/handlers_bench.py --items 2000 --orders 50000 --output bench.json
+#   python benchmarks/handlers_bench.py --compare bench.json
+# ========================
+# ИМПОРТЫ
+# ========================
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+ADMIN_ID = 1000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ========================
+# ЗАГЛУШКА TELEGRAM API
+# ========================
+def make_stub_session(latency: float):
+    """Сессия бота, которая не ходит в сеть, а записывает вызовы API"""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Message
+
+    class StubSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+            self.latency = latency
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls.append(type(method).__name__)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if method.__returning__ is Message:
+                return Message.model_validate({
+                    'message_id': len(self.calls),
+                    'date': datetime.datetime.now(),
+                    'chat': {'id': getattr(method, 'chat_id', 0) or 0, 'type': 'private'},
+                    'text': getattr(method, 'text', None),
+                    'photo': [{'file_id': 'stub', 'file_unique_id': 'stub', 'width': 1, 'height': 1}]
+                    if type(method).__name__ == 'SendPhoto' else None
+                }, context={'bot': bot})
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b''
+
+        async def close(self):
+            pass
+
+    return StubSession()
+
+# ========================
+# СИНТЕТИЧЕСКИЕ ОБНОВЛЕНИЯ
+# ========================
+_update_id = 0
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+def _message(user_id: int, text: str) -> dict:
+    global _update_id
+    _update_id += 1
+    return {
+        'message_id': _update_id,
+        'date': datetime.datetime.now(),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id),
+        'text': text
+    }
+
+def message_update(bot, user_id: int, text: str):
+    """Обновление с текстовым сообщением"""
+    from aiogram.types import Update
+    message = _message(user_id, text)
+    return Update.model_validate({'update_id': _update_id, 'message': message}, context={'bot': bot})
+
+def callback_update(bot, user_id: int, data: str, text: str = 'text'):
+    """Обновление с нажатием inline-кнопки"""
+    from aiogram.types import Update
+    message = _message(user_id, text)
+    return Update.model_validate({
+        'update_id': _update_id,
+        'callback_query': {
+            'id': str(_update_id),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'message': message,
+            'data': data
+        }
+    }, context={'bot': bot})
+
+# ========================
+# НАПОЛНЕНИЕ БД
+# ========================
+async def _insert_rows(session, model, rows) -> None:
+    """Вставка списка строк (пустой список executemany не принимает)"""
+    from sqlalchemy import insert
+
+    if rows:
+        await session.execute(insert(model), rows)
+
+async def seed(categories: int, items: int, orders: int, tickets: int):
+    """
+    Создание схемы и синтетического каталога, заказов и тикетов
+    (товары создаются только при наличии категорий, заказы - при наличии товаров)
+    """
+    from app.database.migrations import init_db
+    from app.database.models import async_session, Category, Item, Order, Ticket
+
+    if not categories:
+        items = 0
+    if not items:
+        orders = 0
+
+    await init_db()
+    async with async_session() as session:
+        await _insert_rows(session, Category, [
+            {'id': i, 'name': f'Предмет {i}'} for i in range(1, categories + 1)
+        ])
+        await _insert_rows(session, Item, [
+            {
+                'id': i,
+                'name': f'Работа {i}',
+                'description': f'Описание работы {i}',
+                'price': 100 + i % 900,
+                'category_id': 1 + i % categories
+            }
+            for i in range(1, items + 1)
+        ])
+        for start in range(0, orders, 5000):
+            await _insert_rows(session, Order, [
+                {
+                    'tg_id': 10_000 + i,
+                    'fio': f'Клиент {i}',
+                    'work_id': 1 + i % items,
+                    'variant': '0',
+                    'price': 100,
+                    'category_id': 1 + (i % items) % categories,
+                    'status': 'completed' if i % 3 else 'new',
+                    'created_at': datetime.datetime.now()
+                }
+                for i in range(start, min(start + 5000, orders))
+            ])
+        await _insert_rows(session, Ticket, [
+            {'tg_id': 10_000 + i, 'fio': f'Клиент {i}', 'description': 'Вопрос', 'status': 'not_completed'}
+            for i in range(tickets)
+        ])
+        await session.commit()
+
+# ========================
+# СЦЕНАРИИ
+# ========================
+def scenarios(bot, dp, args):
+    """Сценарии: имя обработчика -> (подготовка, построение обновления, выбор пользователя)"""
+    from aiogram.fsm.storage.base import StorageKey
+    from app.callbacks import CategoryCallback, ItemCallback, ItemsPageCallback
+
+    def user_id():
+        return random.randint(1, args.users)
+
+    # у каждого оформления заказа свой пользователь, чтобы параллельные прогоны не делили FSM
+    checkout_users = itertools.count(1_000_000)
+
+    def checkout_user_id():
+        return next(checkout_users)
+
+    async def no_prepare(uid):
+        pass
+
+    async def prepare_checkout(uid):
+        key = StorageKey(bot_id=bot.id, chat_id=uid, user_id=uid)
+        item_id = random.randint(1, args.items)
+        # те же данные, что сохраняет start_order (см. seed)
+        await dp.storage.set_data(key, {
+            'item_id': item_id,
+            'item_name': f'Работа {item_id}',
+            'item_price': 100 + item_id % 900,
+            'item_category': 1 + item_id % args.categories,
+            'fio': 'Иванов Иван',
+            'variant': '1',
+            'checkout_id': uuid.uuid4().hex
+        })
+
+    return {
+        'cmd_start': (no_prepare, lambda uid: message_update(bot, uid, '/start'), user_id),
+        'catalog': (no_prepare, lambda uid: message_update(bot, uid, 'Каталог'), user_id),
+        'category_items': (no_prepare, lambda uid: callback_update(
+            bot, uid, CategoryCallback(category_id=random.randint(1, args.categories)).pack()), user_id),
+        'items_page': (no_prepare, lambda uid: callback_update(
+            bot, uid, ItemsPageCallback(
+                category_id=random.randint(1, args.categories), cursor=random.randint(1, args.items // 2)
+            ).pack()), user_id),
+        'show_item': (no_prepare, lambda uid: callback_update(
+            bot, uid, ItemCallback(item_id=random.randint(1, args.items)).pack()), user_id),
+        'search': (no_prepare, lambda uid: message_update(
+            bot, uid, f'/search работа {random.randint(1, args.items)}'), user_id),
+        'confirm_order': (prepare_checkout, lambda uid: callback_update(bot, uid, 'buy_payment'), checkout_user_id),
+        'admin_orders': (no_prepare, lambda uid: message_update(bot, ADMIN_ID, '/orders'), user_id),
+        'admin_tickets': (no_prepare, lambda uid: message_update(bot, ADMIN_ID, '/tickets'), user_id),
+    }
+
+def percentile(values, q: float) -> float:
+    """Перцентиль (q от 0 до 100) в миллисекундах"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index] * 1000
+
+async def run_scenario(dp, bot, prepare, build, user_id, iterations: int, concurrency: int) -> dict:
+    """Прогон одного сценария с заданной параллельностью"""
+    latencies = []
+    counter = iter(range(iterations))
+
+    async def worker():
+        for _ in counter:
+            uid = user_id()
+            await prepare(uid)
+            update = build(uid)
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+
+    api_calls_before = len(bot.session.calls)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'iterations': iterations,
+        'throughput': iterations / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'api_calls_per_update': (len(bot.session.calls) - api_calls_before) / iterations
+    }
+
+# ========================
+# ЗАПУСК
+# ========================
+def git_commit() -> str:
+    """Текущий коммит репозитория (для сравнения результатов)"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def print_report(results: dict, baseline: dict = None):
+    """Таблица результатов (и разница с прошлым прогоном)"""
+    print(f"{'handler':<16}{'upd/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'api/upd':>9}")
+    for name, row in results.items():
+        line = (f"{name:<16}{row['throughput']:>10.1f}{row['p50_ms']:>10.2f}"
+                f"{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['api_calls_per_update']:>9.2f}")
+        previous = (baseline or {}).get(name)
+        if previous:
+            line += f"   p95 {row['p95_ms'] - previous['p95_ms']:+.2f} ms, upd/s {row['throughput'] - previous['throughput']:+.1f}"
+        print(line)
+
+async def main(args):
+    logging_level = os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    import logging
+    logging.basicConfig(level=getattr(logging, logging_level))
+
+    await seed(args.categories, args.items, args.orders, args.tickets)
+
+    from aiogram import Bot
+    from main import create_dispatcher
+
+    bot = Bot(token='42:BENCHMARK', session=make_stub_session(args.api_latency / 1000))
+    dp = create_dispatcher()
+    table = scenarios(bot, dp, args)
+    selected = args.handlers.split(',') if args.handlers else list(table)
+
+    results = {}
+    for name in selected:
+        prepare, build, user_id = table[name]
+        # прогрев (кэши, пул соединений)
+        await run_scenario(dp, bot, prepare, build, user_id, min(args.warmup, args.iterations), args.concurrency)
+        results[name] = await run_scenario(dp, bot, prepare, build, user_id, args.iterations, args.concurrency)
+    await dp.emit_shutdown(bot=bot)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'commit': git_commit(),
+                'created_at': datetime.datetime.now().isoformat(),
+                'params': vars(args),
+                'results': results
+            }, f, ensure_ascii=False, indent=2)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Бенчмарк обработчиков бота')
+    parser.add_argument('--db-url', help='БД для прогона (по умолчанию временный SQLite-файл)')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--tickets', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--api-latency', type=float, default=0, help='задержка заглушки Telegram API, мс')
+    parser.add_argument('--handlers', help='список сценариев через запятую')
+    parser.add_argument('--output', help='файл для сохранения результатов в JSON')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    # Окружение задается до импорта приложения: модули читают его при импорте
+    if not args.db_url:
+        args.db_url = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ['DB_URL'] = args.db_url
+    os.environ['ADMIN_ID'] = str(ADMIN_ID)
+    os.environ.setdefault('METRICS_PORT', '')
+    # Заглушка API не ограничивает частоту, лимиты рассылки только мешают замерам
+    os.environ.setdefault('NOTIFY_GLOBAL_RATE', '1000000')
+    os.environ.setdefault('NOTIFY_CHAT_RATE', '1000000')
+    # Все админские сценарии идут от одного пользователя - защита от флуда не нужна
+    os.environ.setdefault('USER_RATE', '0')
+    os.environ.setdefault('DUPLICATE_CALLBACK_WINDOW', '0')
+    sys.path.insert(0, ROOT)
+    asyncio.run(main(args))
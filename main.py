@@ -3,15 +3,150 @@
 # ========================
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
-from app.handlers import router
-from app.database.models import init_db
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from app.handlers import router, get_admins
+from app.database.migrations import init_db
+from app.database.models import async_session, async_read_session, read_engine, engine, warm_up_pools
+from app.database.storage import DBStorage, FSM_CACHE_TTL
+from app.database.batcher import writer, WRITE_BATCHING
+from app.database.archive import archiver
+from app.middlewares import (
+    ThrottlingMiddleware,
+    ConcurrencyLimitMiddleware,
+    FSMFlushMiddleware,
+    DbSessionMiddleware,
+    UpdateMetricsMiddleware,
+    HandlerMetricsMiddleware
+)
+from app.metrics import start_metrics_server, METRICS_PORT
+from app.outbox import outbox
+from app.workers import (
+    WorkerPool,
+    WORKERS,
+    HEALTH_HOST,
+    HEALTH_PORT,
+    create_front_app,
+    add_webhook_route,
+    poll_updates,
+    serve_updates
+)
+from app.media import registry as media_registry, MEDIA_WARMUP_CHAT_ID
 import asyncio
 import logging
+import signal
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
+# ========================
+# НАСТРОЙКИ ЗАПУСКА
+# ========================
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Хранилище состояний FSM: db (общее для всех процессов) или memory
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'db')
+
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+
+# ========================
+# РЕЖИМ WEBHOOK
+# ========================
+def check_webhook_config():
+    """Проверка настроек webhook до запуска (Telegram принимает только https-адрес)"""
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError('BOT_MODE=webhook requires WEBHOOK_BASE_URL (e.g. https://bot.example.com)')
+    if not WEBHOOK_BASE_URL.startswith('https://'):
+        raise RuntimeError(f'WEBHOOK_BASE_URL must be an https:// URL, got {WEBHOOK_BASE_URL!r}')
+
+async def set_webhook(bot: Bot):
+    """Регистрация адреса webhook в Telegram при старте"""
+    await bot.set_webhook(
+        f'{WEBHOOK_BASE_URL}{WEBHOOK_PATH}',
+        secret_token=WEBHOOK_SECRET
+    )
+
+async def start_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Запуск aiohttp-сервера для приема обновлений:
+    - Проверяет заголовок X-Telegram-Bot-Api-Secret-Token (если задан WEBHOOK_SECRET)
+    - Слушает WEBHOOK_HOST:WEBHOOK_PORT по пути WEBHOOK_PATH
+    """
+    dp.startup.register(set_webhook)
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logging.info('Webhook server started on %s:%s%s', WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+# ========================
+# ПРОГРЕВ МЕДИАФАЙЛОВ
+# ========================
+async def warm_up_media(bot: Bot):
+    """Загрузка фото в Telegram при старте, чтобы первый заказ не ждал скачивания URL"""
+    admins = get_admins()
+    chat_id = MEDIA_WARMUP_CHAT_ID or (admins[0] if admins else None)
+    if chat_id:
+        media_registry.start_warm_up(bot, chat_id)
+
+# ========================
+# ДИСПЕТЧЕР
+# ========================
+def create_dispatcher(fsm_cache_ttl: float = 0) -> Dispatcher:
+    """
+    Создание диспетчера с хранилищем FSM, middleware и роутером.
+    fsm_cache_ttl - кэш состояний между обновлениями (только для воркеров, см. DBStorage)
+    """
+    storage = DBStorage(cache_ttl=fsm_cache_ttl) if FSM_STORAGE == 'db' else MemoryStorage()
+    dp = Dispatcher(storage=storage)
+    # Порядок важен: встроенный FSMContextMiddleware (чтение состояния из хранилища)
+    # переставляется после ограничения частоты и нагрузки, чтобы лишние обновления
+    # отсекались до обращения к FSM и сессии БД
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(ThrottlingMiddleware())
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware())
+    if FSM_STORAGE == 'db':
+        dp.update.outer_middleware(FSMFlushMiddleware(storage))
+    dp.update.outer_middleware(dp.fsm)
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.update.outer_middleware(DbSessionMiddleware(
+        async_session,
+        async_read_session if read_engine is not engine else None
+    ))
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(HandlerMetricsMiddleware())
+    dp.include_router(router)
+    return dp
+
+async def start_services(dp: Dispatcher, metrics_port: int = METRICS_PORT):
+    """Прогрев пулов БД, сервер метрик и пакетная запись (останавливаются вместе с диспетчером)"""
+    await warm_up_pools()
+    if metrics_port:
+        metrics_runner = await start_metrics_server(port=metrics_port)
+        dp.shutdown.register(metrics_runner.cleanup)
+    if WRITE_BATCHING:
+        writer.start()
+        dp.shutdown.register(writer.close)
+
 # ========================
 # ОСНОВНАЯ ФУНКЦИЯ
 # ========================
@@ -20,19 +155,105 @@ async def main():
     Главная функция бота:
     - Инициализирует базу данных
     - Создает бота и диспетчер
-    - Запускает обработку сообщений
+    - Запускает обработку сообщений (polling или webhook)
     """
+    if BOT_MODE == 'webhook':
+        check_webhook_config()
     await init_db()
-    
+
     bot = Bot(token=os.getenv('BOT_TOKEN'))
-    dp = Dispatcher()
-    dp.include_router(router)
-    
-    await dp.start_polling(bot)
+    dp = create_dispatcher()
+    await start_services(dp)
+    archiver.start()
+    dp.shutdown.register(archiver.close)
+    outbox.start(bot)
+    dp.shutdown.register(outbox.close)
+    dp.startup.register(warm_up_media)
+
+    if BOT_MODE == 'webhook':
+        await start_webhook(dp, bot)
+    else:
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+
+# ========================
+# НЕСКОЛЬКО ПРОЦЕССОВ (WORKERS > 1)
+# ========================
+def run_worker(index: int, count: int, updates, heartbeat):
+    """Точка входа процесса-воркера (запускается WorkerPool)"""
+    # Останавливает воркеры фронт через очередь - Ctrl+C из терминала игнорируем
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(worker_main(index, count, updates, heartbeat))
+
+async def worker_main(index: int, count: int, updates, heartbeat):
+    """Диспетчер воркера: обновления приходят из очереди фронта"""
+    bot = Bot(token=os.getenv('BOT_TOKEN'))
+    # Обновления пользователя всегда приходят в этот воркер - состояния FSM можно кэшировать
+    dp = create_dispatcher(fsm_cache_ttl=FSM_CACHE_TTL)
+    # У каждого воркера свой порт метрик: METRICS_PORT + 1 + номер
+    await start_services(dp, METRICS_PORT + 1 + index if METRICS_PORT else 0)
+    await dp.emit_startup(bot=bot, bots=[bot], dispatcher=dp)
+    try:
+        await serve_updates(dp, bot, updates, heartbeat)
+    finally:
+        await dp.emit_shutdown(bot=bot, bots=[bot], dispatcher=dp)
+        await bot.session.close()
+
+async def run_launcher():
+    """
+    Фронт для нескольких воркеров:
+    - Получает обновления (polling или webhook) без их разбора
+    - Раскладывает по воркерам по ID пользователя
+    - Отдает /health и перезапускает упавшие воркеры
+    - Переносит старые заказы и тикеты в архив
+    - Отправляет сообщения из outbox
+    - Загружает медиафайлы в Telegram при старте
+    """
+    if BOT_MODE == 'webhook':
+        check_webhook_config()
+    await init_db()
+
+    pool = WorkerPool(run_worker, WORKERS)
+    pool.start()
+    bot = Bot(token=os.getenv('BOT_TOKEN'))
+    app = create_front_app(pool)
+    if BOT_MODE == 'webhook':
+        add_webhook_route(app, pool, WEBHOOK_PATH, WEBHOOK_SECRET)
+        await set_webhook(bot)
+        host, port = WEBHOOK_HOST, WEBHOOK_PORT
+    else:
+        await bot.delete_webhook()
+        host, port = HEALTH_HOST, HEALTH_PORT
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    if port:
+        await web.TCPSite(runner, host, port).start()
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
+    supervisor = asyncio.create_task(pool.supervise())
+    # Архивация, отправка из outbox и прогрев медиафайлов одни на все процессы - их ведет фронт
+    archiver.start()
+    outbox.start(bot)
+    await warm_up_media(bot)
+    try:
+        if BOT_MODE == 'webhook':
+            await asyncio.Event().wait()
+        else:
+            await poll_updates(pool, bot.token)
+    finally:
+        supervisor.cancel()
+        await archiver.close()
+        await outbox.close()
+        await pool.stop()
+        await runner.cleanup()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await bot.session.close()
 
 # ========================
 # ТОЧКА ВХОДА
 # ========================
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(run_launcher() if WORKERS > 1 else main())
@@ -0,0 +1,35 @@
+# ========================
+# ОБЩИЕ НАСТРОЙКИ ТЕСТОВ
+# ========================
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Модули app читают DB_URL при импорте - тесты работают с SQLite.
+# Файл, а не :memory: - у каждого соединения :memory: была бы своя пустая БД
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='bot-tests-'), 'bot.db')
+os.environ['DB_URL'] = f'sqlite+aiosqlite:///{DB_PATH}'
+os.environ.pop('DB_READ_URL', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ========================
+# ОБЩИЕ ФИКСТУРЫ
+# ========================
+@pytest.fixture
+def app_db():
+    """Пустая БД приложения (глобальный engine) со схемой из миграций и сброшенными кэшами"""
+    from app.database import requests as rq
+    from app.database.migrations import init_db
+    from app.database.models import engine
+
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+    rq.invalidate_catalog()
+    rq._known_users.clear()
+    rq.checkout_dedup.entries.clear()
+    asyncio.run(init_db())
+    yield
+    asyncio.run(engine.dispose())
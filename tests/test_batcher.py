@@ -0,0 +1,74 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from app.database.batcher import BatchWriter
+from app.database.models import async_session, Order
+import asyncio
+import pytest
+
+# ========================
+# ВСПОМОГАТЕЛЬНОЕ
+# ========================
+def make_order(checkout_key: str = None, tg_id: int = 1) -> Order:
+    return Order(tg_id=tg_id, fio='Иванов Иван', work_id=1, variant='A', price=100, category_id=1, checkout_key=checkout_key)
+
+async def saved_orders() -> dict:
+    async with async_session() as session:
+        return {order.id: (order.checkout_key, order.status) for order in await session.scalars(select(Order))}
+
+# ========================
+# ТЕСТЫ
+# ========================
+def test_batch_is_written_in_one_transaction(app_db):
+    async def scenario():
+        writer = BatchWriter(batch_size=10, window=0.05)
+        writer.start()
+        futures = [writer.insert(make_order(f'key-{index}')) for index in range(3)]
+        ids = await asyncio.gather(*futures)
+        await writer.update(Order, ids[0], status='done')
+        await writer.close()
+        return writer.stats, ids
+
+    stats, ids = asyncio.run(scenario())
+    assert len(set(ids)) == 3
+    assert stats['batches'] == 2 and stats['operations'] == 4 and stats['errors'] == 0
+    orders = asyncio.run(saved_orders())
+    assert orders[ids[0]] == ('key-0', 'done')
+    assert orders[ids[2]] == ('key-2', 'new')
+
+def test_failed_operation_does_not_fail_its_batch(app_db):
+    async def scenario():
+        writer = BatchWriter(batch_size=10, window=0.05)
+        writer.start()
+        await writer.insert(make_order('taken'))
+        # Вторая операция нарушает уникальность checkout_key - пакет повторяется по одной
+        futures = [writer.insert(make_order('first')), writer.insert(make_order('taken')), writer.insert(make_order('last'))]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        await writer.close()
+        return writer.stats, results
+
+    stats, (first, duplicate, last) = asyncio.run(scenario())
+    assert isinstance(first, int) and isinstance(last, int)
+    assert isinstance(duplicate, IntegrityError)
+    assert stats['errors'] == 1
+    keys = sorted(key for key, _ in asyncio.run(saved_orders()).values())
+    assert keys == ['first', 'last', 'taken']
+
+def test_submit_after_close_is_rejected(app_db):
+    async def scenario():
+        writer = BatchWriter(window=0.05)
+        writer.start()
+        pending = writer.insert(make_order('queued'))
+        closing = asyncio.create_task(writer.close())
+        await asyncio.sleep(0)
+        # Во время остановки писатель не принимает операции - вызывающие пишут напрямую
+        assert not writer.running
+        with pytest.raises(RuntimeError):
+            writer.insert(make_order('late'))
+        await closing
+        return await pending
+
+    order_id = asyncio.run(scenario())
+    assert asyncio.run(saved_orders()) == {order_id: ('queued', 'new')}
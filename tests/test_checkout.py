@@ -0,0 +1,76 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from sqlalchemy import select, func
+from app.database import requests as rq
+from app.database.batcher import writer
+from app.database.models import async_session, Order
+import asyncio
+import pytest
+
+ORDER = {'tg_id': 1, 'fio': 'Иванов Иван', 'work_id': 1, 'variant': 'A', 'price': 100, 'category_id': 1}
+
+# ========================
+# ВСПОМОГАТЕЛЬНОЕ
+# ========================
+async def orders_count() -> int:
+    async with async_session() as session:
+        return await session.scalar(select(func.count()).select_from(Order))
+
+# ========================
+# ТЕСТЫ
+# ========================
+def test_double_tap_creates_one_order(app_db):
+    async def scenario():
+        results = await asyncio.gather(*(rq.set_order_once('checkout-1', **ORDER) for _ in range(5)))
+        return results, await orders_count()
+
+    results, count = asyncio.run(scenario())
+    assert count == 1
+    assert len({order_id for order_id, _ in results}) == 1
+    assert [created for _, created in results].count(True) == 1
+
+def test_redelivery_after_restart_returns_existing_order(app_db):
+    async def scenario():
+        order_id, created = await rq.set_order_once('checkout-1', **ORDER)
+        # Рестарт процесса: кэш оформлений пуст, повтор упирается в уникальный индекс
+        rq.checkout_dedup.entries.clear()
+        return (order_id, created), await rq.set_order_once('checkout-1', **ORDER), await orders_count()
+
+    first, repeated, count = asyncio.run(scenario())
+    assert first[1] is True
+    assert repeated == (first[0], False)
+    assert count == 1
+
+def test_redelivery_with_batched_writes(app_db):
+    async def scenario():
+        writer.start()
+        try:
+            order_id, _ = await rq.set_order_once('checkout-1', **ORDER)
+            rq.checkout_dedup.entries.clear()
+            repeated = await rq.set_order_once('checkout-1', **ORDER)
+        finally:
+            await writer.close()
+        return order_id, repeated, await orders_count()
+
+    order_id, repeated, count = asyncio.run(scenario())
+    assert repeated == (order_id, False)
+    assert count == 1
+
+def test_failed_checkout_can_be_retried():
+    dedup = rq.CheckoutDedup()
+    calls = []
+
+    async def create():
+        calls.append(None)
+        if len(calls) == 1:
+            raise ConnectionError('db is down')
+        return 42, True
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await dedup.run('checkout-1', create)
+        return await dedup.run('checkout-1', create), await dedup.run('checkout-1', create)
+
+    assert asyncio.run(scenario()) == ((42, True), (42, False))
+    assert len(calls) == 2
@@ -0,0 +1,120 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError
+from aiogram.methods import SendMessage
+from sqlalchemy import select
+from app import outbox as outbox_module
+from app.database import requests as rq
+from app.database.models import async_session, OutboxMessage
+from app.outbox import OutboxDispatcher
+import asyncio
+import datetime
+import pytest
+
+# ========================
+# ВСПОМОГАТЕЛЬНОЕ
+# ========================
+class FakeNotifier:
+    """Отправка без лимитов и сети: запоминает отправленное, ошибки задаются по тексту"""
+
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+
+    async def try_send(self, bot, chat_id: int, text: str, **kwargs) -> None:
+        error = self.errors.pop(text, None)
+        if error is not None:
+            raise error
+        self.sent.append((chat_id, text))
+
+@pytest.fixture
+def notifier(monkeypatch):
+    fake = FakeNotifier()
+    monkeypatch.setattr(outbox_module, 'notifier', fake)
+    return fake
+
+async def enqueue(messages) -> None:
+    async with async_session() as session:
+        for statement in rq._outbox_insert(messages):
+            await session.execute(statement)
+        await session.commit()
+
+async def pending() -> dict:
+    """Ожидающие сообщения: текст -> (попытки, время следующей попытки)"""
+    async with async_session() as session:
+        messages = await session.scalars(select(OutboxMessage).where(OutboxMessage.status == 'pending'))
+        return {message.text: (message.attempts, message.next_attempt_at) for message in messages}
+
+def send_error(error_class, *args):
+    return error_class(SendMessage(chat_id=1, text='-'), 'error', *args)
+
+# ========================
+# ТЕСТЫ
+# ========================
+def test_claimed_messages_are_not_given_out_twice(app_db):
+    async def scenario():
+        await enqueue([(1, 'a'), (2, 'b')])
+        first = await rq.get_outbox_batch(10)
+        second = await rq.get_outbox_batch(10)
+        return [message.text for message in first], second
+
+    first, second = asyncio.run(scenario())
+    assert first == ['a', 'b']
+    assert second == []
+
+def test_sent_messages_are_deleted(app_db, notifier):
+    async def scenario():
+        await enqueue([(1, 'a'), (2, 'b'), (1, 'c')])
+        count = await OutboxDispatcher().dispatch_once(bot=None)
+        return count, await pending()
+
+    count, left = asyncio.run(scenario())
+    assert count == 3
+    assert left == {}
+    assert sorted(notifier.sent) == [(1, 'a'), (1, 'c'), (2, 'b')]
+
+def test_chat_limit_releases_the_rest_for_the_next_pass(app_db, notifier):
+    async def scenario():
+        await enqueue([(1, 'a1'), (1, 'a2'), (1, 'a3'), (1, 'a4'), (2, 'b1')])
+        dispatcher = OutboxDispatcher(chat_limit=2)
+        await dispatcher.dispatch_once(bot=None)
+        after_first = await pending()
+        await dispatcher.dispatch_once(bot=None)
+        return after_first, await pending()
+
+    after_first, after_second = asyncio.run(scenario())
+    # Неотправленные сразу доступны следующему проходу (закрепление снято)
+    assert set(after_first) == {'a3', 'a4'}
+    assert all(next_attempt_at <= datetime.datetime.now() for _, next_attempt_at in after_first.values())
+    assert after_second == {}
+    assert [text for chat_id, text in notifier.sent if chat_id == 1] == ['a1', 'a2', 'a3', 'a4']
+
+def test_retry_after_keeps_chat_order_and_attempts(app_db, notifier):
+    notifier.errors['a2'] = send_error(TelegramRetryAfter, 30)
+
+    async def scenario():
+        await enqueue([(1, 'a1'), (1, 'a2'), (1, 'a3'), (2, 'b1')])
+        await OutboxDispatcher().dispatch_once(bot=None)
+        return await pending(), await rq.get_outbox_batch(10)
+
+    left, ready = asyncio.run(scenario())
+    assert sorted(notifier.sent) == [(1, 'a1'), (2, 'b1')]
+    # RetryAfter не тратит попытку; a3 ждет вместе с a2, чтобы не обогнать его
+    assert left['a2'][0] == 0
+    assert left['a2'][1] == left['a3'][1] > datetime.datetime.now() + datetime.timedelta(seconds=20)
+    assert ready == []
+
+def test_network_error_counts_attempt_and_backs_off(app_db, notifier):
+    notifier.errors['a1'] = send_error(TelegramNetworkError)
+
+    async def scenario():
+        await enqueue([(1, 'a1'), (1, 'a2')])
+        await OutboxDispatcher().dispatch_once(bot=None)
+        return await pending()
+
+    left = asyncio.run(scenario())
+    assert notifier.sent == []
+    assert left['a1'][0] == 1
+    assert left['a1'][1] > datetime.datetime.now()
+    assert left['a2'][1] == left['a1'][1]
@@ -0,0 +1,87 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from app.database import requests as rq
+from app.database.models import async_session, Ticket, Category, Item
+import asyncio
+import pytest
+
+# ========================
+# ВСПОМОГАТЕЛЬНОЕ
+# ========================
+async def add_tickets(count: int, status: str = 'not_completed') -> None:
+    async with async_session() as session:
+        session.add_all(Ticket(tg_id=1, fio=f'user {index}', description='-', status=status) for index in range(count))
+        await session.commit()
+
+async def add_items(count: int) -> int:
+    """Категория с count товарами (и соседняя категория, чтобы проверить фильтр)"""
+    async with async_session() as session:
+        category, other = Category(name='Курсовые'), Category(name='Дипломы')
+        session.add_all([category, other])
+        await session.flush()
+        for index in range(count):
+            session.add(Item(name=f'item {index}', description='-', price=100, category_id=category.id))
+            session.add(Item(name=f'other {index}', description='-', price=100, category_id=other.id))
+        await session.commit()
+        return category.id
+
+def ids(rows) -> list:
+    return [row.id for row in rows]
+
+# ========================
+# ТЕСТЫ: СПИСКИ АДМИНИСТРАТОРА
+# ========================
+def test_admin_pages_walk_forward_and_back(app_db):
+    async def scenario():
+        await add_tickets(45)
+        first = await rq.get_tickets_page()
+        second = await rq.get_tickets_page(cursor=first[0][-1].id)
+        third = await rq.get_tickets_page(cursor=second[0][-1].id)
+        back = await rq.get_tickets_page(cursor=third[0][0].id, direction='prev')
+        return first, second, third, back
+
+    first, second, third, back = asyncio.run(scenario())
+    # Новые записи сверху, страницы по ADMIN_PAGE_SIZE
+    assert (ids(first[0]), first[1]) == (list(range(45, 25, -1)), True)
+    assert (ids(second[0]), second[1]) == (list(range(25, 5, -1)), True)
+    assert (ids(third[0]), third[1]) == ([5, 4, 3, 2, 1], False)
+    assert (ids(back[0]), back[1]) == (ids(second[0]), True)
+
+def test_admin_pages_filter_by_status(app_db):
+    async def scenario():
+        await add_tickets(3)
+        await add_tickets(2, status='completed')
+        return await rq.get_tickets_page('completed'), await rq.get_tickets_page(None)
+
+    completed, everything = asyncio.run(scenario())
+    assert (ids(completed[0]), completed[1]) == ([5, 4], False)
+    assert ids(everything[0]) == [5, 4, 3, 2, 1]
+
+# ========================
+# ТЕСТЫ: ТОВАРЫ КАТЕГОРИИ
+# ========================
+@pytest.mark.parametrize('cache_ttl', [0, 300], ids=['db', 'cache'])
+def test_item_pages_walk_forward_and_back(app_db, monkeypatch, cache_ttl):
+    monkeypatch.setattr(rq.catalog, 'ttl', cache_ttl)
+
+    async def scenario():
+        category_id = await add_items(25)
+        pages = [await rq.get_category_items_page(category_id, limit=10)]
+        for _ in range(2):
+            pages.append(await rq.get_category_items_page(category_id, cursor=pages[-1][0][-1].id, limit=10))
+        for _ in range(2):
+            pages.append(await rq.get_category_items_page(category_id, cursor=pages[-1][0][0].id, direction='prev', limit=10))
+        categories = {item.category_id for page, _ in pages for item in page}
+        return [(ids(page), has_more) for page, has_more in pages], categories == {category_id}
+
+    (first, second, third, back, start), same_category = asyncio.run(scenario())
+    assert same_category
+    item_ids = first[0] + second[0] + third[0]
+    # Товары по возрастанию ID, без товаров соседней категории и без повторов
+    assert item_ids == sorted(item_ids) and len(set(item_ids)) == 25
+    assert (len(first[0]), first[1]) == (10, True)
+    assert (len(second[0]), second[1]) == (10, True)
+    assert (len(third[0]), third[1]) == (5, False)
+    assert back == (second[0], True)
+    assert start == (first[0], False)
@@ -0,0 +1,176 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.database.models import make_engine, FSMRecord
+from app.database.storage import DBStorage
+import asyncio
+import pytest
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER_KEY = StorageKey(bot_id=1, chat_id=20, user_id=20)
+
+# ========================
+# ВСПОМОГАТЕЛЬНОЕ
+# ========================
+@pytest.fixture
+def db(tmp_path):
+    """Фабрика сессий с пустой таблицей fsm_storage в отдельном файле SQLite"""
+    engine = make_engine(f'sqlite+aiosqlite:///{tmp_path / "fsm.db"}')
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(FSMRecord.__table__.create)
+
+    asyncio.run(create())
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+async def handle_update(storage: DBStorage, action):
+    """Обработка одного обновления так, как это делает FSMFlushMiddleware"""
+    token = storage.track_update()
+    try:
+        return await action()
+    finally:
+        await storage.flush_update(token)
+
+async def saved_rows(session_maker) -> dict:
+    async with session_maker() as session:
+        return {record.key: (record.state, record.data) for record in await session.scalars(select(FSMRecord))}
+
+# ========================
+# ТЕСТЫ
+# ========================
+def test_state_and_data_round_trip(db):
+    async def scenario():
+        storage = DBStorage(session_maker=db)
+
+        async def write():
+            await storage.set_state(KEY, 'BuyerStates:fio')
+            await storage.set_data(KEY, {'item_id': 5})
+            await storage.update_data(KEY, {'fio': 'Иванов Иван'})
+            return await storage.get_state(KEY), await storage.get_data(KEY)
+
+        assert await handle_update(storage, write) == ('BuyerStates:fio', {'item_id': 5, 'fio': 'Иванов Иван'})
+
+        # Другой процесс (новое хранилище) видит сохраненное
+        fresh = DBStorage(session_maker=db)
+        assert await fresh.get_state(KEY) == 'BuyerStates:fio'
+        assert await fresh.get_data(KEY) == {'item_id': 5, 'fio': 'Иванов Иван'}
+
+    asyncio.run(scenario())
+
+def test_get_data_returns_copy(db):
+    async def scenario():
+        storage = DBStorage(session_maker=db)
+
+        async def write():
+            await storage.set_data(KEY, {'item_id': 5})
+            data = await storage.get_data(KEY)
+            data['item_id'] = 6
+            return await storage.get_data(KEY)
+
+        assert await handle_update(storage, write) == {'item_id': 5}
+
+    asyncio.run(scenario())
+
+def test_cleared_state_deletes_row(db):
+    async def scenario():
+        storage = DBStorage(session_maker=db)
+
+        async def write():
+            await storage.set_state(KEY, 'SupportStates:fio')
+            await storage.set_data(KEY, {'fio': 'Иванов'})
+
+        async def clear():
+            await storage.set_state(KEY, None)
+            await storage.set_data(KEY, {})
+
+        await handle_update(storage, write)
+        assert list(await saved_rows(db)) == [DBStorage._key(KEY)]
+        await handle_update(storage, clear)
+        assert await saved_rows(db) == {}
+
+    asyncio.run(scenario())
+
+def test_flush_update_writes_only_own_keys(db):
+    async def scenario():
+        storage = DBStorage(session_maker=db)
+        other_changed = asyncio.Event()
+        first_flushed = asyncio.Event()
+
+        async def first():
+            await other_changed.wait()
+            await storage.set_state(KEY, 'BuyerStates:fio')
+
+        async def second():
+            await storage.set_state(OTHER_KEY, 'BuyerStates:variant')
+            other_changed.set()
+            # Обновление еще обрабатывается, пока первое сохраняется
+            await first_flushed.wait()
+
+        async def run_first():
+            await handle_update(storage, first)
+            first_flushed.set()
+
+        second_task = asyncio.create_task(handle_update(storage, second))
+        await run_first()
+        assert await saved_rows(db) == {DBStorage._key(KEY): ('BuyerStates:fio', {})}
+
+        await second_task
+        assert (await saved_rows(db))[DBStorage._key(OTHER_KEY)] == ('BuyerStates:variant', {})
+
+    asyncio.run(scenario())
+
+def test_state_read_once_per_update(db):
+    async def scenario():
+        storage = DBStorage(session_maker=db)
+        reads = []
+        real_session_maker = storage.session_maker
+
+        def counting_session_maker():
+            reads.append(1)
+            return real_session_maker()
+
+        storage.session_maker = counting_session_maker
+
+        async def read():
+            await storage.get_state(KEY)
+            await storage.get_data(KEY)
+            await storage.get_state(KEY)
+
+        await handle_update(storage, read)
+        assert len(reads) == 1
+
+    asyncio.run(scenario())
+
+def test_no_cache_sees_changes_from_other_process(db):
+    async def scenario():
+        storage = DBStorage(session_maker=db)
+        other_process = DBStorage(session_maker=db)
+        await handle_update(storage, lambda: storage.get_state(KEY))
+
+        async def write():
+            await other_process.set_state(KEY, 'SupportStates:question')
+
+        await handle_update(other_process, write)
+        assert await handle_update(storage, lambda: storage.get_state(KEY)) == 'SupportStates:question'
+
+    asyncio.run(scenario())
+
+def test_cache_between_updates_when_enabled(db):
+    async def scenario():
+        storage = DBStorage(session_maker=db, cache_ttl=60)
+        other_process = DBStorage(session_maker=db)
+        await handle_update(storage, lambda: storage.get_state(KEY))
+
+        async def write():
+            await other_process.set_state(KEY, 'SupportStates:question')
+
+        await handle_update(other_process, write)
+        # Воркер с кэшем читает из памяти: допустимо, только пока ключ обслуживает один процесс
+        assert await handle_update(storage, lambda: storage.get_state(KEY)) is None
+
+    asyncio.run(scenario())
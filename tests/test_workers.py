@@ -0,0 +1,66 @@
+# ========================
+# ИМПОРТЫ
+# ========================
+from types import SimpleNamespace
+from app.workers import shard_key, serve_updates
+import asyncio
+import queue
+
+# ========================
+# ВСПОМОГАТЕЛЬНОЕ
+# ========================
+def message_update(update_id: int, user_id: int = 10) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Иван'},
+            'text': 'hi'
+        }
+    }
+
+class FakeDispatcher:
+    """feed_update, считающий одновременно обрабатываемые обновления"""
+
+    def __init__(self, fail_ids=()):
+        self.active = 0
+        self.max_active = 0
+        self.processed = []
+        self.fail_ids = set(fail_ids)
+
+    async def feed_update(self, bot, update) -> None:
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            if update.update_id in self.fail_ids:
+                raise RuntimeError('handler failed')
+            self.processed.append(update.update_id)
+        finally:
+            self.active -= 1
+
+# ========================
+# ТЕСТЫ
+# ========================
+def test_shard_key_uses_user_then_chat():
+    assert shard_key(message_update(1, user_id=42)) == 42
+    assert shard_key({'update_id': 2, 'callback_query': {'id': 'x', 'from': {'id': 7}}}) == 7
+    assert shard_key({'update_id': 3, 'channel_post': {'message_id': 1, 'chat': {'id': -100}}}) == -100
+    assert shard_key({'update_id': 4, 'poll': {'id': 'p'}}) == 4
+
+def test_user_updates_go_to_one_shard():
+    keys = {shard_key(message_update(update_id, user_id=42)) for update_id in range(20)}
+    assert keys == {42}
+
+def test_serve_updates_bounds_in_flight_and_survives_errors():
+    updates = queue.Queue()
+    for update_id in range(1, 21):
+        updates.put(message_update(update_id))
+    updates.put(None)
+    dp = FakeDispatcher(fail_ids={5})
+
+    asyncio.run(serve_updates(dp, None, updates, SimpleNamespace(value=0.0), batch_size=8, max_in_flight=3))
+    assert dp.max_active == 3
+    assert sorted(dp.processed) == [update_id for update_id in range(1, 21) if update_id != 5]